@@ -0,0 +1,71 @@
+"""
+Size and load time of a model stored as .joblib against the compact npz
+format (inclearn.compact), for the regression and classification models.
+
+The warm load is the best of many loads in this process; the cold load
+is a fresh interpreter importing what it needs and loading the file,
+which is what a cold predict container pays.
+
+  python benchmarks/bench_compact.py
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import warnings
+
+import benchutil
+from inclearn.artifacts import dump_model
+from inclearn.compact import dump_compact, load_compact
+from inclearn.csvdata import load_csv
+
+COLD_JOBLIB = "import time; t = time.perf_counter(); import joblib; joblib.load({path!r}); print(time.perf_counter() - t)"
+COLD_COMPACT = ("import sys, time; sys.path.append({lambda_dir!r}); t = time.perf_counter(); "
+                "from inclearn.compact import load_compact; load_compact({path!r}); print(time.perf_counter() - t)")
+
+
+def train(prefix):
+  from sklearn.linear_model import SGDClassifier, SGDRegressor
+  from sklearn.preprocessing import StandardScaler
+
+  X, y = load_csv(benchutil.dataset_paths(prefix)[0])
+  scaler = StandardScaler().fit(X)
+  if prefix == "spamdata":
+    model = SGDClassifier(max_iter=100, loss='log', early_stopping=True, learning_rate='adaptive', eta0=0.01)
+  else:
+    model = SGDRegressor(max_iter=1000, early_stopping=True, learning_rate='adaptive', eta0=0.0001)
+  return model.fit(scaler.transform(X), y), scaler
+
+
+def cold_seconds(code, repeat=5):
+  return min(float(subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout)
+             for _ in range(repeat))
+
+
+def main():
+  warnings.simplefilter("ignore", FutureWarning)
+  print(f"{'model':<10}{'format':<14}{'bytes':>8}{'warm us':>10}{'cold ms':>10}")
+  with tempfile.TemporaryDirectory() as workdir:
+    for prefix in ("calhouse", "spamdata"):
+      model, scaler = train(prefix)
+      _, joblib_bytes = dump_model(model, scaler)
+      variants = [
+        ("joblib", joblib_bytes, COLD_JOBLIB),
+        ("npz float64", dump_compact(model, scaler), COLD_COMPACT),
+        ("npz float32", dump_compact(model, scaler, "float32"), COLD_COMPACT),
+      ]
+      for label, data, cold_code in variants:
+        path = os.path.join(workdir, prefix + (".joblib" if label == "joblib" else ".npz"))
+        with open(path, "wb") as fp:
+          fp.write(data)
+        if label == "joblib":
+          import joblib
+          warm = benchutil.best_time(lambda: joblib.load(path), repeat=200)
+        else:
+          warm = benchutil.best_time(lambda: load_compact(path), repeat=200)
+        cold = cold_seconds(cold_code.format(path=path, lambda_dir=benchutil.LAMBDA_DIR))
+        print(f"{prefix:<10}{label:<14}{len(data):>8}{warm * 1e6:>10.0f}{cold * 1000:>10.1f}")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,115 @@
+"""
+Fires many training steps at one session at once and checks that the
+session still ends up with one linear lineage.
+
+A first model is trained on calhouse0, then --steps continuation steps
+(on calhouse1, calhouse2, ... in turn) start together from worker
+processes, the way parallel invocations of the regression trainer would.
+Every step commits with a conditional write of the session head and
+retrains on the new head when another step got there first. The script
+checks that every step succeeded, that the registry lists each model
+once as the parent of the next, that no losing model file was left
+behind and that the metrics log has one record per model, and prints the
+wall-clock time and the rebases the steps needed. --index-after lowers
+registry.INDEX_AFTER so the steps also fold the registry index while
+they race.
+
+  python benchmarks/bench_concurrent_updates.py [--steps N] [--epochs N]
+      [--index-after N]
+"""
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import warnings
+
+import benchutil
+from inclearn import metricslog, registry, runtime
+
+SESSION = "concurrent"
+
+
+def train(args):
+  """
+  Runs one training step in a worker process and returns its response
+  with the handler's instrument record.
+  """
+  dataset, first, epochs, start = args
+  warnings.simplefilter("ignore", FutureWarning)
+  runtime.set_scratch_dir(tempfile.mkdtemp())
+  handler = benchutil.load_handler("train_job _reg")
+  #start the steps together
+  time.sleep(max(0.0, start - time.time()))
+  with contextlib.redirect_stdout(io.StringIO()):
+    return handler.lambda_handler({"modelBucket": SESSION, "datasetFilenameIn": dataset, "firstModel": first,
+                                   "epochs": epochs, "instrument": True}, None)
+
+
+def check(storage, n_models):
+  """
+  Raises AssertionError unless the session holds n_models models in one
+  lineage, each with its file and metrics record.
+  """
+  head = storage.get_json(f"{SESSION}/head.json")
+  manifest = registry.load_registry(storage, SESSION)
+  names = [model["name"] for model in manifest["models"]]
+  assert [model["version"] for model in manifest["models"]] == list(range(1, n_models + 1)), "versions are not 1..n"
+  assert head == {"version": n_models, "name": names[-1]} and manifest["head"] == names[-1], "head is not the newest model"
+  assert [model["parent"] for model in manifest["models"]] == [None] + names[:-1], "lineage is not linear"
+
+  files = sorted(os.path.basename(obj["key"]) for obj in storage.list(f"{SESSION}/model") if obj["key"].endswith(".joblib"))
+  assert files == sorted(names), f"{len(files) - len(names)} model files are not in the registry"
+  records = [record for record in metricslog.read_records(storage, SESSION) if "model" in record]
+  assert sorted(record["version"] for record in records) == list(range(1, n_models + 1)), "metrics log misses models"
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Checks concurrent training steps on one session.")
+  parser.add_argument("--steps", type=int, default=8, help="concurrent continuation steps")
+  parser.add_argument("--epochs", type=int, default=20)
+  parser.add_argument("--index-after", type=int, default=registry.INDEX_AFTER, help="entries before the index is folded")
+  args = parser.parse_args()
+  #the worker processes are forked after this, so they see it too
+  registry.INDEX_AFTER = args.index_after
+
+  datasets = benchutil.dataset_paths("calhouse")[:4]
+  cwd = os.getcwd()
+  with tempfile.TemporaryDirectory() as workdir:
+    #the handlers read config.ini from the working directory
+    os.chdir(workdir)
+    with open("config.ini", "w") as fp:
+      fp.write(f"[storage]\nbackend = local\nroot = {os.path.join(workdir, 'storage')}\n")
+    os.makedirs(os.path.join(workdir, "storage", SESSION))
+    for path in datasets:
+      shutil.copy(path, os.path.join(workdir, "storage", SESSION))
+    runtime.reset()
+    names = [os.path.basename(path) for path in datasets]
+
+    first = train((names[0], 1, args.epochs, 0.0))
+    assert first["statusCode"] == 200, first
+
+    start = time.time() + 1.0
+    steps = [(names[1 + i % (len(names) - 1)], 0, args.epochs, start) for i in range(args.steps)]
+    with multiprocessing.Pool(args.steps) as pool:
+      responses = pool.map(train, steps)
+    seconds = time.time() - start
+
+    failed = [response for response in responses if response["statusCode"] != 200]
+    assert not failed, failed
+    check(runtime.get_storage(), args.steps + 1)
+    indexed = (runtime.get_storage().get_json(f"{SESSION}/{registry.REGISTRY_NAME}") or {"version": 0})["version"]
+    rebases = [response["metrics"]["counters"].get("rebases", 0) for response in responses]
+    runtime.reset()
+    os.chdir(cwd)
+
+  print(json.dumps({"steps": args.steps, "seconds": seconds, "rebases": sum(rebases), "maxRebases": max(rebases),
+                    "indexed": indexed, "lineage": "linear"}, indent=2))
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,63 @@
+"""
+Compares inclearn.csvdata.load_csv with the csv.reader loop the handlers
+used before, on the bundled datasets: best-of-N parse time and peak
+traced memory per file.
+
+  python benchmarks/bench_csv_loader.py [repeat]
+"""
+import csv
+import os
+import sys
+import tracemalloc
+
+import numpy as np
+
+import benchutil
+from inclearn.csvdata import load_csv
+
+
+def legacy_load(path):
+  X = []
+  y = []
+  with open(path, 'r') as file:
+    my_reader = csv.reader(file, delimiter=',')
+    next(my_reader)
+    for row in my_reader:
+      X.append([float(value) for value in row[:-1]])
+      y.append(float(row[-1]))
+  return np.array(X), np.array(y)
+
+
+def peak_memory(fn):
+  tracemalloc.start()
+  fn()
+  peak = tracemalloc.get_traced_memory()[1]
+  tracemalloc.stop()
+  return peak
+
+
+def main():
+  repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+  print(f"{'dataset':<18}{'rows':>7}{'legacy ms':>11}{'vector ms':>11}{'speedup':>9}{'legacy KiB':>12}{'vector KiB':>12}")
+  totals = [0.0, 0.0]
+  for path in benchutil.dataset_paths():
+    X_old, y_old = legacy_load(path)
+    X_new, y_new = load_csv(path)
+    assert np.array_equal(X_old, X_new) and np.array_equal(y_old, y_new), path
+
+    t_old = benchutil.best_time(lambda: legacy_load(path), repeat)
+    t_new = benchutil.best_time(lambda: load_csv(path), repeat)
+    m_old = peak_memory(lambda: legacy_load(path))
+    m_new = peak_memory(lambda: load_csv(path))
+    totals[0] += t_old
+    totals[1] += t_new
+
+    print(f"{os.path.basename(path):<18}{len(y_new):>7}{t_old * 1000:>11.2f}{t_new * 1000:>11.2f}"
+          f"{t_old / t_new:>8.1f}x{m_old / 1024:>12.0f}{m_new / 1024:>12.0f}")
+
+  print(f"{'total':<18}{'':>7}{totals[0] * 1000:>11.2f}{totals[1] * 1000:>11.2f}{totals[0] / totals[1]:>8.1f}x")
+
+
+if __name__ == "__main__":
+  main()
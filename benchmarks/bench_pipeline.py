@@ -0,0 +1,204 @@
+"""
+End-to-end benchmark of incremental-learning sessions over the bundled
+datasets, run through the real handlers against local storage.
+
+calhouse0..19 are replayed through the regression trainer and
+spamdata0..3 through the classifier. Every step uploads the next chunk
+(multipart, as client.py does), scores the current head model on it
+with predict, then trains the next model on it. Per step the script
+records wall-clock time, the inclearn.instrument phase times (download,
+parse, scale, fit, serialize, upload, progress, ...), counters and bytes
+moved, peak memory and throughput, and prints the results as json so
+runs of different commits can be compared.
+
+  python benchmarks/bench_pipeline.py [--workload calhouse|spamdata|all]
+      [--epochs N] [--streaming] [--trace-memory] [--output results.json]
+"""
+import argparse
+import base64
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+
+import benchutil
+from inclearn import runtime
+from inclearn.csvdata import count_rows
+from inclearn.registry import read_head
+
+sys.path.append(benchutil.REPO_DIR)
+from client import read_parts
+
+# dataset prefix -> (training handler, trainType for predict)
+WORKLOADS = {
+  "calhouse": ("train_job _reg", 1),
+  "spamdata": ("train_job", 0),
+}
+
+
+def call(handler, event, trace_memory):
+  """
+  Calls a handler with its output silenced and returns (response,
+  measurements of the call). The phase times, counters and bytes are the
+  handler's own inclearn.instrument record.
+  """
+  if trace_memory:
+    tracemalloc.reset_peak()
+  start = time.perf_counter()
+  with contextlib.redirect_stdout(io.StringIO()):
+    response = handler.lambda_handler({**event, "instrument": True}, None)
+  seconds = time.perf_counter() - start
+
+  if response.get("statusCode") != 200:
+    raise RuntimeError(f"{event} failed: {response}")
+  metrics = response.pop("metrics")
+  result = {
+    "seconds": seconds,
+    "phases": metrics["spans"],
+    "counters": metrics["counters"],
+    "bytes": metrics["bytes"],
+    "peakRssMiB": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+  }
+  if trace_memory:
+    result["tracedPeakMiB"] = tracemalloc.get_traced_memory()[1] / 2**20
+  return response, result
+
+
+def upload(handler, path, session, trace_memory):
+  """
+  Uploads a dataset with the begin/part/complete protocol and returns
+  the measurements summed over the calls.
+  """
+  fields = {"dataset_filename": os.path.basename(path), "modelFolder": session}
+  response, total = call(handler, {**fields, "action": "begin"}, trace_memory)
+  uploadId = json.loads(response["body"])["uploadId"]
+  calls = []
+  for partNumber, data in read_parts(path, compress=True):
+    event = {"action": "part", "uploadId": uploadId, "partNumber": partNumber, "encoding": "gzip",
+             "body": base64.b64encode(data).decode(), "isBase64Encoded": True, **fields}
+    calls.append(call(handler, event, trace_memory)[1])
+  calls.append(call(handler, {**fields, "action": "complete", "uploadId": uploadId}, trace_memory)[1])
+
+  for result in calls:
+    total["seconds"] += result["seconds"]
+    for field in ("phases", "counters", "bytes"):
+      for name, value in result[field].items():
+        total[field][name] = total[field].get(name, 0) + value
+    total["peakRssMiB"] = max(total["peakRssMiB"], result["peakRssMiB"])
+    if trace_memory:
+      total["tracedPeakMiB"] = max(total["tracedPeakMiB"], result["tracedPeakMiB"])
+  return total
+
+
+def run_workload(prefix, storage, handlers, args):
+  train_name, trainType = WORKLOADS[prefix]
+  session = f"bench-{prefix}"
+  steps = []
+  for i, path in enumerate(benchutil.dataset_paths(prefix)):
+    name = os.path.basename(path)
+    rows = count_rows(path)
+    step = {"dataset": name, "rows": rows, "bytes": os.path.getsize(path)}
+    step["upload"] = upload(handlers["upload_dataset"], path, session, args.trace_memory)
+
+    if i > 0:
+      #score the current head on the chunk it has not seen yet
+      head = read_head(storage, session)
+      event = {"modelFolder": session, "modelName": head["name"], "datasetFilenameIn": name, "trainType": trainType}
+      response, step["predict"] = call(handlers["predict"], event, args.trace_memory)
+      step["predict"]["metric"] = response["accuracy"]
+      step["predict"]["rowsPerSecond"] = rows / step["predict"]["seconds"]
+
+    event = {"modelBucket": session, "datasetFilenameIn": name, "firstModel": i == 0, "streaming": args.streaming}
+    if args.epochs is not None:
+      event["epochs"] = args.epochs
+    response, step["train"] = call(handlers[train_name], event, args.trace_memory)
+    step["train"]["metric"] = response["accuracy"]
+    step["train"]["rowsPerSecond"] = rows / step["train"]["seconds"]
+    steps.append(step)
+
+    print(f"{name:<18}{step['upload']['seconds']:>9.3f}{step.get('predict', {}).get('seconds', 0):>9.3f}"
+          f"{step['train']['seconds']:>9.3f}{step['train']['metric']:>9.4f}", file=sys.stderr)
+  return steps
+
+
+def summarize(steps):
+  """
+  Totals of every call kind and phase over the steps of a workload.
+  """
+  summary = {}
+  for kind in ("upload", "predict", "train"):
+    results = [step[kind] for step in steps if kind in step]
+    summary[kind] = {"calls": len(results), "seconds": sum(result["seconds"] for result in results)}
+    for field in ("phases", "counters", "bytes"):
+      totals = {}
+      for result in results:
+        for name, value in result[field].items():
+          totals[name] = totals.get(name, 0) + value
+      summary[kind][field] = totals
+  summary["rows"] = sum(step["rows"] for step in steps)
+  summary["seconds"] = sum(summary[kind]["seconds"] for kind in ("upload", "predict", "train"))
+  return summary
+
+
+def environment():
+  import numpy
+  import sklearn
+
+  try:
+    commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=benchutil.REPO_DIR,
+                            capture_output=True, text=True, check=True).stdout.strip()
+  except (OSError, subprocess.CalledProcessError):
+    commit = None
+  return {"commit": commit, "python": platform.python_version(), "numpy": numpy.__version__, "sklearn": sklearn.__version__}
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+  parser.add_argument("--workload", choices=sorted(WORKLOADS) + ["all"], default="all")
+  parser.add_argument("--epochs", type=int, default=None, help="epochs per training step (handler default if unset)")
+  parser.add_argument("--streaming", action="store_true", help="train in out-of-core mode")
+  parser.add_argument("--trace-memory", action="store_true", help="also report tracemalloc peaks (slows every call)")
+  parser.add_argument("--output", help="write the json results to this file instead of stdout")
+  args = parser.parse_args()
+
+  warnings.simplefilter("ignore", FutureWarning)
+  if args.trace_memory:
+    tracemalloc.start()
+
+  prefixes = sorted(WORKLOADS) if args.workload == "all" else [args.workload]
+  cwd = os.getcwd()
+  results = {"environment": environment(), "args": vars(args), "workloads": {}}
+  with tempfile.TemporaryDirectory() as workdir:
+    #the handlers read config.ini from the working directory
+    os.chdir(workdir)
+    with open("config.ini", "w") as fp:
+      fp.write(f"[storage]\nbackend = local\nroot = {os.path.join(workdir, 'storage')}\n")
+    runtime.reset()
+    storage = runtime.get_storage()
+    handlers = {name: benchutil.load_handler(name) for name in ("upload_dataset", "predict", "train_job", "train_job _reg")}
+
+    print(f"{'dataset':<18}{'upload':>9}{'predict':>9}{'train':>9}{'metric':>9}", file=sys.stderr)
+    for prefix in prefixes:
+      steps = run_workload(prefix, storage, handlers, args)
+      results["workloads"][prefix] = {"steps": steps, "summary": summarize(steps)}
+    runtime.reset()
+    os.chdir(cwd)
+
+  text = json.dumps(results, indent=2)
+  if args.output:
+    with open(args.output, "w") as fp:
+      fp.write(text + "\n")
+  else:
+    print(text)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,84 @@
+"""
+Per-call setup overhead of a handler: the old code that rebuilt config,
+boto3 session, resource and clients on every call, against
+inclearn.runtime on a cold and on a warm container.
+
+No request is sent to S3; the config points at a stand-in bucket with
+dummy credentials, so only the client-side setup cost is measured.
+
+  python benchmarks/bench_runtime.py [calls]
+"""
+import os
+import sys
+import tempfile
+import time
+
+import benchutil
+from inclearn import runtime
+
+CONFIG = """[s3]
+bucket_name = benchmark-bucket
+
+[s3readwrite]
+aws_access_key_id = AKIAEXAMPLEEXAMPLE00
+aws_secret_access_key = example/example/example/example/example0
+region_name = us-east-2
+"""
+
+
+def legacy_setup():
+  import boto3
+  from configparser import ConfigParser
+
+  config_file = 'config.ini'
+  os.environ['AWS_SHARED_CREDENTIALS_FILE'] = config_file
+  configur = ConfigParser()
+  configur.read(config_file)
+  boto3.setup_default_session(profile_name='s3readwrite')
+  bucketname = configur.get('s3', 'bucket_name')
+  s3_resource = boto3.resource('s3')
+  bucket = s3_resource.Bucket(bucketname)
+  s3_client = boto3.client('s3')
+  return bucket, s3_client
+
+
+def runtime_setup():
+  # the storage creates its client on first use; create it here so both
+  # sides build the same objects
+  runtime.get_s3_client()
+  return runtime.get_storage()
+
+
+def per_call_ms(fn, calls):
+  start = time.perf_counter()
+  for _ in range(calls):
+    fn()
+  return (time.perf_counter() - start) / calls * 1000
+
+
+def main():
+  calls = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+  os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-2')
+
+  with tempfile.TemporaryDirectory() as workdir:
+    os.chdir(workdir)
+    with open('config.ini', 'w') as fp:
+      fp.write(CONFIG)
+
+    # import cost is paid once per process either way
+    legacy_setup()
+
+    def cold():
+      runtime.reset()
+      runtime_setup()
+
+    print(f"{'setup':<28}{'ms/call':>10}")
+    print(f"{'legacy (every call)':<28}{per_call_ms(legacy_setup, calls):>10.3f}")
+    print(f"{'runtime, cold container':<28}{per_call_ms(cold, calls):>10.3f}")
+    runtime_setup()
+    print(f"{'runtime, warm container':<28}{per_call_ms(runtime_setup, calls * 100):>10.3f}")
+    os.chdir(benchutil.REPO_DIR)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,87 @@
+"""
+Compares inclearn.trainer.train_epochs_sharded with the sequential
+train_epochs loop, for SGDRegressor on all calhouse chunks and
+SGDClassifier on all spamdata chunks. Like a session, the model is first
+fitted on chunk 0 and then continued for the given epochs on the rest;
+every variant starts from the same fitted model. Per variant the script
+prints the time, the speedup over the sequential loop and the score on a
+held-out split. Sequential runs with two seeds show how far scores move
+from shuffling alone, the yardstick for the sharded scores.
+
+  python benchmarks/bench_sharded_trainer.py [epochs]
+
+The speedup needs as many free cores as shards; os.cpu_count() is printed.
+"""
+import argparse
+import copy
+import os
+import time
+import warnings
+
+import numpy as np
+from sklearn.linear_model import SGDClassifier, SGDRegressor
+from sklearn.model_selection import train_test_split
+from sklearn.preprocessing import StandardScaler
+
+import benchutil
+from inclearn.csvdata import load_csv
+from inclearn.trainer import train_epochs, train_epochs_sharded
+
+
+def prepare(prefix, model):
+  paths = benchutil.dataset_paths(prefix)
+  X_first, y_first = load_csv(paths[0])
+  rest = [load_csv(path) for path in paths[1:]]
+  X = np.concatenate([X for X, _ in rest])
+  y = np.concatenate([y for _, y in rest])
+  X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=0)
+
+  scaler = StandardScaler().fit(X_first)
+  model.fit(scaler.transform(X_first), y_first)
+  model.learning_rate = 'adaptive'
+  model.early_stopping = False
+  scaler.partial_fit(X_train)
+  return model, scaler.transform(X_train), scaler.transform(X_test), y_train, y_test
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Compares sharded with sequential training epochs.")
+  parser.add_argument("epochs", type=int, nargs="?", default=20, help="epochs each variant continues the model for")
+  epochs = parser.parse_args().epochs
+  warnings.simplefilter("ignore", FutureWarning)
+  cases = [
+    ("calhouse", SGDRegressor(max_iter=1000, loss='squared_error', early_stopping=True, learning_rate='adaptive', eta0=0.0001, random_state=0)),
+    ("spamdata", SGDClassifier(max_iter=100, loss='log', early_stopping=True, learning_rate='adaptive', eta0=0.01, random_state=0)),
+  ]
+
+  print(f"cores: {os.cpu_count()}, epochs: {epochs}")
+  print(f"{'model':<15}{'rows':>7}  {'variant':<26}{'seconds':>9}{'speedup':>9}{'score':>9}{'delta':>9}")
+  for prefix, model in cases:
+    model, X_train, X_test, y_train, y_test = prepare(prefix, model)
+    kind = type(model).__name__
+
+    #(seed, shards, sync_every); shards None runs the sequential loop
+    variants = [(0, None, None), (1, None, None)]
+    variants += [(0, shards, sync_every) for shards in (2, 4) for sync_every in (None, 5, 1)]
+
+    baseline_seconds = baseline_score = None
+    for seed, shards, sync_every in variants:
+      trained = copy.deepcopy(model)
+      start = time.perf_counter()
+      if shards is None:
+        train_epochs(trained, X_train, y_train, epochs, 32, random_state=seed)
+        label = f"sequential seed={seed}"
+      else:
+        #train_epochs_sharded caps the shards by MIN_SHARD_ROWS
+        _, used_shards = train_epochs_sharded(trained, X_train, y_train, epochs, 32, shards=shards,
+                                              sync_every=sync_every, random_state=seed)
+        label = f"{used_shards} shards, sync {'at end' if sync_every is None else f'every {sync_every}'}"
+      seconds = time.perf_counter() - start
+      score = trained.score(X_test, y_test)
+      if baseline_seconds is None:
+        baseline_seconds, baseline_score = seconds, score
+      print(f"{kind:<15}{len(X_train):>7}  {label:<26}{seconds:>9.3f}{baseline_seconds / seconds:>9.2f}"
+            f"{score:>9.4f}{score - baseline_score:>+9.4f}")
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,116 @@
+"""
+Peak resident memory of training on a large dataset: the in-memory path
+(legacy csv.reader lists, or load_csv) against inclearn.streaming.stream_fit.
+
+A regression csv of the requested size is built by repeating the
+calhouse chunks; every mode runs in its own process so ru_maxrss is the
+peak of that mode alone. One epoch of SGDRegressor partial_fit is run in
+every mode.
+
+  python benchmarks/bench_streaming.py [rows] [chunk_rows]
+"""
+import csv
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import benchutil
+
+MODES = ["baseline", "legacy", "load_csv", "streaming"]
+
+
+def build_dataset(path, rows):
+  sources = benchutil.dataset_paths("calhouse")
+  with open(sources[0]) as fp:
+    header = fp.readline()
+  bodies = []
+  for source in sources:
+    with open(source) as fp:
+      fp.readline()
+      bodies.append(fp.read())
+
+  written = 0
+  with open(path, "w") as out:
+    out.write(header)
+    while written < rows:
+      for body in bodies:
+        out.write(body)
+        written += body.count("\n")
+        if written >= rows:
+          break
+
+
+def run_mode(mode, path, chunk_rows):
+  import numpy as np
+  from sklearn.linear_model import SGDRegressor
+  from sklearn.model_selection import train_test_split
+  from sklearn.preprocessing import StandardScaler
+
+  model = SGDRegressor(learning_rate='adaptive', eta0=0.0001)
+  scaler = StandardScaler()
+  if mode == "baseline":
+    return None
+
+  if mode == "streaming":
+    from inclearn.datasets import dataset_chunks
+    from inclearn.storage import LocalStorage
+    from inclearn.streaming import stream_fit
+
+    storage = LocalStorage(os.path.dirname(path))
+    local_path = os.path.join("/tmp", "bench_streaming_local.csv")
+    make_chunks = dataset_chunks(storage, os.path.basename(path), local_path, chunk_rows)
+    return stream_fit(model, scaler, make_chunks, epochs=1, batch_size=None)["score"]
+
+  if mode == "legacy":
+    X = []
+    y = []
+    with open(path, 'r') as file:
+      my_reader = csv.reader(file, delimiter=',')
+      next(my_reader)
+      for row in my_reader:
+        X.append([float(value) for value in row[:-1]])
+        y.append(float(row[-1]))
+    X = np.array(X)
+    y = np.array(y)
+  else:
+    from inclearn.csvdata import load_csv
+    X, y = load_csv(path)
+
+  X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2)
+  scaler.fit(X_train)
+  X_train = scaler.transform(X_train)
+  X_test = scaler.transform(X_test)
+  model.partial_fit(X_train, y_train)
+  return model.score(X_test, y_test)
+
+
+def main():
+  if len(sys.argv) > 1 and sys.argv[1] == "--mode":
+    mode, path, chunk_rows = sys.argv[2], sys.argv[3], int(sys.argv[4])
+    start = time.perf_counter()
+    score = run_mode(mode, path, chunk_rows)
+    seconds = time.perf_counter() - start
+    peak_kib = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"{mode} {seconds} {peak_kib} {score}")
+    return
+
+  rows = int(sys.argv[1]) if len(sys.argv) > 1 else 2_000_000
+  chunk_rows = int(sys.argv[2]) if len(sys.argv) > 2 else 50_000
+  path = os.path.join("/tmp", f"bench_streaming_{rows}.csv")
+  if not os.path.exists(path):
+    build_dataset(path, rows)
+  size_mb = os.path.getsize(path) / 2**20
+
+  print(f"dataset: {rows} rows, {size_mb:.0f} MiB, chunk_rows={chunk_rows}")
+  print(f"{'mode':<12}{'seconds':>9}{'peak RSS MiB':>14}{'score':>9}")
+  for mode in MODES:
+    out = subprocess.run([sys.executable, __file__, "--mode", mode, path, str(chunk_rows)],
+                         capture_output=True, text=True, check=True).stdout.splitlines()[-1].split()
+    score = "-" if out[3] == "None" else f"{float(out[3]):.4f}"
+    print(f"{mode:<12}{float(out[1]):>9.2f}{int(out[2]) / 1024:>14.0f}{score:>9}")
+
+
+if __name__ == "__main__":
+  main()
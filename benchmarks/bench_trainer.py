@@ -0,0 +1,72 @@
+"""
+Compares inclearn.trainer.train_epochs with the epoch loop train_job used
+before (a permuted copy of the data per epoch), for SGDClassifier on
+spamdata0.csv and SGDRegressor on calhouse0.csv. Both start from the same
+fitted model; the score on the held-out split is printed next to the
+time.
+
+  python benchmarks/bench_trainer.py [epochs]
+"""
+import copy
+import os
+import sys
+
+import numpy as np
+from sklearn.linear_model import SGDClassifier, SGDRegressor
+from sklearn.model_selection import train_test_split
+from sklearn.preprocessing import StandardScaler
+
+import benchutil
+from inclearn.csvdata import load_csv
+from inclearn.trainer import train_epochs
+
+
+def legacy_epochs(loaded_model, X_train, y_train, n_iterations, batch_size=32):
+  for iteration in range(n_iterations):
+    permutation_0 = np.random.permutation(X_train.shape[0])
+    X_train = X_train[permutation_0]
+    y_train = y_train[permutation_0]
+    for i in range(0, len(X_train), batch_size):
+      X_batch = X_train[i:i+batch_size]
+      y_batch = y_train[i:i+batch_size]
+      loaded_model.partial_fit(X_batch, y_batch)
+
+
+def prepare(name, model):
+  X, y = load_csv(os.path.join(benchutil.DATASETS_DIR, name))
+  X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=0)
+  scaler = StandardScaler().fit(X_train)
+  X_train = scaler.transform(X_train)
+  X_test = scaler.transform(X_test)
+  model.fit(X_train, y_train)
+  model.learning_rate = 'adaptive'
+  model.early_stopping = False
+  return model, X_train, X_test, y_train, y_test
+
+
+def main():
+  epochs = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+  cases = [
+    ("spamdata0.csv", SGDClassifier(max_iter=100, loss='log', early_stopping=True, learning_rate='adaptive', eta0=0.01, random_state=0)),
+    ("calhouse0.csv", SGDRegressor(max_iter=1000, loss='squared_error', early_stopping=True, learning_rate='adaptive', eta0=0.0001, random_state=0)),
+  ]
+
+  print(f"{'model':<15}{'variant':<22}{'seconds':>9}{'score':>9}")
+  for name, model in cases:
+    model, X_train, X_test, y_train, y_test = prepare(name, model)
+    kind = type(model).__name__
+
+    variants = [
+      ("legacy loop", lambda m: legacy_epochs(m, X_train, y_train, epochs)),
+      ("train_epochs bs=32", lambda m: train_epochs(m, X_train, y_train, epochs, 32, random_state=0)),
+      ("train_epochs bs=256", lambda m: train_epochs(m, X_train, y_train, epochs, 256, random_state=0)),
+      ("train_epochs bs=None", lambda m: train_epochs(m, X_train, y_train, epochs, None, random_state=0)),
+    ]
+    for label, run in variants:
+      trained = copy.deepcopy(model)
+      seconds = benchutil.best_time(lambda: run(trained), repeat=1)
+      print(f"{kind:<15}{label:<22}{seconds:>9.3f}{trained.score(X_test, y_test):>9.4f}")
+
+
+if __name__ == "__main__":
+  main()
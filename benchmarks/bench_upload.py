@@ -0,0 +1,80 @@
+"""
+Client-to-storage upload cost of the old base64-in-json upload against
+the multipart protocol (client.read_parts + uploadDataset "part"), with
+the network left out: both ends run in this process and parts are
+written to a local file the way the handler hands them to storage.
+
+Reports throughput, bytes on the wire and peak traced memory per file.
+
+  python benchmarks/bench_upload.py [extra.csv ...]
+"""
+import base64
+import gzip
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import benchutil
+
+sys.path.append(benchutil.REPO_DIR)
+from client import read_parts
+
+
+def legacy_upload(path, out_path):
+  with open(path, "rb") as infile:
+    bytes = infile.read()
+  datastr = base64.b64encode(bytes).decode()
+  payload = json.dumps({"dataset_filename": path, "dataset": datastr, "modelFolder": "bench"})
+
+  event = json.loads(payload)
+  data = base64.b64decode(event["dataset"].encode())
+  with open(out_path, "wb") as fp:
+    fp.write(data)
+  return len(payload)
+
+
+def multipart_upload(path, out_path, part_size, compress):
+  wire = 0
+  with open(out_path, "wb") as fp:
+    for partNumber, data in read_parts(path, part_size, compress):
+      wire += len(data)
+      if compress:
+        data = gzip.decompress(data)
+      fp.write(data)
+  return wire
+
+
+def measure(fn):
+  tracemalloc.start()
+  start = time.perf_counter()
+  wire = fn()
+  seconds = time.perf_counter() - start
+  peak = tracemalloc.get_traced_memory()[1]
+  tracemalloc.stop()
+  return seconds, wire, peak
+
+
+def main():
+  paths = benchutil.dataset_paths() + sys.argv[1:]
+  part_size = 8 * 1024 * 1024
+  variants = [
+    ("base64 json", lambda path, out: legacy_upload(path, out)),
+    ("parts raw", lambda path, out: multipart_upload(path, out, part_size, False)),
+    ("parts gzip", lambda path, out: multipart_upload(path, out, part_size, True)),
+  ]
+
+  print(f"{'file':<28}{'variant':<13}{'MiB/s':>9}{'wire KiB':>11}{'peak KiB':>11}")
+  with tempfile.TemporaryDirectory() as workdir:
+    out = os.path.join(workdir, "upload.csv")
+    for path in paths:
+      size = os.path.getsize(path)
+      for label, run in variants:
+        seconds, wire, peak = measure(lambda: run(path, out))
+        print(f"{os.path.basename(path):<28}{label:<13}{size / 2**20 / seconds:>9.1f}{wire / 1024:>11.0f}{peak / 1024:>11.0f}")
+
+
+if __name__ == "__main__":
+  main()
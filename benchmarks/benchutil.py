@@ -0,0 +1,58 @@
+"""
+Helpers shared by the benchmark scripts.
+
+Run the scripts from the repository root, e.g.
+
+  python benchmarks/bench_csv_loader.py
+"""
+import os
+import re
+import sys
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATASETS_DIR = os.path.join(REPO_DIR, "datasets")
+LAMBDA_DIR = os.path.join(REPO_DIR, "lambda_functions")
+
+# make the shared inclearn package importable
+sys.path.append(LAMBDA_DIR)
+
+
+def dataset_paths(prefix=""):
+  """
+  Returns the bundled csv datasets whose names start with prefix, in
+  chunk order (calhouse0, calhouse1, ..., calhouse10, ...).
+  """
+  names = [name for name in os.listdir(DATASETS_DIR) if name.startswith(prefix) and name.endswith(".csv")]
+
+  def chunk_number(name):
+    match = re.match(r"(.*?)(\d*)\.csv$", name)
+    return (match.group(1), int(match.group(2) or 0))
+
+  return [os.path.join(DATASETS_DIR, name) for name in sorted(names, key=chunk_number)]
+
+
+def best_time(fn, repeat=5):
+  """
+  Calls fn repeat times and returns the fastest wall-clock time in seconds.
+  """
+  best = float("inf")
+  for _ in range(repeat):
+    start = time.perf_counter()
+    fn()
+    best = min(best, time.perf_counter() - start)
+  return best
+
+
+def load_handler(name):
+  """
+  Imports lambda_functions/<name>/lambda_function.py as a module; every
+  handler file has the same module name, so they are loaded by path.
+  """
+  import importlib.util
+
+  path = os.path.join(LAMBDA_DIR, name, "lambda_function.py")
+  spec = importlib.util.spec_from_file_location(name.replace(" ", "_"), path)
+  module = importlib.util.module_from_spec(spec)
+  spec.loader.exec_module(module)
+  return module
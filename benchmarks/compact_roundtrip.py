@@ -0,0 +1,81 @@
+"""
+Round-trip check of the compact model format (inclearn.compact).
+
+For SGDRegressor on calhouse0/calhouse1 and SGDClassifier on
+spamdata0/spamdata1, with average off, on and from step 10, a model and
+scaler are fitted on the first chunk, saved with dump_compact and
+rebuilt with LinearScorer.to_estimator. The rebuilt pair must score like
+the original, and continuing both with partial_fit on the second chunk
+must give the same weights. A compact file of an averaged model that
+lacks the averaged state must be refused with a ValueError. The script
+fails (exit status 1) if any case does not hold.
+
+  python benchmarks/compact_roundtrip.py
+"""
+import copy
+import sys
+import warnings
+
+import numpy as np
+
+import benchutil
+from inclearn.compact import AVERAGE_STATE, dump_compact, load_compact
+from inclearn.csvdata import load_csv
+
+
+def check(prefix, make_model, average):
+  """
+  Returns the failures of one case, empty if it holds.
+  """
+  from sklearn.preprocessing import StandardScaler
+
+  (X_first, y_first), (X_next, y_next) = [load_csv(path) for path in benchutil.dataset_paths(prefix)[:2]]
+  scaler = StandardScaler().fit(X_first)
+  model = make_model(average).fit(scaler.transform(X_first), y_first)
+
+  failures = []
+  rebuilt, rebuilt_scaler = load_compact(dump_compact(model, scaler)).to_estimator()
+  if rebuilt.score(rebuilt_scaler.transform(X_next), y_next) != model.score(scaler.transform(X_next), y_next):
+    failures.append("rebuilt model scores differently")
+
+  #continue both the way a training step does
+  model = copy.deepcopy(model)
+  for trained, trained_scaler in ((model, scaler), (rebuilt, rebuilt_scaler)):
+    trained_scaler.partial_fit(X_next)
+    trained.partial_fit(trained_scaler.transform(X_next), y_next)
+  for name in ("coef_", "intercept_") + (AVERAGE_STATE if average else ()):
+    if not np.array_equal(getattr(model, name), getattr(rebuilt, name)):
+      failures.append(f"{name} differs after partial_fit")
+
+  if average:
+    #compact files written before the averaged state was stored
+    for name in AVERAGE_STATE:
+      delattr(model, name)
+    try:
+      load_compact(dump_compact(model, scaler)).to_estimator()
+      failures.append("compact model without averaged state was not refused")
+    except ValueError:
+      pass
+  return failures
+
+
+def main():
+  from sklearn.linear_model import SGDClassifier, SGDRegressor
+
+  warnings.simplefilter("ignore", FutureWarning)
+  cases = [
+    ("calhouse", lambda average: SGDRegressor(max_iter=1000, eta0=0.0001, average=average, random_state=0)),
+    ("spamdata", lambda average: SGDClassifier(max_iter=100, loss='log', eta0=0.01, average=average, random_state=0)),
+  ]
+
+  failed = False
+  for prefix, make_model in cases:
+    for average in (False, True, 10):
+      failures = check(prefix, make_model, average)
+      failed = failed or bool(failures)
+      print(f"{prefix:<10} average={str(average):<6} {'; '.join(failures) or 'ok'}")
+  sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+  main()
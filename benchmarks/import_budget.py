@@ -0,0 +1,117 @@
+"""
+Cold-start import budget of the handlers.
+
+Every handler is imported in a fresh interpreter under -X importtime and
+called once with an empty event, the cheapest path (a validation error).
+The script fails (exit status 1) if the import time of the handler
+module plus the imports done by that call exceeds the handler's budget,
+or if the call pulled in a heavy module that only real work needs.
+
+  python benchmarks/import_budget.py [--scale 1.5] [--verbose]
+
+--scale multiplies every budget, for slow machines.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+import benchutil
+
+# milliseconds of imports for the handler module plus an invalid call
+BUDGETS_MS = {
+  "get_models": 25,
+  "jobs": 25,
+  "predict": 25,
+  "train_job": 25,
+  "train_job _reg": 25,
+  "upload_dataset": 25,
+}
+
+# modules no handler may import before it knows the event is valid
+HEAVY_MODULES = ["numpy", "sklearn", "joblib", "boto3", "botocore"]
+
+CONFIG = """[s3]
+bucket_name = budget-bucket
+
+[s3readwrite]
+aws_access_key_id = AKIAEXAMPLEEXAMPLE00
+aws_secret_access_key = example/example/example/example/example0
+region_name = us-east-2
+"""
+
+BOOTSTRAP = """
+import contextlib, io, json, sys
+sys.path.insert(0, {handler_dir!r})
+with contextlib.redirect_stdout(io.StringIO()):
+  import lambda_function
+  response = lambda_function.lambda_handler({{}}, None)
+heavy = [name for name in {heavy!r} if name in sys.modules]
+print(json.dumps({{"statusCode": response.get("statusCode"), "heavy": heavy}}))
+"""
+
+
+def parse_importtime(stderr):
+  """
+  Returns [(cumulative us, module)] of the top-level imports from the
+  handler module on, in import order.
+  """
+  entries = []
+  started = False
+  for line in stderr.splitlines():
+    if not line.startswith("import time:") or "|" not in line:
+      continue
+    fields = line[len("import time:"):].split("|")
+    if not fields[0].strip().isdigit():
+      continue  # the column header
+    name = fields[2]
+    top_level = not name[1:].startswith(" ")
+    if name.strip() == "lambda_function":
+      started = True
+    if started and top_level:
+      entries.append((int(fields[1]), name.strip()))
+  return entries
+
+
+def measure(name, workdir):
+  handler_dir = os.path.join(benchutil.LAMBDA_DIR, name)
+  code = BOOTSTRAP.format(handler_dir=handler_dir, heavy=HEAVY_MODULES)
+  proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=workdir,
+                        capture_output=True, text=True, check=True)
+  result = json.loads(proc.stdout.splitlines()[-1])
+  entries = parse_importtime(proc.stderr)
+  result["ms"] = sum(us for us, _ in entries) / 1000
+  result["slowest"] = sorted(entries, reverse=True)[:5]
+  return result
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+  parser.add_argument("--scale", type=float, default=1.0, help="multiply every budget")
+  parser.add_argument("--verbose", action="store_true", help="list the slowest imports")
+  args = parser.parse_args()
+
+  failed = False
+  with tempfile.TemporaryDirectory() as workdir:
+    with open(os.path.join(workdir, "config.ini"), "w") as fp:
+      fp.write(CONFIG)
+
+    print(f"{'handler':<18}{'ms':>8}{'budget':>8}  heavy modules")
+    for name, budget in BUDGETS_MS.items():
+      result = measure(name, workdir)
+      budget *= args.scale
+      over = result["ms"] > budget or result["heavy"] or result["statusCode"] != 400
+      failed = failed or over
+      print(f"{name:<18}{result['ms']:>8.1f}{budget:>8.1f}  {', '.join(result['heavy']) or '-'}"
+            f"{'  FAIL' if over else ''}")
+      if args.verbose:
+        for us, module in result["slowest"]:
+          print(f"{'':<18}{us / 1000:>8.1f}  {module}")
+
+  sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+  main()
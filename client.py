@@ -3,8 +3,18 @@ import pathlib
 import logging
 import sys
 import base64
-
+import gzip
+import hashlib
+import json
+import os
+import argparse
+import asyncio
+import random
+import time
+
+from concurrent.futures import ThreadPoolExecutor
 from configparser import ConfigParser
+from requests.adapters import HTTPAdapter
 
 #
 # prompt
@@ -95,89 +105,544 @@ def training_session(baseurl):
     if not train_type: #classification
         print()
         print("Training your classification model...")
-        data = {"datasetFilenameIn": dataset_filename, "firstModel": new_train, "modelBucket": sess_name}
-        url = baseurl + '/trainSGDClassifier'
-        res = requests.get(url, json=data)
-
-        if res.status_code != 200:
-            print("Failed with status code:", res.status_code)
-            print("url: " + url)
-            if res.status_code == 400:
-                body = res.json()
-                print("Error message:", body)
+        body = train(baseurl, sess_name, train_type, dataset_filename, new_train)
+        if body is None:
             return
-
-        body = res.json()
         print(f"SGDClassifier trained and achieved accuracy of {body}")
     
     else: #regression
        print()
        print("Training your regression model...")
-       data = {"datasetFilenameIn": dataset_filename, "firstModel": new_train, "modelBucket": sess_name}
-       url = baseurl + '/trainSGDRegressor'
-       res = requests.get(url, json=data)
-       
-       if res.status_code != 200:
-          print("Failed with status code:", res.status_code)
-          print("url: " + url)
-          if res.status_code == 400:
-              body = res.json()
-              print("Error message:", body)
+       body = train(baseurl, sess_name, train_type, dataset_filename, new_train)
+       if body is None:
           return
-       body = res.json()
        print(f"SGDRegressor trained and achieved R2 score of {body}")
 
   except Exception as e:
     logging.error("training_session() failed:")
-    logging.error("url: " + url)
     logging.error(e)
     return
 
 
-############################################################
-def upload(baseurl, dataset_filename, sess_name):
+def train(baseurl, sess_name, train_type, dataset_filename, first_model):
   """
-  Uploads a dataset to s3.
+  Trains the next model of a session on a dataset uploaded to it.
 
   Parameters
   ----------
   baseurl: baseurl for web service
-  dataset_filename: name of dataset with .csv suffix
   sess_name: name used for model bucket
+  train_type: 0 for classification, 1 for regression
+  dataset_filename: name the dataset was uploaded under
+  first_model: True to start the session with a new model
 
   Returns
   -------
-  nothing
+  the response body (the score of the new model), or None if the
+  request failed
   """
   try:
-      infile = open(dataset_filename, "rb")
-      bytes = infile.read()
-      infile.close()
+    return get_client(baseurl).train(sess_name, train_type, dataset_filename, first_model)
+  except ServiceError as err:
+    print_failure(err)
+    return None
 
-      data = base64.b64encode(bytes)
-      datastr = data.decode()
 
-      data = {"dataset_filename": dataset_filename, "dataset": datastr, "modelFolder": sess_name}
+############################################################
+PART_SIZE = 8 * 1024 * 1024  # uploadDataset needs parts of at least 5 MiB (except the last)
+PRESIGN_BATCH = 100  # part urls asked for at once, uploadDataset signs at most 100
 
-      url = baseurl + '/uploadDataset'
-      res = requests.post(url, json=data)
 
-      if res.status_code != 200:
-          print("Failed with status code:", res.status_code)
-          print("url: " + url)
-          if res.status_code == 400:
-              body = res.json()
-              print("Error message:", body)
-          return
+def read_parts(dataset_filename, part_size=PART_SIZE, compress=True):
+  """
+  Reads a file one upload part at a time.
+
+  Parameters
+  ----------
+  dataset_filename: path of the file
+  part_size: bytes of the file per part
+  compress: gzip every part (fastest level, csv still shrinks 2-3x)
+
+  Returns
+  -------
+  generator of (part number, part bytes), numbered from 1
+  """
+  with open(dataset_filename, "rb") as infile:
+    partNumber = 1
+    while True:
+      data = infile.read(part_size)
+      if not data:
+        break
+      yield partNumber, (gzip.compress(data, compresslevel=1) if compress else data)
+      partNumber += 1
 
-      print("Dataset uploaded")
-      return
 
+def file_sha256(dataset_filename):
+  """
+  Returns the sha256 hex digest of a file, read one block at a time.
+  """
+  digest = hashlib.sha256()
+  with open(dataset_filename, "rb") as infile:
+    for block in iter(lambda: infile.read(1 << 20), b""):
+      digest.update(block)
+  return digest.hexdigest()
+
+
+def print_failure(err):
+  """
+  Prints the error of a failed request.
+  """
+  print("Failed with status code:", err.status_code)
+  print("url: " + err.url)
+  print("Error message:", err.message)
+
+
+def upload(baseurl, dataset_filename, sess_name, compress=True):
+  """
+  Uploads a dataset to s3 in parts, see Client.upload.
+
+  Parameters
+  ----------
+  baseurl: baseurl for web service
+  dataset_filename: name of dataset with .csv suffix
+  sess_name: name used for model bucket
+  compress: gzip parts on the wire
+
+  Returns
+  -------
+  True if the dataset was uploaded
+  """
+  try:
+    result = get_client(baseurl).upload(dataset_filename, sess_name, compress)
+    if result["linked"]:
+      print("Dataset already stored, linked it to the session")
+      return True
+    if result["resumed"]:
+      print(f"Resumed upload, {result['resumed']} parts were already stored")
+    print("Dataset uploaded")
+    return True
+
+  except ServiceError as err:
+    print_failure(err)
+    return False
   except Exception as e:
       logging.error("upload() failed:")
-      logging.error("url: " + url)
       logging.error(e)
-      return
+      return False
+
+
+############################################################
+# client library
+#
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+class ServiceError(Exception):
+  """
+  A request the web service failed (status_code) or that could not be
+  sent (status_code None).
+  """
+
+  def __init__(self, status_code, message, url):
+    super().__init__(f"{url} failed with status {status_code}: {message}")
+    self.status_code = status_code
+    self.message = message
+    self.url = url
+
+
+class Client:
+  """
+  Programmatic access to the web service.
+
+  One requests.Session pools the connections of every call. Failed calls
+  are retried with exponential backoff and jitter: idempotent ones on
+  connection errors, timeouts and 429/5xx responses, training only when
+  the service cannot have started it (connection timeouts and 429), so a
+  retry never trains a model twice. A client may be shared by threads.
+  """
+
+  def __init__(self, baseurl, retries=3, backoff=0.5, max_backoff=30.0, timeout=900, pool_size=10):
+    self.baseurl = baseurl.rstrip("/")
+    self.retries = retries
+    self.backoff = backoff
+    self.max_backoff = max_backoff
+    self.timeout = timeout
+    self.session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    self.session.mount("https://", adapter)
+    self.session.mount("http://", adapter)
+
+  def close(self):
+    self.session.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
+
+  def _wait(self, attempt, retry_after=None):
+    delay = min(self.max_backoff, self.backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+    try:
+      delay = max(delay, float(retry_after))
+    except (TypeError, ValueError):
+      pass
+    time.sleep(delay)
+
+  def request(self, method, route, idempotent=True, **kwargs):
+    """
+    Sends a request to a route of the web service.
+
+    Parameters
+    ----------
+    method: "GET" or "POST"
+    route: e.g. "/uploadDataset"
+    idempotent: False for calls that must not run twice
+    kwargs: passed to requests (json, params, data, headers)
+
+    Returns
+    -------
+    the json body of the response (its text if it is not json)
+    """
+    return self._send(method, self.baseurl + route, idempotent, **kwargs)
+
+  def _send(self, method, url, idempotent=True, **kwargs):
+    """
+    Sends a request to any url, with the retries of request.
+    """
+    for attempt in range(self.retries + 1):
+      retry_after = None
+      try:
+        res = self.session.request(method, url, timeout=self.timeout, **kwargs)
+      except (requests.ConnectionError, requests.Timeout) as err:
+        if attempt == self.retries or not (idempotent or isinstance(err, requests.ConnectTimeout)):
+          raise ServiceError(None, str(err), url) from err
+      else:
+        if res.status_code == 200:
+          try:
+            return res.json()
+          except ValueError:
+            return res.text
+        if attempt == self.retries or res.status_code not in (RETRY_STATUS if idempotent else (429,)):
+          try:
+            message = res.json()
+          except ValueError:
+            message = res.text
+          raise ServiceError(res.status_code, message, url)
+        retry_after = res.headers.get("Retry-After")
+      self._wait(attempt, retry_after)
+
+  def _part_urls(self, fields, upload_id, part_numbers):
+    """
+    Returns {part number (str): url to PUT the part to}, or None if the
+    service has parts sent through it (its storage cannot sign urls, or
+    it predates "presign").
+    """
+    try:
+      return self.request("POST", '/uploadDataset', json={**fields, "action": "presign", "uploadId": upload_id,
+                                                          "partNumbers": part_numbers})["urls"]
+    except ServiceError as err:
+      if err.status_code != 400:
+        raise
+      return None
+
+  def upload(self, dataset_filename, sess_name, compress=True):
+    """
+    Uploads a dataset in parts, so the file is never held in memory. The
+    upload id is kept in <dataset>.upload until the upload completes, so
+    an interrupted upload of the same file resumes where it stopped.
+
+    Parts go straight to the bucket through presigned urls when the
+    service hands them out: a part sent through the service must fit its
+    6 MB request limit, which an 8 MiB part only does gzipped and
+    compressible.
+
+    The service stores datasets by content. The file's sha256 is sent
+    first, and if the service already holds those bytes the dataset name
+    is linked to them without sending the file.
+
+    Parameters
+    ----------
+    dataset_filename: name of dataset with .csv suffix
+    sess_name: name used for model bucket
+    compress: gzip parts sent through the service (parts PUT to the
+      bucket are stored as sent, so they are never compressed)
+
+    Returns
+    -------
+    {"uploadId", "parts": parts sent, "resumed": parts already stored,
+     "sha256", "linked": True if no bytes had to be sent, "direct": True
+     if the parts went straight to the bucket}
+    """
+    route = '/uploadDataset'
+    fields = {"dataset_filename": dataset_filename, "modelFolder": sess_name}
+    stat = os.stat(dataset_filename)
+    fingerprint = {"modelFolder": sess_name, "size": stat.st_size, "mtime": stat.st_mtime}
+    state_file = dataset_filename + ".upload"
+
+    sha256 = file_sha256(dataset_filename)
+    try:
+      if self.request("POST", route, json={**fields, "action": "link", "sha256": sha256})["linked"]:
+        #an interrupted upload of the file is no longer needed
+        if pathlib.Path(state_file).is_file():
+          with open(state_file) as fp:
+            state = json.load(fp)
+          try:
+            self.request("POST", route, json={**fields, "action": "abort", "uploadId": state["uploadId"]})
+          except ServiceError:
+            pass
+          os.remove(state_file)
+        return {"uploadId": None, "parts": 0, "resumed": 0, "sha256": sha256, "linked": True, "direct": False}
+    except ServiceError as err:
+      #services older than content-addressed datasets do not know "link"
+      if err.status_code != 400:
+        raise
+
+    #resume an interrupted upload of the same file, otherwise start one
+    uploadId = None
+    done = set()
+    if pathlib.Path(state_file).is_file():
+      with open(state_file) as fp:
+        state = json.load(fp)
+      if state.get("fingerprint") == fingerprint:
+        try:
+          body = self.request("POST", route, json={**fields, "action": "status", "uploadId": state["uploadId"]})
+          uploadId = state["uploadId"]
+          done = {part["partNumber"] for part in body["parts"]}
+        except ServiceError:
+          pass
+
+    if uploadId is None:
+      uploadId = self.request("POST", route, json={**fields, "action": "begin"})["uploadId"]
+      with open(state_file, "w") as fp:
+        json.dump({"uploadId": uploadId, "fingerprint": fingerprint}, fp)
+
+    todo = [partNumber for partNumber in range(1, -(-stat.st_size // PART_SIZE) + 1) if partNumber not in done]
+    urls = self._part_urls(fields, uploadId, todo[:PRESIGN_BATCH]) if todo else None
+    direct = urls is not None
+    params = {**fields, "action": "part", "uploadId": uploadId}
+    if compress and not direct:
+      params["encoding"] = "gzip"
+    sent = 0
+    for partNumber, data in read_parts(dataset_filename, PART_SIZE, compress and not direct):
+      if partNumber in done:
+        continue
+      if direct:
+        #urls are signed a batch at a time, so none expires before its part is sent
+        if str(partNumber) not in urls:
+          urls = self._part_urls(fields, uploadId, [n for n in todo if n >= partNumber][:PRESIGN_BATCH])
+          if urls is None:
+            raise ServiceError(None, "the service stopped signing part urls", self.baseurl + route)
+        self._send("PUT", urls[str(partNumber)], data=data)
+      else:
+        self.request("POST", route, params={**params, "partNumber": partNumber}, data=data,
+                     headers={"Content-Type": "application/octet-stream"})
+      sent += 1
+
+    #a completed upload no longer exists, so completing is not retried like the parts
+    self.request("POST", route, idempotent=False, json={**fields, "action": "complete", "uploadId": uploadId, "sha256": sha256})
+    os.remove(state_file)
+    return {"uploadId": uploadId, "parts": sent, "resumed": len(done), "sha256": sha256, "linked": False, "direct": direct}
+
+  def train(self, sess_name, train_type, dataset_filename, first_model, **options):
+    """
+    Trains the next model of a session on a dataset uploaded to it.
+
+    Parameters
+    ----------
+    sess_name: name used for model bucket
+    train_type: 0 for classification, 1 for regression
+    dataset_filename: name the dataset was uploaded under
+    first_model: True to start the session with a new model
+    options: other event fields, e.g. epochs=20, streaming=True,
+      mode="sweep", grid={...}
+
+    Returns
+    -------
+    the response body
+    """
+    route = '/trainSGDRegressor' if train_type else '/trainSGDClassifier'
+    data = {"datasetFilenameIn": dataset_filename, "firstModel": first_model, "modelBucket": sess_name, **options}
+    return self.request("GET", route, idempotent=False, json=data)
+
+  def submit(self, sess_name, train_type, dataset_filename, first_model, **options):
+    """
+    Queues a training step as a job (see train) and returns its job id at
+    once. The id is chosen here, so a retried submit queues the job once.
+    """
+    import uuid
+
+    event = {"datasetFilenameIn": dataset_filename, "firstModel": first_model, "modelBucket": sess_name, **options}
+    data = {"action": "submit", "kind": "train_job_reg" if train_type else "train_job", "event": event, "jobId": uuid.uuid4().hex}
+    return self.request("POST", '/jobs', json=data)["jobId"]
+
+  def job(self, job_id):
+    """
+    Returns the record of a job: its status ("queued", "running",
+    "succeeded", "failed"), progress and, once finished, result or error.
+    """
+    return self.request("GET", '/jobs', json={"action": "status", "jobId": job_id})
+
+  def wait(self, job_id, poll_seconds=2.0, timeout=None, on_progress=None):
+    """
+    Polls a job until it has finished and returns its record.
+
+    Parameters
+    ----------
+    job_id: id returned by submit
+    poll_seconds: time between status requests
+    timeout: seconds to wait before raising TimeoutError, None for no limit
+    on_progress: optional callback(job record) called after every poll
+    """
+    start = time.monotonic()
+    while True:
+      job = self.job(job_id)
+      if on_progress is not None:
+        on_progress(job)
+      if job["status"] in ("succeeded", "failed"):
+        return job
+      if timeout is not None and time.monotonic() - start > timeout:
+        raise TimeoutError(f"job {job_id} is still {job['status']}")
+      time.sleep(poll_seconds)
+
+  def progress(self, sess_name, **options):
+    """
+    Returns the "<model> <metric>" listing of a session, or the json of
+    another view (options view="metrics", view="sweeps" or
+    view="registry").
+    """
+    body = self.request("GET", '/getProgress', json={"modelFolder": sess_name, **options})
+    if options.get("view", "progress") == "progress":
+      return base64.b64decode(body.encode()).decode()
+    return body
+
+  def infer(self, sess_name, model_name, dataset_filename, train_type, **options):
+    """
+    Scores a model of a session on a dataset uploaded to it.
+
+    Parameters
+    ----------
+    sess_name: name used for model bucket
+    model_name: name of the model, None for mode="leaderboard"
+    dataset_filename: name the dataset was uploaded under
+    train_type: 0 for classification, 1 for regression
+    options: other event fields, e.g. mode="predict",
+      mode="leaderboard", topN=5 or refresh=True (recompute memoized scores)
+
+    Returns
+    -------
+    the response body
+    """
+    data = {"datasetFilenameIn": dataset_filename, "modelFolder": sess_name, "trainType": train_type, **options}
+    if model_name is not None:
+      data["modelName"] = model_name
+    return self.request("GET", '/inferModel', json=data)
+
+  def perform(self, op):
+    """
+    Runs one operation given as a dict, as the batch command reads them:
+
+      {"op": "upload", "session": ..., "dataset": ...}
+      {"op": "train", "session": ..., "trainType": 0|1, "dataset": ..., "firstModel": false, "options": {...}}
+      {"op": "infer", "session": ..., "model": ..., "dataset": ..., "trainType": 0|1, "options": {...}}
+      {"op": "progress", "session": ..., "options": {...}}
+      {"op": "submit", ...as train}, {"op": "wait", "jobId": ...}
+
+    Returns
+    -------
+    the result of the matching method
+    """
+    kind = op.get("op")
+    options = op.get("options", {})
+    if kind == "upload":
+      return self.upload(op["dataset"], op["session"], op.get("compress", True))
+    if kind == "train":
+      return self.train(op["session"], op["trainType"], op["dataset"], op.get("firstModel", False), **options)
+    if kind == "infer":
+      return self.infer(op["session"], op.get("model"), op["dataset"], op["trainType"], **options)
+    if kind == "progress":
+      return self.progress(op["session"], **options)
+    if kind == "submit":
+      return {"jobId": self.submit(op["session"], op["trainType"], op["dataset"], op.get("firstModel", False), **options)}
+    if kind == "wait":
+      return self.wait(op["jobId"])
+    raise ValueError(f"unknown operation {kind!r}")
+
+
+class AsyncClient:
+  """
+  asyncio front end of Client for issuing many session operations at
+  once: every call runs on one of max_concurrency threads that share the
+  client's connection pool.
+
+    async with AsyncClient(baseurl) as client:
+      results = await asyncio.gather(*(client.progress(name) for name in names))
+  """
+
+  def __init__(self, baseurl, max_concurrency=10, **client_options):
+    self.client = Client(baseurl, pool_size=max_concurrency, **client_options)
+    self.executor = ThreadPoolExecutor(max_workers=max_concurrency)
+
+  async def close(self):
+    self.executor.shutdown(wait=True)
+    self.client.close()
+
+  async def __aenter__(self):
+    return self
+
+  async def __aexit__(self, *exc_info):
+    await self.close()
+
+  async def _run(self, fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(self.executor, lambda: fn(*args, **kwargs))
+
+  async def upload(self, *args, **kwargs):
+    return await self._run(self.client.upload, *args, **kwargs)
+
+  async def train(self, *args, **kwargs):
+    return await self._run(self.client.train, *args, **kwargs)
+
+  async def progress(self, *args, **kwargs):
+    return await self._run(self.client.progress, *args, **kwargs)
+
+  async def infer(self, *args, **kwargs):
+    return await self._run(self.client.infer, *args, **kwargs)
+
+  async def submit(self, *args, **kwargs):
+    return await self._run(self.client.submit, *args, **kwargs)
+
+  async def job(self, *args, **kwargs):
+    return await self._run(self.client.job, *args, **kwargs)
+
+  async def wait(self, job_id, poll_seconds=2.0, timeout=None):
+    """
+    Polls a job like Client.wait, sleeping in the event loop between polls.
+    """
+    start = time.monotonic()
+    while True:
+      job = await self.job(job_id)
+      if job["status"] in ("succeeded", "failed"):
+        return job
+      if timeout is not None and time.monotonic() - start > timeout:
+        raise TimeoutError(f"job {job_id} is still {job['status']}")
+      await asyncio.sleep(poll_seconds)
+
+  async def perform(self, op):
+    return await self._run(self.client.perform, op)
+
+
+_clients = {}
+
+
+def get_client(baseurl):
+  """
+  Returns the shared Client of a web service, so every call of the
+  interactive client reuses its connections.
+  """
+  if baseurl not in _clients:
+    _clients[baseurl] = Client(baseurl)
+  return _clients[baseurl]
 
 
 ############################################################
@@ -208,26 +673,7 @@ def inference(baseurl):
     print()
     print("Getting list of models and their performance metrics...")
     print()
-    data = {"modelFolder": sess_name}
-
-    url = baseurl + '/getProgress'
-    res = requests.get(url, json=data)
-
-    if res.status_code != 200:
-          print("Failed with status code:", res.status_code)
-          print("url: " + url)
-          if res.status_code == 400:
-              body = res.json()
-              print("Error message:", body)
-          return
-    
-    body = res.json()
-
-    datastr = body
-
-    base64_bytes = datastr.encode()
-    bytes = base64.b64decode(base64_bytes)
-    results = bytes.decode()
+    results = get_client(baseurl).progress(sess_name)
     print(results)
 
     print()
@@ -255,74 +701,225 @@ def inference(baseurl):
 
     print()
     print(f"Inferring from model {modelName}...")
-    data = {"datasetFilenameIn": dataset_filename, "modelName": modelName, "modelFolder": sess_name}
-    url = baseurl + '/inferModel'
-    res = requests.get(url, json=data)
-    
-    if res.status_code != 200:
-      print("Failed with status code:", res.status_code)
-      print("url: " + url)
-      if res.status_code == 400:
-          body = res.json()
-          print("Error message:", body)
-      return
-    
-    body = res.json()
+    body = get_client(baseurl).infer(sess_name, modelName, dataset_filename, int(model_type))
     if(not int(model_type)): #classifier
       print(f"{modelName} achieved an accuracy of {body}")
     else: #regressor
       print(f"{modelName} achieved a R2 score of {body}")
 
 
+  except ServiceError as err:
+    print_failure(err)
+    return
   except Exception as e:
     logging.error("inference() failed:")
-    logging.error("url: " + url)
     logging.error(e)
     return
 
 ############################################################
-# main
-try:
-  print('** Welcome to Incremental Learning Experimenter **')
-  print()
-
-  # eliminate traceback so we just get error message:
-  sys.tracebacklimit = 0
+# command line
+#
+async def run_batch(client, operations):
+  """
+  Runs operations concurrently across sessions: the operations of one
+  session run in the given order, and a failed one skips the rest of
+  its session.
 
-  config_file = 'inc_learn_config.ini'
-  if not pathlib.Path(config_file).is_file():
-    print("**ERROR: config file '", config_file, "' does not exist, exiting")
-    sys.exit(0)
+  Parameters
+  ----------
+  client: AsyncClient
+  operations: list of (line number, operation dict), see Client.perform
 
+  Returns
+  -------
+  list of result dicts in the order of operations
+  """
+  sessions = {}
+  for line, op in operations:
+    sessions.setdefault(op.get("session"), []).append((line, op))
+
+  results = {}
+
+  async def run_session(ops):
+    failed = False
+    for line, op in ops:
+      result = {"line": line, "op": op.get("op"), "session": op.get("session")}
+      if failed:
+        result["ok"] = False
+        result["error"] = "skipped after an earlier failure in the session"
+      else:
+        try:
+          result["result"] = await client.perform(op)
+          result["ok"] = True
+        except (ServiceError, ValueError, KeyError, OSError) as err:
+          result["ok"] = False
+          result["error"] = str(err)
+          failed = True
+      results[line] = result
+      print(json.dumps(result), flush=True)
+
+  await asyncio.gather(*(run_session(ops) for ops in sessions.values()))
+  return [results[line] for line, _ in operations]
+
+
+def read_baseurl(config_file):
   configur = ConfigParser()
   configur.read(config_file)
-  baseurl = configur.get('client', 'webservice')
-  if len(baseurl) < 16:
-    print("**ERROR: baseurl '", baseurl, "' is not nearly long enough...")
-    sys.exit(0)
+  return configur.get('client', 'webservice').rstrip("/")
+
+
+def cli(argv):
+  """
+  Non-interactive commands; prints json results and returns the exit
+  status.
+  """
+  parser = argparse.ArgumentParser(prog="client.py", description="Incremental Learning Experimenter client")
+  parser.add_argument("--config", default="inc_learn_config.ini", help="client config with the web service url")
+  parser.add_argument("--baseurl", help="web service url (instead of --config)")
+  parser.add_argument("--retries", type=int, default=3)
+  parser.add_argument("--timeout", type=float, default=900, help="seconds per request")
+  commands = parser.add_subparsers(dest="command", required=True)
+
+  def add_task(command):
+    task = command.add_mutually_exclusive_group(required=True)
+    task.add_argument("--classification", dest="train_type", action="store_const", const=0)
+    task.add_argument("--regression", dest="train_type", action="store_const", const=1)
+
+  command = commands.add_parser("upload", help="upload datasets to a session")
+  command.add_argument("--session", required=True)
+  command.add_argument("datasets", nargs="+")
+
+  command = commands.add_parser("train", help="train the next model of a session")
+  command.add_argument("--session", required=True)
+  add_task(command)
+  command.add_argument("--new", action="store_true", help="start the session with a new model")
+  command.add_argument("--upload", action="store_true", help="upload the dataset first")
+  command.add_argument("--options", type=json.loads, default={}, help='other event fields as json, e.g. \'{"epochs": 20}\'')
+  command.add_argument("--submit", action="store_true", help="queue the step as a job and print its id")
+  command.add_argument("--wait", action="store_true", help="with --submit, poll the job until it finishes")
+  command.add_argument("dataset")
+
+  command = commands.add_parser("job", help="show (or wait for) a training job")
+  command.add_argument("--wait", action="store_true", help="poll the job until it finishes")
+  command.add_argument("job_id")
+
+  command = commands.add_parser("progress", help="list the models of a session")
+  command.add_argument("--session", required=True)
+  command.add_argument("--view", choices=["progress", "metrics", "sweeps", "registry"], default="progress")
+
+  command = commands.add_parser("infer", help="score, predict with or rank the models of a session")
+  command.add_argument("--session", required=True)
+  add_task(command)
+  command.add_argument("--model", help="model name (not needed with --mode leaderboard or invalidate)")
+  command.add_argument("--mode", choices=["score", "predict", "leaderboard", "invalidate"], default="score")
+  command.add_argument("--upload", action="store_true", help="upload the dataset first")
+  command.add_argument("--refresh", action="store_true", help="recompute scores instead of reading memoized ones")
+  command.add_argument("--options", type=json.loads, default={}, help="other event fields as json")
+  command.add_argument("dataset")
+
+  command = commands.add_parser("batch", help="run json-lines operations, sessions concurrently")
+  command.add_argument("--concurrency", type=int, default=10, help="requests in flight")
+  command.add_argument("file", help="json-lines file of operations, - for stdin")
+
+  args = parser.parse_args(argv)
+  if args.baseurl is None and not pathlib.Path(args.config).is_file():
+    parser.error(f"config file '{args.config}' does not exist, pass --baseurl")
+  baseurl = args.baseurl or read_baseurl(args.config)
+  client_options = {"retries": args.retries, "timeout": args.timeout}
+
+  if args.command == "batch":
+    fp = sys.stdin if args.file == "-" else open(args.file)
+    with fp:
+      operations = [(line, json.loads(text)) for line, text in enumerate(fp, start=1) if text.strip()]
+
+    async def batch():
+      async with AsyncClient(baseurl, args.concurrency, **client_options) as client:
+        return await run_batch(client, operations)
+
+    results = asyncio.run(batch())
+    return 0 if all(result["ok"] for result in results) else 1
+
+  with Client(baseurl, **client_options) as client:
+    try:
+      if args.command == "upload":
+        for dataset_filename in args.datasets:
+          print(json.dumps({"dataset": dataset_filename, **client.upload(dataset_filename, args.session)}))
+      elif args.command == "train":
+        if args.upload:
+          client.upload(args.dataset, args.session)
+        if args.submit:
+          jobId = client.submit(args.session, args.train_type, args.dataset, args.new, **args.options)
+          print(json.dumps(client.wait(jobId) if args.wait else {"jobId": jobId}))
+        else:
+          print(json.dumps(client.train(args.session, args.train_type, args.dataset, args.new, **args.options)))
+      elif args.command == "job":
+        job = client.wait(args.job_id) if args.wait else client.job(args.job_id)
+        print(json.dumps(job))
+        return 1 if job["status"] == "failed" else 0
+      elif args.command == "progress":
+        result = client.progress(args.session, view=args.view)
+        print(result if args.view == "progress" else json.dumps(result))
+      elif args.command == "infer":
+        if args.model is None and args.mode not in ("leaderboard", "invalidate"):
+          parser.error("--model is required unless --mode is leaderboard or invalidate")
+        if args.upload:
+          client.upload(args.dataset, args.session)
+        options = {"mode": args.mode, **({"refresh": True} if args.refresh else {}), **args.options}
+        print(json.dumps(client.infer(args.session, args.model, args.dataset, args.train_type, **options)))
+    except ServiceError as err:
+      print(json.dumps({"error": err.message, "statusCode": err.status_code, "url": err.url}))
+      return 1
+  return 0
+
+
+############################################################
+# main
+if __name__ == "__main__":
+  #with a command, run it without prompts
+  if len(sys.argv) > 1:
+    sys.exit(cli(sys.argv[1:]))
+
+  try:
+    print('** Welcome to Incremental Learning Experimenter **')
+    print()
+
+    # eliminate traceback so we just get error message:
+    sys.tracebacklimit = 0
+
+    config_file = 'inc_learn_config.ini'
+    if not pathlib.Path(config_file).is_file():
+      print("**ERROR: config file '", config_file, "' does not exist, exiting")
+      sys.exit(0)
+
+    configur = ConfigParser()
+    configur.read(config_file)
+    baseurl = configur.get('client', 'webservice')
+    if len(baseurl) < 16:
+      print("**ERROR: baseurl '", baseurl, "' is not nearly long enough...")
+      sys.exit(0)
 
-  lastchar = baseurl[len(baseurl) - 1]
-  if lastchar == "/":
-    baseurl = baseurl[:-1]
+    lastchar = baseurl[len(baseurl) - 1]
+    if lastchar == "/":
+      baseurl = baseurl[:-1]
 
   
-  # main processing loop:
-  cmd = prompt()
-
-  while cmd != 0:
-    if cmd == 1:
-      training_session(baseurl)
-    elif cmd == 2:
-      inference(baseurl)
-    else:
-      print("** Unknown command, try again...")
+    # main processing loop:
     cmd = prompt()
 
-  print()
-  print('** done **')
-  sys.exit(0)
+    while cmd != 0:
+      if cmd == 1:
+        training_session(baseurl)
+      elif cmd == 2:
+        inference(baseurl)
+      else:
+        print("** Unknown command, try again...")
+      cmd = prompt()
 
-except Exception as e:
-  logging.error("**ERROR: main() failed:")
-  logging.error(e)
-  sys.exit(0)
\ No newline at end of file
+    print()
+    print('** done **')
+    sys.exit(0)
+
+  except Exception as e:
+    logging.error("**ERROR: main() failed:")
+    logging.error(e)
+    sys.exit(0)
\ No newline at end of file
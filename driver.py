@@ -0,0 +1,171 @@
+"""
+Runs an incremental-learning experiment without prompts: uploads an
+ordered list of chunk files to a session and trains the next model on
+each, e.g.
+
+  python driver.py --session cal --regression --new datasets/calhouse*.csv
+
+Uploads run ahead of training on a background thread, so chunk n+1 is
+uploaded while the model is trained on chunk n. Training requests are
+sent one at a time in chunk order, each only after the previous one
+succeeded, so the session's models form one lineage in chunk order. A
+failed upload or training step stops the run.
+
+The web service is read from inc_learn_config.ini, as client.py does.
+"""
+import argparse
+import json
+import pathlib
+import re
+import sys
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from configparser import ConfigParser
+
+import client
+
+
+def natural_key(path):
+  """
+  Sort key that orders calhouse2.csv before calhouse10.csv.
+  """
+  return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", path)]
+
+
+def timed_upload(baseurl, dataset_filename, sess_name):
+  """
+  Uploads a dataset and returns (uploaded?, seconds).
+  """
+  start = time.perf_counter()
+  ok = client.upload(baseurl, dataset_filename, sess_name)
+  return ok, time.perf_counter() - start
+
+
+def run(baseurl, sess_name, train_type, dataset_filenames, new_session, lookahead=1):
+  """
+  Uploads and trains on every chunk in order, overlapping uploads with
+  training.
+
+  Parameters
+  ----------
+  baseurl: baseurl for web service
+  sess_name: name used for model bucket
+  train_type: 0 for classification, 1 for regression
+  dataset_filenames: chunk files in training order
+  new_session: True to start the session with a new model on the first chunk
+  lookahead: chunks uploaded ahead of the one being trained, 0 runs
+    every upload and training step one after another
+
+  Returns
+  -------
+  summary dict with per-step times and scores, see summarize
+  """
+  steps = []
+  start = time.perf_counter()
+  with ThreadPoolExecutor(max_workers=1) as uploader:
+    pending = {}
+
+    def schedule(i):
+      if i < len(dataset_filenames) and i not in pending:
+        pending[i] = uploader.submit(timed_upload, baseurl, dataset_filenames[i], sess_name)
+
+    for i, dataset_filename in enumerate(dataset_filenames):
+      #block until this chunk is uploaded
+      schedule(i)
+      wait_start = time.perf_counter()
+      ok, upload_seconds = pending.pop(i).result()
+      waited = time.perf_counter() - wait_start
+      step = {"dataset": dataset_filename, "uploadSeconds": upload_seconds, "waitSeconds": waited}
+      steps.append(step)
+      if not ok:
+        step["error"] = "upload failed"
+        break
+      #the next chunks upload while this one trains
+      for j in range(i + 1, i + 1 + lookahead):
+        schedule(j)
+
+      print(f"Training on {dataset_filename} ({i + 1}/{len(dataset_filenames)})...")
+      train_start = time.perf_counter()
+      body = client.train(baseurl, sess_name, train_type, dataset_filename, new_session and i == 0)
+      step["trainSeconds"] = time.perf_counter() - train_start
+      if body is None:
+        step["error"] = "training failed"
+        break
+      step["score"] = body.get("accuracy") if isinstance(body, dict) else body
+      print(f"{dataset_filename}: {step['score']}")
+
+    for future in pending.values():
+      future.cancel()
+
+  return summarize(steps, time.perf_counter() - start, len(dataset_filenames))
+
+
+def summarize(steps, wall_seconds, n_chunks):
+  """
+  Returns the end-to-end summary of a run: wall-clock time, the time
+  spent uploading and training, and how much of the upload time was
+  hidden behind training.
+  """
+  upload_seconds = sum(step["uploadSeconds"] for step in steps)
+  train_seconds = sum(step.get("trainSeconds", 0) for step in steps)
+  return {
+    "chunks": n_chunks,
+    "trained": sum(1 for step in steps if "score" in step),
+    "completed": len(steps) == n_chunks and "error" not in steps[-1],
+    "wallSeconds": wall_seconds,
+    "uploadSeconds": upload_seconds,
+    "trainSeconds": train_seconds,
+    "waitSeconds": sum(step["waitSeconds"] for step in steps),
+    "overlapSeconds": max(0.0, upload_seconds + train_seconds - wall_seconds),
+    "steps": steps,
+  }
+
+
+def print_summary(summary):
+  print()
+  print(f"{'dataset':<28}{'upload':>9}{'wait':>9}{'train':>9}  score")
+  for step in summary["steps"]:
+    print(f"{step['dataset']:<28}{step['uploadSeconds']:>9.2f}{step['waitSeconds']:>9.2f}"
+          f"{step.get('trainSeconds', 0):>9.2f}  {step.get('score', step.get('error'))}")
+  print()
+  print(f"trained {summary['trained']}/{summary['chunks']} chunks in {summary['wallSeconds']:.2f} s wall clock "
+        f"(upload {summary['uploadSeconds']:.2f} s, train {summary['trainSeconds']:.2f} s, "
+        f"{summary['overlapSeconds']:.2f} s of upload overlapped with training)")
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+  parser.add_argument("datasets", nargs="+", help="chunk csv files, trained in the given order")
+  parser.add_argument("--session", required=True, help="session (model bucket) name")
+  task = parser.add_mutually_exclusive_group(required=True)
+  task.add_argument("--classification", dest="train_type", action="store_const", const=0)
+  task.add_argument("--regression", dest="train_type", action="store_const", const=1)
+  parser.add_argument("--new", action="store_true", help="start a new session with the first chunk")
+  parser.add_argument("--sort", action="store_true", help="order the chunks by name, numbers compared as numbers")
+  parser.add_argument("--lookahead", type=int, default=1, help="chunks uploaded ahead of the one being trained (0: no overlap)")
+  parser.add_argument("--config", default="inc_learn_config.ini", help="client config with the web service url")
+  parser.add_argument("--json", help="also write the summary as json to this file")
+  args = parser.parse_args()
+
+  dataset_filenames = sorted(args.datasets, key=natural_key) if args.sort else args.datasets
+  for dataset_filename in dataset_filenames:
+    if not dataset_filename.endswith(".csv") or not pathlib.Path(dataset_filename).is_file():
+      parser.error(f"'{dataset_filename}' is not a csv file")
+
+  if not pathlib.Path(args.config).is_file():
+    parser.error(f"config file '{args.config}' does not exist")
+  configur = ConfigParser()
+  configur.read(args.config)
+  baseurl = configur.get('client', 'webservice').rstrip("/")
+
+  summary = run(baseurl, args.session, args.train_type, dataset_filenames, args.new, max(0, args.lookahead))
+  print_summary(summary)
+  if args.json:
+    with open(args.json, "w") as fp:
+      json.dump(summary, fp, indent=2)
+  sys.exit(0 if summary["completed"] else 1)
+
+
+if __name__ == "__main__":
+  main()
@@ -1,34 +1,43 @@
 import json
-import boto3
 import os
+import sys
 import base64
 
 
-from configparser import ConfigParser
+# shared code (inclearn) ships as a lambda layer; in a checkout it lives next to this folder
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from inclearn import instrument, metricslog, runtime
+from inclearn.registry import load_registry, registry_from_listing
 
+
+def event_number(event, name, convert, default=None, minimum=None):
+  """
+  Returns event[name] converted with convert (int or float), or default
+  if it is absent or null. Query strings and the CLI send numbers as
+  strings, so "5" is accepted; anything else raises with the field name.
+  """
+  value = event.get(name)
+  if value is None:
+    return default
+  try:
+    number = convert(value)
+  except (TypeError, ValueError):
+    raise Exception(f"{name} must be {'an integer' if convert is int else 'a number'}, not {json.dumps(value)}")
+  if minimum is not None and number < minimum:
+    raise Exception(f"{name} must be at least {minimum}, not {number}")
+  return number
+
+
+@instrument.handler("get_models")
 def lambda_handler(event, context):
   try:
     print("**STARTING**")
     
     #
-    # setup AWS based on config file:
-    #
-    config_file = 'config.ini'
-    os.environ['AWS_SHARED_CREDENTIALS_FILE'] = config_file
-    
-    configur = ConfigParser()
-    configur.read(config_file)
-    
-    #
-    # configure for S3 access:
+    # config and storage access are set up once per container and reused
+    # by warm invocations:
     #
-    s3_profile = 's3readwrite'
-    boto3.setup_default_session(profile_name=s3_profile)
-    
-    bucketname = configur.get('s3', 'bucket_name')
-    
-    s3_resource = boto3.resource('s3')
-    bucket = s3_resource.Bucket(bucketname)
+    storage = runtime.get_storage()
     
     modelFolder = ""
     #check for name of folder to store model artifacts, progress.txt, datasets
@@ -37,15 +46,53 @@ def lambda_handler(event, context):
     else:
         raise Exception("requires model folder name in event")
     
-    print(f"modelFolder: {modelFolder}")
+    #"progress" (default) returns the "<model> <metric>" listing, "metrics"
+    #a page of the trained models' metrics records, "sweeps" a page of the
+    #records of sweep candidates, "registry" the model manifest
+    view = event.get("view", "progress")
 
-    #get progress of models
-    local_file_path = "/tmp/" + "progress.txt"
-    progress_file_path = os.path.join(modelFolder,"progress.txt")
-    bucket.download_file(progress_file_path, local_file_path)
+    print(f"modelFolder: {modelFolder}, view: {view}")
 
-    with open(local_file_path, "rb") as fp:
-      bytes = fp.read()
+    if view == "registry":
+      registry = load_registry(storage, modelFolder)
+      if registry is None:
+        registry = registry_from_listing(storage, modelFolder)
+      return {
+        'statusCode': 200,
+        'body': json.dumps(registry)
+      }
+    elif view in ("metrics", "sweeps"):
+      #checked before reading the log, so a bad value fails fast with its name
+      options = {
+        "offset": event_number(event, "offset", int, 0, minimum=0),
+        "limit": event_number(event, "limit", int, 100, minimum=1),
+        "min_metric": event_number(event, "minMetric", float),
+        "max_metric": event_number(event, "maxMetric", float),
+        "top_k": event_number(event, "topK", int, minimum=1),
+        "kind": "model" if view == "metrics" else "sweep",
+      }
+      #a plain page only reads the segments it spans
+      with instrument.span("query"):
+        page = metricslog.query_log(storage, modelFolder, **options)
+      instrument.count("records", len(page["records"]))
+      return {
+        'statusCode': 200,
+        'body': json.dumps(page)
+      }
+    elif view != "progress":
+      raise Exception(f"unknown view '{view}'")
+
+    #get progress of models
+    #the log includes the progress.txt lines of sessions trained before it
+    records = metricslog.read_records(storage, modelFolder, kind="model")
+    instrument.count("records", len(records))
+    if records:
+      with instrument.span("render"):
+        bytes = metricslog.render_progress(records).encode()
+    else:
+      #an unknown session fails here
+      progress_file_path = os.path.join(modelFolder,"progress.txt")
+      bytes = storage.get_bytes(progress_file_path)
     
     data = base64.b64encode(bytes)
     datastr = data.decode()
@@ -0,0 +1,7 @@
+"""
+Code shared by the Incremental Learning Experimenter lambda functions.
+
+The package is deployed as a Lambda layer (python/inclearn/ inside the
+layer zip) so every handler can import it; in a checkout it sits next to
+the handler folders.
+"""
@@ -0,0 +1,41 @@
+"""
+Model artifacts stored in a session.
+
+A .joblib model file holds a dict bundling the estimator with the
+StandardScaler whose running statistics were accumulated over every chunk
+the model was trained on:
+
+  {"format": 1, "model": <SGDClassifier/SGDRegressor>, "scaler": <StandardScaler>}
+
+Models written before the scaler was persisted are bare estimators; they
+unpack with scaler None.
+"""
+import io
+
+FORMAT = 1
+
+
+def dump_model(model, scaler):
+  """
+  Serializes a model and its scaler.
+
+  Returns
+  -------
+  the artifact object and its joblib bytes
+  """
+  import joblib
+
+  artifact = {"format": FORMAT, "model": model, "scaler": scaler}
+  with io.BytesIO() as fp:
+    joblib.dump(artifact, fp)
+    return artifact, fp.getvalue()
+
+
+def unpack(artifact):
+  """
+  Returns (model, scaler) from a loaded artifact; scaler is None for
+  models saved as bare estimators.
+  """
+  if isinstance(artifact, dict) and "model" in artifact:
+    return artifact["model"], artifact.get("scaler")
+  return artifact, None
@@ -0,0 +1,81 @@
+"""
+Binary columnar form of a csv dataset.
+
+A dataset is stored as a 2-D .npy array of shape (columns, rows): one row
+of the array per csv column, target last. The .npy header records the
+dtype and shape, so the feature count is shape[0] - 1. The file can be
+memory-mapped and read without any parsing.
+"""
+import numpy as np
+
+from inclearn.csvdata import CHUNK_ROWS, check_dtype, count_rows, iter_csv_chunks, read_header
+
+SUFFIX = ".npy"
+
+
+def columnar_name(csv_name):
+  """
+  Returns the name the columnar form of csv_name is stored under.
+  """
+  return csv_name + SUFFIX
+
+
+def csv_to_columnar(csv_path, npy_path, dtype=np.float64, chunk_rows=CHUNK_ROWS):
+  """
+  Converts a csv dataset into its columnar .npy form. The csv is parsed
+  chunk by chunk into a memory-mapped output file, so memory use does not
+  depend on the size of the dataset.
+
+  Parameters
+  ----------
+  csv_path: path to csv file
+  npy_path: path of the .npy file to write
+  dtype: floating point dtype of the stored values
+  chunk_rows: rows parsed per chunk
+
+  Returns
+  -------
+  shape of the stored array (columns, rows)
+  """
+  dtype = check_dtype(dtype)
+  with open(csv_path, "r") as fp:
+    n_columns = len(read_header(fp, has_target=False))
+  n = count_rows(csv_path)
+
+  out = np.lib.format.open_memmap(npy_path, mode="w+", dtype=dtype, shape=(n_columns, n))
+  filled = 0
+  for chunk in iter_csv_chunks(csv_path, chunk_rows, dtype, has_target=False):
+    out[:, filled:filled + chunk.shape[0]] = chunk.T
+    filled += chunk.shape[0]
+  out.flush()
+
+  if filled < n:
+    # blank lines were counted as rows, rewrite without the unused tail
+    trimmed = np.array(out[:, :filled])
+    del out
+    np.save(npy_path, trimmed)
+    return trimmed.shape
+  return out.shape
+
+
+def load_columnar(npy_path, has_target=True, mmap=True):
+  """
+  Opens a columnar dataset.
+
+  Parameters
+  ----------
+  npy_path: path to .npy file written by csv_to_columnar
+  has_target: True if the last column is the target
+  mmap: memory-map the file instead of reading it into memory
+
+  Returns
+  -------
+  X, y: (rows, features) view and (rows,) target view; y is None when
+  has_target is False
+  """
+  data = np.load(npy_path, mmap_mode="r" if mmap else None)
+  if data.ndim != 2 or data.shape[0] < 1 + int(has_target):
+    raise ValueError(f"{npy_path} is not a columnar dataset")
+  if has_target:
+    return data[:-1].T, data[-1]
+  return data.T, None
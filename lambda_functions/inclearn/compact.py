@@ -0,0 +1,233 @@
+"""
+Compact storage format for linear SGD models.
+
+Training writes model<uuid>.npz next to model<uuid>.joblib. It is an
+uncompressed npz with two members, so it stays a few hundred bytes and
+loads with one zip read:
+
+  header  utf-8 json, stored as a uint8 array
+  data    every fitted array, flattened into one float32/float64 vector
+
+  header = {"format": "inclearn.linear", "version": 1,
+            "estimator": "SGDClassifier", "params": {non-default params},
+            "state": {"t_": ..., "n_iter_": ...}, "nFeatures": 8,
+            "classes": [0.0, 1.0],
+            "arrays": {"coef": [offset, [1, 8]], "intercept": [8, [1]], ...},
+            "scaler": {"n_samples_seen_": 825, "with_mean": true, "with_std": true}}
+
+The arrays are coef, intercept and, with a scaler, mean, var and scale.
+A model fitted with average=True also keeps standard_coef,
+standard_intercept, average_coef and average_intercept, the state its
+next partial_fit continues from. Loading needs numpy only: load_compact returns a LinearScorer that
+predicts and scores without sklearn, and LinearScorer.to_estimator
+rebuilds the sklearn estimator and scaler when training must continue.
+"""
+import io
+import json
+
+import numpy as np
+
+FORMAT = "inclearn.linear"
+VERSION = 1
+SUFFIX = ".npz"
+ESTIMATORS = ("SGDClassifier", "SGDRegressor")
+# private state of an average=True model, stored without the underscore
+AVERAGE_STATE = ("_standard_coef", "_standard_intercept", "_average_coef", "_average_intercept")
+
+
+def compact_name(name):
+  """
+  Returns the compact file name of a .joblib model name or key.
+  """
+  if name.endswith(".joblib"):
+    name = name[:-len(".joblib")]
+  return name + SUFFIX
+
+
+def dump_compact(model, scaler, dtype="float64"):
+  """
+  Serializes a fitted SGDClassifier/SGDRegressor and its scaler.
+
+  Parameters
+  ----------
+  model: fitted SGDClassifier or SGDRegressor
+  scaler: fitted StandardScaler, or None
+  dtype: "float64", or "float32" to halve the arrays (scores may then
+    differ from the estimator's in the last digits)
+
+  Returns
+  -------
+  npz bytes
+  """
+  estimator = type(model).__name__
+  if estimator not in ESTIMATORS:
+    raise ValueError(f"no compact format for {estimator}")
+
+  defaults = type(model)().get_params()
+  header = {
+    "format": FORMAT,
+    "version": VERSION,
+    "estimator": estimator,
+    "params": {name: value for name, value in model.get_params().items() if defaults.get(name) != value},
+    "state": {"t_": float(model.t_), "n_iter_": int(model.n_iter_)},
+    "nFeatures": int(model.n_features_in_),
+    "classes": model.classes_.tolist() if estimator == "SGDClassifier" else None,
+    "arrays": {},
+    "scaler": None,
+  }
+  arrays = {"coef": model.coef_, "intercept": model.intercept_}
+  for name in AVERAGE_STATE:
+    if getattr(model, name, None) is not None:
+      arrays[name[1:]] = getattr(model, name)
+  if scaler is not None:
+    header["scaler"] = {
+      "n_samples_seen_": int(scaler.n_samples_seen_),
+      "with_mean": bool(scaler.with_mean),
+      "with_std": bool(scaler.with_std),
+    }
+    for name in ("mean", "var", "scale"):
+      value = getattr(scaler, name + "_")
+      if value is not None:
+        arrays[name] = value
+
+  offset = 0
+  for name, value in arrays.items():
+    header["arrays"][name] = [offset, list(np.shape(value))]
+    offset += np.size(value)
+  data = np.empty(offset, dtype=dtype)
+  for name, value in arrays.items():
+    start, shape = header["arrays"][name]
+    data[start:start + np.size(value)] = np.ravel(value)
+
+  with io.BytesIO() as fp:
+    np.savez(fp, header=np.frombuffer(json.dumps(header).encode(), dtype=np.uint8), data=data)
+    return fp.getvalue()
+
+
+def load_compact(source):
+  """
+  Loads a compact model.
+
+  Parameters
+  ----------
+  source: npz bytes, a path or a binary file object
+
+  Returns
+  -------
+  LinearScorer
+  """
+  if isinstance(source, (bytes, bytearray, memoryview)):
+    source = io.BytesIO(source)
+  with np.load(source, allow_pickle=False) as npz:
+    header = json.loads(npz["header"].tobytes())
+    data = npz["data"]
+  if header.get("format") != FORMAT or header.get("version", 0) > VERSION:
+    raise ValueError(f"unsupported model format {header.get('format')} version {header.get('version')}")
+
+  arrays = {}
+  for name, (start, shape) in header["arrays"].items():
+    arrays[name] = data[start:start + int(np.prod(shape))].reshape(shape)
+  return LinearScorer(header, arrays)
+
+
+def scorer_from_estimator(model, scaler):
+  """
+  Returns the LinearScorer of a fitted estimator and scaler, e.g. of a
+  model saved before the compact form existed.
+  """
+  return load_compact(dump_compact(model, scaler))
+
+
+class LinearScorer:
+  """
+  Scoring-only view of a compact model: the scaler and the linear model
+  applied with numpy.
+  """
+
+  def __init__(self, header, arrays):
+    self.header = header
+    self.arrays = arrays
+    self.is_classifier = header["estimator"] == "SGDClassifier"
+    self.n_features = header["nFeatures"]
+    self.coef = np.atleast_2d(arrays["coef"])
+    self.intercept = arrays["intercept"]
+    self.classes = None if header.get("classes") is None else np.array(header["classes"])
+    scaler = header.get("scaler")
+    self.mean = arrays.get("mean") if scaler and scaler["with_mean"] else None
+    self.scale = arrays.get("scale") if scaler and scaler["with_std"] else None
+
+  def transform(self, X):
+    """
+    Applies the stored scaler statistics to X.
+    """
+    if self.mean is not None:
+      X = X - self.mean
+    if self.scale is not None:
+      X = X / self.scale
+    return X
+
+  def decision_function(self, X):
+    """
+    Returns the linear scores of unscaled rows X.
+    """
+    scores = self.transform(np.asarray(X, dtype=np.float64)) @ self.coef.T + self.intercept
+    return scores.ravel() if scores.shape[1] == 1 else scores
+
+  def predict(self, X):
+    scores = self.decision_function(X)
+    if not self.is_classifier:
+      return scores
+    if scores.ndim == 1:
+      return self.classes[(scores > 0).astype(np.intp)]
+    return self.classes[np.argmax(scores, axis=1)]
+
+  def score(self, X, y):
+    """
+    Returns accuracy for a classifier, R2 for a regressor, as the
+    estimator's score method does.
+    """
+    y_pred = self.predict(X)
+    if self.is_classifier:
+      return float(np.mean(y_pred == y))
+    sse = float(np.sum((y - y_pred) ** 2))
+    sst = float(np.sum((y - np.mean(y)) ** 2))
+    if sst == 0:
+      return 1.0 if sse == 0 else 0.0
+    return 1.0 - sse / sst
+
+  def to_estimator(self):
+    """
+    Rebuilds the sklearn estimator and scaler, e.g. to continue training.
+
+    Returns
+    -------
+    model, scaler (None if none was stored)
+    """
+    import sklearn.linear_model
+    from sklearn.preprocessing import StandardScaler
+
+    header = self.header
+    model = getattr(sklearn.linear_model, header["estimator"])(**header["params"])
+    model.coef_ = np.array(self.arrays["coef"], dtype=np.float64)
+    model.intercept_ = np.array(self.intercept, dtype=np.float64)
+    if self.is_classifier:
+      model.classes_ = self.classes
+    model.t_ = header["state"]["t_"]
+    model.n_iter_ = header["state"]["n_iter_"]
+    model.n_features_in_ = header["nFeatures"]
+    if model.average:
+      missing = [name for name in AVERAGE_STATE if name[1:] not in self.arrays]
+      if missing:
+        raise ValueError(f"the compact model lacks {', '.join(missing)} to continue averaged SGD, load its .joblib")
+      for name in AVERAGE_STATE:
+        setattr(model, name, np.array(self.arrays[name[1:]], dtype=np.float64))
+
+    scaler = None
+    if header.get("scaler") is not None:
+      scaler = StandardScaler(with_mean=header["scaler"]["with_mean"], with_std=header["scaler"]["with_std"])
+      for name in ("mean", "var", "scale"):
+        value = self.arrays.get(name)
+        setattr(scaler, name + "_", None if value is None else np.array(value, dtype=np.float64))
+      scaler.n_samples_seen_ = header["scaler"]["n_samples_seen_"]
+      scaler.n_features_in_ = header["nFeatures"]
+    return model, scaler
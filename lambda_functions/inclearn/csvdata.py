@@ -0,0 +1,193 @@
+"""
+Vectorized csv dataset loading.
+
+Datasets are csv files with a header row followed by numeric rows; the
+last column is the target (label for classification, value for
+regression). Rows are parsed in chunks straight into one preallocated
+buffer, so no python list of rows is ever built.
+"""
+import itertools
+
+import numpy as np
+
+CHUNK_ROWS = 8192
+
+
+def check_dtype(dtype):
+  """
+  Validates and normalizes the dtype used to hold a dataset.
+
+  Parameters
+  ----------
+  dtype: numpy dtype or name ("float32", "float64", ...)
+
+  Returns
+  -------
+  numpy.dtype
+  """
+  dtype = np.dtype(dtype)
+  if dtype.kind != "f":
+    raise ValueError(f"dataset dtype must be a floating point type, not {dtype}")
+  return dtype
+
+
+def check_feature_count(found, expected):
+  """
+  Raises if a dataset does not have the expected number of features.
+  """
+  if expected is not None and found != expected:
+    raise ValueError(f"dataset has {found} feature columns, expected {expected}")
+
+
+def read_header(fp, has_target=True):
+  """
+  Reads and validates the header row of an open csv file.
+
+  Parameters
+  ----------
+  fp: csv file opened in text mode, positioned at the start
+  has_target: True if the last column is the target
+
+  Returns
+  -------
+  list of column names
+  """
+  line = fp.readline()
+  columns = [name.strip() for name in line.rstrip("\r\n").split(",")]
+  if line.strip() == "" or any(name == "" for name in columns):
+    raise ValueError("dataset is missing a valid header row")
+  if has_target and len(columns) < 2:
+    raise ValueError("dataset needs at least one feature column and a target column")
+  return columns
+
+
+def count_rows(path):
+  """
+  Counts the data rows (excluding the header) of a csv file without
+  parsing it.
+
+  Parameters
+  ----------
+  path: path to csv file
+
+  Returns
+  -------
+  number of data rows
+  """
+  lines = 0
+  last = b"\n"
+  with open(path, "rb") as fp:
+    while True:
+      block = fp.read(1 << 16)
+      if not block:
+        break
+      lines += block.count(b"\n")
+      last = block[-1:]
+  if last != b"\n":
+    lines += 1
+  return max(lines - 1, 0)
+
+
+def parse_lines(lines, n_columns, dtype, first_line=2):
+  """
+  Parses a list of csv lines into a (rows, n_columns) array.
+
+  Parameters
+  ----------
+  lines: list of csv lines, blank lines already removed
+  n_columns: expected number of columns per row
+  dtype: numpy dtype of the result
+  first_line: line number of lines[0] in the file, used in error messages
+
+  Returns
+  -------
+  2-D numpy array
+  """
+  try:
+    block = np.loadtxt(lines, delimiter=",", dtype=dtype, ndmin=2)
+  except ValueError as err:
+    raise ValueError(f"could not parse dataset rows starting at line {first_line}: {err}")
+  if block.shape[1] != n_columns:
+    raise ValueError(f"dataset rows starting at line {first_line} have {block.shape[1]} columns, header has {n_columns}")
+  return block
+
+
+def iter_csv_chunks(path, chunk_rows=CHUNK_ROWS, dtype=np.float64, has_target=True, n_features=None):
+  """
+  Yields the rows of a csv dataset as fixed-size 2-D arrays, so files of
+  any size can be processed with bounded memory.
+
+  Parameters
+  ----------
+  path: path to csv file
+  chunk_rows: maximum rows per yielded array
+  dtype: floating point dtype of the arrays
+  has_target: True if the last column is the target
+  n_features: expected number of feature columns, or None to accept any
+
+  Returns
+  -------
+  generator of 2-D arrays with every column of the file (target last)
+  """
+  dtype = check_dtype(dtype)
+  with open(path, "r") as fp:
+    n_columns = len(read_header(fp, has_target))
+    check_feature_count(n_columns - int(has_target), n_features)
+    line_no = 2
+    while True:
+      lines = list(itertools.islice(fp, chunk_rows))
+      if not lines:
+        break
+      rows = [line for line in lines if line.strip() != ""]
+      if rows:
+        yield parse_lines(rows, n_columns, dtype, line_no)
+      line_no += len(lines)
+
+
+def load_csv(path, dtype=np.float64, has_target=True, n_features=None, chunk_rows=CHUNK_ROWS):
+  """
+  Loads a csv dataset into contiguous numpy arrays.
+
+  The rows are counted first and a single buffer is allocated for the
+  features and target; the file is then parsed chunk by chunk straight
+  into that buffer.
+
+  Parameters
+  ----------
+  path: path to csv file
+  dtype: floating point dtype of the arrays
+  has_target: True if the last column is the target
+  n_features: expected number of feature columns, or None to accept any
+  chunk_rows: rows parsed per chunk
+
+  Returns
+  -------
+  X, y: C-contiguous (rows, features) array and (rows,) target array;
+  y is None when has_target is False
+  """
+  dtype = check_dtype(dtype)
+  with open(path, "r") as fp:
+    n_columns = len(read_header(fp, has_target))
+  d = n_columns - int(has_target)
+  check_feature_count(d, n_features)
+
+  n = count_rows(path)
+  buffer = np.empty(n * n_columns, dtype=dtype)
+  X = buffer[:n * d].reshape(n, d)
+  y = buffer[n * d:] if has_target else None
+
+  filled = 0
+  for chunk in iter_csv_chunks(path, chunk_rows, dtype, has_target):
+    rows = chunk.shape[0]
+    if has_target:
+      X[filled:filled + rows] = chunk[:, :-1]
+      y[filled:filled + rows] = chunk[:, -1]
+    else:
+      X[filled:filled + rows] = chunk
+    filled += rows
+
+  # blank lines are counted but not parsed
+  X = X[:filled]
+  if has_target:
+    y = y[:filled]
+  return X, y
@@ -0,0 +1,90 @@
+"""
+Fetching session datasets from storage into numpy arrays.
+"""
+import numpy as np
+
+from inclearn.columnar import columnar_name, load_columnar
+from inclearn.csvdata import iter_csv_chunks, load_csv
+from inclearn.instrument import span
+from inclearn.storage import NotFound
+
+
+def download_dataset(storage, key, local_path, has_target=True):
+  """
+  Downloads a dataset and returns its features and target.
+
+  The columnar form written by upload_dataset is preferred: it is
+  memory-mapped from local_path + ".npy" and needs no parsing. Datasets
+  uploaded before the columnar form existed fall back to the csv.
+
+  Parameters
+  ----------
+  storage: Storage holding the session
+  key: key of the csv dataset, e.g. "session/calhouse0.csv"
+  local_path: local csv path, e.g. "/tmp/dataset.csv"
+  has_target: True if the last column is the target
+
+  Returns
+  -------
+  X, y (y is None when has_target is False)
+  """
+  local_npy_path = columnar_name(local_path)
+  try:
+    with span("download"):
+      storage.download_file(columnar_name(key), local_npy_path)
+  except NotFound as err:
+    print(f"no columnar form of {key}, parsing csv ({err})")
+  else:
+    with span("parse"):
+      return load_columnar(local_npy_path, has_target)
+
+  with span("download"):
+    storage.download_file(key, local_path)
+  with span("parse"):
+    return load_csv(local_path, has_target=has_target)
+
+
+def dataset_chunks(storage, key, local_path, chunk_rows, has_target=True):
+  """
+  Downloads a dataset to local disk and returns a function that yields it
+  in (X, y) chunks of at most chunk_rows rows. Every call of the function
+  starts a new pass over the data and only one chunk is in memory at a
+  time.
+
+  Parameters
+  ----------
+  storage: Storage holding the session
+  key: key of the csv dataset
+  local_path: local csv path, e.g. "/tmp/dataset.csv"
+  chunk_rows: rows per chunk
+  has_target: True if the last column is the target
+
+  Returns
+  -------
+  function returning a generator of (X, y) pairs
+  """
+  local_npy_path = columnar_name(local_path)
+  try:
+    with span("download"):
+      storage.download_file(columnar_name(key), local_npy_path)
+  except NotFound as err:
+    print(f"no columnar form of {key}, streaming csv ({err})")
+  else:
+    def columnar_chunks():
+      X, y = load_columnar(local_npy_path, has_target)
+      for i in range(0, X.shape[0], chunk_rows):
+        yield np.array(X[i:i + chunk_rows]), (None if y is None else np.array(y[i:i + chunk_rows]))
+
+    return columnar_chunks
+
+  with span("download"):
+    storage.download_file(key, local_path)
+
+  def csv_chunks():
+    for chunk in iter_csv_chunks(local_path, chunk_rows, has_target=has_target):
+      if has_target:
+        yield chunk[:, :-1], chunk[:, -1]
+      else:
+        yield chunk, None
+
+  return csv_chunks
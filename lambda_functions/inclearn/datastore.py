@@ -0,0 +1,134 @@
+"""
+Content-addressed dataset storage.
+
+The bytes of a dataset are stored once per bucket, under the sha256 of
+its contents, with their columnar form (see inclearn.columnar) next to
+them:
+
+  _datasets/sha256/<hex>.csv
+
+The name a session uploaded a dataset under is an alias, a small object
+
+  <session>/aliases/<dataset_filename>.json  {"sha256", "size", "created"}
+
+so uploading a name again only moves the alias: models and results
+derived from the old bytes still point at them, and bytes the bucket
+already holds (the same chunk file uploaded to another session, or a
+re-run of an experiment) need not be sent at all, see link. Datasets of
+sessions uploaded before aliases existed are still read from
+<session>/<dataset_filename>.
+"""
+import hashlib
+import os
+import re
+import time
+
+from inclearn.storage import NotFound
+
+BLOB_PREFIX = "_datasets/sha256"
+ALIAS_DIR = "aliases"
+HASH_BLOCK = 1 << 20
+
+_SHA256 = re.compile(r"[0-9a-f]{64}")
+
+
+def check_sha256(sha256):
+  """
+  Returns sha256 in lower case; raises ValueError unless it is 64 hex digits.
+  """
+  if not isinstance(sha256, str) or not _SHA256.fullmatch(sha256.lower()):
+    raise ValueError("sha256 must be 64 hex digits")
+  return sha256.lower()
+
+
+def file_sha256(path):
+  """
+  Returns the sha256 hex digest of a local file, read in blocks.
+  """
+  digest = hashlib.sha256()
+  with open(path, "rb") as fp:
+    for block in iter(lambda: fp.read(HASH_BLOCK), b""):
+      digest.update(block)
+  return digest.hexdigest()
+
+
+def blob_key(sha256):
+  return f"{BLOB_PREFIX}/{sha256}.csv"
+
+
+def alias_key(modelFolder, dataset_filename):
+  return os.path.join(modelFolder, ALIAS_DIR, dataset_filename + ".json")
+
+
+def read_alias(storage, modelFolder, dataset_filename):
+  """
+  Returns the alias {"sha256", "size", "created"} of a dataset name, or
+  None if the name was never uploaded as an alias.
+  """
+  return storage.get_json(alias_key(modelFolder, dataset_filename))
+
+
+def resolve(storage, modelFolder, dataset_filename):
+  """
+  Returns (key of the dataset's csv, its sha256); the sha256 is None for
+  a dataset uploaded before aliases existed.
+  """
+  alias = read_alias(storage, modelFolder, dataset_filename)
+  if alias is None:
+    return os.path.join(modelFolder, dataset_filename), None
+  return blob_key(alias["sha256"]), alias["sha256"]
+
+
+def write_alias(storage, modelFolder, dataset_filename, sha256, size):
+  alias = {"sha256": sha256, "size": size, "created": time.time()}
+  storage.put_json(alias_key(modelFolder, dataset_filename), alias)
+  return alias
+
+
+def link(storage, modelFolder, dataset_filename, sha256):
+  """
+  Points a dataset name at content the bucket already holds.
+
+  Returns
+  -------
+  the new alias, or None if no dataset with that sha256 is stored (the
+  bytes have to be uploaded)
+  """
+  sha256 = check_sha256(sha256)
+  try:
+    size = storage.head(blob_key(sha256))["size"]
+  except NotFound:
+    return None
+  return write_alias(storage, modelFolder, dataset_filename, sha256, size)
+
+
+def store(storage, local_path, expected_sha256=None, stored_key=None):
+  """
+  Stores a local dataset file by its content.
+
+  Parameters
+  ----------
+  storage: Storage to store it in
+  local_path: path of the csv
+  expected_sha256: sha256 the sender computed, checked if given
+  stored_key: key the same bytes are stored under already (an assembled
+    multipart upload); new content is copied from there inside the
+    storage instead of being uploaded again
+
+  Returns
+  -------
+  (sha256, size, True if the content was new to the bucket); the caller
+  stores the columnar form of new content
+  """
+  sha256 = file_sha256(local_path)
+  if expected_sha256 is not None and check_sha256(expected_sha256) != sha256:
+    raise ValueError(f"dataset has sha256 {sha256}, expected {expected_sha256}")
+  size = os.path.getsize(local_path)
+  key = blob_key(sha256)
+  if storage.exists(key):
+    return sha256, size, False
+  if stored_key is not None:
+    storage.copy(stored_key, key)
+  else:
+    storage.upload_file(local_path, key)
+  return sha256, size, True
@@ -0,0 +1,110 @@
+"""
+Memoized evaluation results of a session.
+
+Scoring a model on a labeled dataset is a pure function of the model's
+bytes and the dataset's bytes. Model files are never rewritten (every
+model gets a new name), and a dataset is identified by its content: the
+sha256 of its alias (see inclearn.datastore), or the ETag of the object
+for datasets uploaded before aliases existed. So scores are kept per
+dataset, in one small object per session:
+
+  <session>/evals/<dataset id>.json
+    {"format": 1, "dataset": <dataset id>, "rows": ...,
+     "scores": {<model name>: {"score": ..., "metricName": ..., "time": ...}, ...}}
+
+and a score or leaderboard request whose models are all in it is
+answered with one read, without downloading or parsing the dataset.
+Entries never go stale on their own; invalidate drops them explicitly,
+e.g. after changing how scores are computed.
+"""
+import os
+import time
+
+from inclearn.storage import PreconditionFailed
+
+EVALS_DIR = "evals"
+FORMAT = 1
+# conditional writes of an evals object before a result is not cached
+MERGE_ATTEMPTS = 8
+
+
+def dataset_id(storage, dataset_key, sha256):
+  """
+  Returns the id scores on a dataset are cached under: its sha256, or
+  "etag-<ETag>" for a dataset without one. Raises NotFound if the
+  dataset does not exist.
+  """
+  if sha256 is not None:
+    return sha256
+  return "etag-" + storage.head(dataset_key)["etag"].strip('"')
+
+
+def evals_key(modelFolder, dataset):
+  return os.path.join(modelFolder, EVALS_DIR, dataset + ".json")
+
+
+def load(storage, modelFolder, dataset):
+  """
+  Returns the results cached for a dataset, {"rows", "scores": {model
+  name: {"score", "metricName", "time"}}}; scores are empty if nothing is.
+  """
+  cached = storage.get_json(evals_key(modelFolder, dataset))
+  return {"rows": None, "scores": {}} if cached is None else cached
+
+
+def record(storage, modelFolder, dataset, scores, metricName, rows):
+  """
+  Adds scores {model name: score} on a dataset to the session's cache,
+  merging with results other calls wrote meanwhile. A result that cannot
+  be written is only logged; it is computed again next time.
+  """
+  key = evals_key(modelFolder, dataset)
+  now = time.time()
+  for attempt in range(MERGE_ATTEMPTS):
+    cached, etag = storage.get_json_versioned(key)
+    if cached is None:
+      cached = {"format": FORMAT, "dataset": dataset, "rows": rows, "scores": {}}
+    for name, score in scores.items():
+      cached["scores"][name] = {"score": score, "metricName": metricName, "time": now}
+    try:
+      storage.put_json(key, cached, if_match=etag, if_none_match=etag is None)
+      return
+    except PreconditionFailed:
+      continue
+  print(f"{key} kept changing, results not cached")
+
+
+def invalidate(storage, modelFolder, dataset=None, modelName=None):
+  """
+  Drops cached results: of one model (modelName), on one dataset
+  (dataset id), both, or all of the session's.
+
+  Returns
+  -------
+  number of results dropped
+  """
+  if dataset is not None:
+    keys = [evals_key(modelFolder, dataset)]
+  else:
+    keys = [obj["key"] for obj in storage.list(os.path.join(modelFolder, EVALS_DIR) + "/") if obj["key"].endswith(".json")]
+
+  dropped = 0
+  for key in keys:
+    for attempt in range(MERGE_ATTEMPTS):
+      cached, etag = storage.get_json_versioned(key)
+      if cached is None:
+        break
+      if modelName is None:
+        storage.delete([key])
+        dropped += len(cached["scores"])
+        break
+      if modelName not in cached["scores"]:
+        break
+      del cached["scores"][modelName]
+      try:
+        storage.put_json(key, cached, if_match=etag)
+        dropped += 1
+        break
+      except PreconditionFailed:
+        continue
+  return dropped
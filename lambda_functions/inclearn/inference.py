@@ -0,0 +1,170 @@
+"""
+Batch inference with compact linear models (inclearn.compact).
+
+Predictions are computed one row block at a time, each block as a single
+matrix product, and streamed to storage as a multipart upload, so memory
+use depends on the block and part sizes, not on the dataset.
+
+Leaderboards score many models of a session on one parsed dataset: the
+scalers are folded into the coefficients and the models are stacked
+into one matrix, so a block of rows is scored by all of them with a
+single matrix product.
+"""
+import io
+
+from inclearn.instrument import count, span, timed_iter
+
+PART_SIZE = 8 * 1024 * 1024  # S3 parts must be at least 5 MiB, except the last
+BLOCK_ROWS = 65536
+
+
+def predict_to_storage(storage, scorer, make_chunks, key, part_size=PART_SIZE):
+  """
+  Writes the predictions of scorer for every row of a dataset to key, as
+  a csv with a "prediction" header and one value per line.
+
+  Parameters
+  ----------
+  storage: Storage to write to
+  scorer: LinearScorer
+  make_chunks: function returning a generator of (X, y) row blocks, see
+    inclearn.datasets.dataset_chunks; y is ignored
+  key: key of the predictions file
+  part_size: bytes buffered before a part is uploaded
+
+  Returns
+  -------
+  number of rows predicted
+  """
+  upload_id = storage.begin_multipart(key)
+  try:
+    buffer = io.BytesIO()
+    buffer.write(b"prediction\n")
+    part_number = 1
+    rows = 0
+    for X, _ in timed_iter(make_chunks(), "parse"):
+      if X.shape[1] != scorer.n_features:
+        raise ValueError(f"dataset has {X.shape[1]} feature columns, the model expects {scorer.n_features}")
+      if len(X) == 0:
+        continue
+      with span("predict"):
+        y_pred = scorer.predict(X)
+      with span("format"):
+        buffer.write(("\n".join(map(str, y_pred.tolist())) + "\n").encode())
+      rows += len(X)
+
+      if buffer.tell() >= part_size:
+        storage.upload_part(key, upload_id, part_number, buffer.getvalue())
+        part_number += 1
+        buffer = io.BytesIO()
+
+    if buffer.tell() > 0 or part_number == 1:
+      storage.upload_part(key, upload_id, part_number, buffer.getvalue())
+    storage.complete_multipart(key, upload_id)
+  except BaseException:
+    storage.abort_multipart(key, upload_id)
+    raise
+
+  count("rows", rows)
+  return rows
+
+
+def select_models(models, top_n=None):
+  """
+  Returns the registry entries to put on a leaderboard: all of them, or
+  the top_n by the metric recorded at training time (models without one
+  last, newer versions first on ties).
+  """
+  if top_n is None:
+    return list(models)
+  ranked = sorted(models, key=lambda entry: (entry.get("metric") is not None, entry.get("metric") or 0, entry["version"]),
+                  reverse=True)
+  return ranked[:int(top_n)]
+
+
+def stack_scorers(scorers):
+  """
+  Folds the scaler of every scorer into its coefficients,
+  w' = w / scale and b' = b - w' . mean, and stacks them, so the linear
+  scores of all models on unscaled rows X are X @ W.T + b.
+
+  Returns
+  -------
+  W, b, and the row slice of W of every scorer
+  """
+  import numpy as np
+
+  weights, intercepts, slices = [], [], []
+  start = 0
+  for scorer in scorers:
+    coef = np.asarray(scorer.coef, dtype=np.float64)
+    if scorer.scale is not None:
+      coef = coef / scorer.scale
+    intercept = np.asarray(scorer.intercept, dtype=np.float64)
+    if scorer.mean is not None:
+      intercept = intercept - coef @ scorer.mean
+    weights.append(coef)
+    intercepts.append(intercept)
+    slices.append(slice(start, start + len(coef)))
+    start += len(coef)
+  return np.vstack(weights), np.concatenate(intercepts), slices
+
+
+def score_stacked(scorers, X, y, block_rows=BLOCK_ROWS):
+  """
+  Scores every scorer on labeled rows X, y with one matrix product per
+  block of rows.
+
+  Parameters
+  ----------
+  scorers: LinearScorers of one kind (all classifiers or all regressors)
+  X: unscaled feature rows
+  y: targets
+  block_rows: rows per matrix product
+
+  Returns
+  -------
+  list of scores, accuracy for classifiers and R2 for regressors, as
+  LinearScorer.score returns them
+  """
+  import numpy as np
+
+  if len({scorer.is_classifier for scorer in scorers}) > 1:
+    raise ValueError("cannot rank classifiers and regressors together")
+  for scorer in scorers:
+    if X.shape[1] != scorer.n_features:
+      raise ValueError(f"dataset has {X.shape[1]} feature columns, a model expects {scorer.n_features}")
+
+  W, b, slices = stack_scorers(scorers)
+  totals = np.zeros(len(scorers))
+  for i in range(0, len(X), block_rows):
+    scores = np.asarray(X[i:i + block_rows], dtype=np.float64) @ W.T + b
+    y_block = y[i:i + block_rows]
+    for m, (scorer, columns) in enumerate(zip(scorers, slices)):
+      model_scores = scores[:, columns]
+      if not scorer.is_classifier:
+        totals[m] += np.sum((y_block - model_scores[:, 0]) ** 2)
+      elif model_scores.shape[1] == 1:
+        totals[m] += np.sum(scorer.classes[(model_scores[:, 0] > 0).astype(np.intp)] == y_block)
+      else:
+        totals[m] += np.sum(scorer.classes[np.argmax(model_scores, axis=1)] == y_block)
+
+  if scorers[0].is_classifier:
+    return [float(correct / len(y)) for correct in totals]
+  sst = float(np.sum((y - np.mean(y)) ** 2))
+  if sst == 0:
+    return [1.0 if sse == 0 else 0.0 for sse in totals]
+  return [1.0 - float(sse) / sst for sse in totals]
+
+
+def rank(entries, scores):
+  """
+  Returns the leaderboard rows of registry entries and their scores, best
+  first.
+  """
+  rows = [{"name": entry["name"], "version": entry["version"], "trainMetric": entry.get("metric"), "score": score}
+          for entry, score in zip(entries, scores)]
+  rows.sort(key=lambda row: (-row["score"], -row["version"]))
+  for position, row in enumerate(rows, start=1):
+    row["rank"] = position
+  return rows
@@ -0,0 +1,357 @@
+"""
+Asynchronous jobs.
+
+A training step can run as a job instead of inside the request: submit
+stores the step's event and returns a job id at once, workers claim
+queued jobs and call the handler of their kind, and the job record
+answers status queries while the handler updates its "progress".
+
+  {"jobId": ..., "kind": "train_job", "session": ..., "event": {...},
+   "status": "queued" | "running" | "succeeded" | "failed",
+   "progress": {"phase": "fit", "epoch": 12, "epochs": 100, ...},
+   "result": <handler response>, "error": ..., "attempts": 1, "worker": ...,
+   "submitted": ..., "started": ..., "finished": ...}
+
+Jobs of one session run one at a time in submission order, so the
+incremental updates of a session are never trained concurrently; jobs
+of different sessions run in parallel on as many workers as there are.
+A running job holds a lease that progress updates renew; the job of a
+worker that died is claimed again once its lease expires, at most
+MAX_ATTEMPTS times.
+
+The queues stand in for a managed queue service: MemoryQueue serves the
+worker threads of one process, SQLiteQueue any number of worker
+processes on one host sharing the database file.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+
+LEASE_SECONDS = 15 * 60
+MAX_ATTEMPTS = 3
+PROGRESS_INTERVAL = 1.0
+FINISHED = ("succeeded", "failed")
+
+_local = threading.local()
+
+
+def new_job(kind, session, event, job_id=None):
+  return {
+    "jobId": job_id or uuid.uuid4().hex,
+    "kind": kind,
+    "session": session,
+    "event": event,
+    "status": "queued",
+    "progress": {},
+    "result": None,
+    "error": None,
+    "attempts": 0,
+    "worker": None,
+    "submitted": time.time(),
+    "started": None,
+    "finished": None,
+  }
+
+
+class JobQueue:
+  """
+  Interface of the job queues.
+  """
+
+  def submit(self, kind, session, event, job_id=None):
+    """
+    Queues a job and returns its record. Submitting a job_id that already
+    exists returns the existing job, so a retried submit queues it once.
+    """
+    raise NotImplementedError
+
+  def claim(self, worker):
+    """
+    Marks the oldest runnable job as running for worker and returns its
+    record, or None if no job can run now.
+    """
+    raise NotImplementedError
+
+  def update_progress(self, job_id, progress):
+    """
+    Replaces the job's progress and renews its lease.
+    """
+    raise NotImplementedError
+
+  def finish(self, job_id, status, result=None, error=None):
+    raise NotImplementedError
+
+  def get(self, job_id):
+    """
+    Returns the job record, or None.
+    """
+    raise NotImplementedError
+
+  def list(self, session=None, limit=100):
+    """
+    Returns the newest job records, of one session or of all.
+    """
+    raise NotImplementedError
+
+
+class MemoryQueue(JobQueue):
+  """
+  Queue of one process, for worker threads.
+  """
+
+  def __init__(self, lease_seconds=LEASE_SECONDS):
+    self.lease_seconds = lease_seconds
+    self._jobs = {}
+    self._leases = {}
+    self._lock = threading.Lock()
+
+  def submit(self, kind, session, event, job_id=None):
+    with self._lock:
+      if job_id in self._jobs:
+        return dict(self._jobs[job_id])
+      job = new_job(kind, session, event, job_id)
+      self._jobs[job["jobId"]] = job
+      return dict(job)
+
+  def claim(self, worker):
+    now = time.time()
+    with self._lock:
+      busy = set()
+      expired = []
+      for job in self._jobs.values():
+        if job["status"] == "running":
+          if self._leases[job["jobId"]] >= now:
+            busy.add(job["session"])
+          elif job["attempts"] >= MAX_ATTEMPTS:
+            job.update(status="failed", error="worker lost", finished=now)
+          else:
+            expired.append(job["jobId"])
+
+      for job in self._jobs.values():
+        runnable = job["status"] == "queued" or job["jobId"] in expired
+        if runnable and job["session"] not in busy:
+          job.update(status="running", attempts=job["attempts"] + 1, worker=worker, started=now)
+          self._leases[job["jobId"]] = now + self.lease_seconds
+          return dict(job)
+    return None
+
+  def update_progress(self, job_id, progress):
+    with self._lock:
+      job = self._jobs[job_id]
+      job["progress"] = dict(progress)
+      self._leases[job_id] = time.time() + self.lease_seconds
+
+  def finish(self, job_id, status, result=None, error=None):
+    with self._lock:
+      self._jobs[job_id].update(status=status, result=result, error=error, finished=time.time())
+      self._leases.pop(job_id, None)
+
+  def get(self, job_id):
+    with self._lock:
+      job = self._jobs.get(job_id)
+      return None if job is None else dict(job)
+
+  def list(self, session=None, limit=100):
+    with self._lock:
+      jobs = [dict(job) for job in self._jobs.values() if session is None or job["session"] == session]
+    return jobs[::-1][:limit]
+
+
+class SQLiteQueue(JobQueue):
+  """
+  Queue in an SQLite database file, shared by the worker processes of
+  one host. Every call opens its own connection, so a queue object can
+  be used from any thread.
+  """
+  COLUMNS = ("jobId", "kind", "session", "event", "status", "progress", "result", "error",
+             "attempts", "worker", "submitted", "started", "finished")
+  JSON_COLUMNS = ("event", "progress", "result")
+
+  def __init__(self, path, lease_seconds=LEASE_SECONDS):
+    self.path = path
+    self.lease_seconds = lease_seconds
+    if os.path.dirname(path):
+      os.makedirs(os.path.dirname(path), exist_ok=True)
+    with self._connect() as db:
+      db.execute("PRAGMA journal_mode=WAL")
+      db.execute("""CREATE TABLE IF NOT EXISTS jobs (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT, jobId TEXT UNIQUE NOT NULL, kind TEXT, session TEXT,
+        event TEXT, status TEXT, progress TEXT, result TEXT, error TEXT, attempts INTEGER,
+        worker TEXT, submitted REAL, started REAL, finished REAL, leaseUntil REAL)""")
+      db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, seq)")
+
+  def _connect(self):
+    #imported here, so handlers that only report progress never load sqlite3
+    import sqlite3
+
+    db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+    db.row_factory = sqlite3.Row
+    return _Closing(db)
+
+  def _record(self, row):
+    job = {name: row[name] for name in self.COLUMNS}
+    for name in self.JSON_COLUMNS:
+      job[name] = None if job[name] is None else json.loads(job[name])
+    return job
+
+  def submit(self, kind, session, event, job_id=None):
+    job = new_job(kind, session, event, job_id)
+    values = [json.dumps(job[name]) if name in self.JSON_COLUMNS else job[name] for name in self.COLUMNS]
+    with self._connect() as db:
+      db.execute(f"INSERT OR IGNORE INTO jobs ({', '.join(self.COLUMNS)}) VALUES ({', '.join('?' * len(values))})", values)
+    return self.get(job["jobId"])
+
+  def claim(self, worker):
+    now = time.time()
+    with self._connect() as db:
+      #the write lock is taken up front, so two workers never claim the same job
+      db.execute("BEGIN IMMEDIATE")
+      try:
+        db.execute("UPDATE jobs SET status = 'failed', error = 'worker lost', finished = ? "
+                   "WHERE status = 'running' AND leaseUntil < ? AND attempts >= ?", (now, now, MAX_ATTEMPTS))
+        row = db.execute("""SELECT * FROM jobs
+          WHERE (status = 'queued' OR (status = 'running' AND leaseUntil < :now))
+            AND session NOT IN (SELECT session FROM jobs WHERE status = 'running' AND leaseUntil >= :now)
+          ORDER BY seq LIMIT 1""", {"now": now}).fetchone()
+        if row is not None:
+          db.execute("UPDATE jobs SET status = 'running', attempts = attempts + 1, worker = ?, started = ?, leaseUntil = ? "
+                     "WHERE jobId = ?", (worker, now, now + self.lease_seconds, row["jobId"]))
+        db.execute("COMMIT")
+      except BaseException:
+        db.execute("ROLLBACK")
+        raise
+    return None if row is None else self.get(row["jobId"])
+
+  def update_progress(self, job_id, progress):
+    with self._connect() as db:
+      db.execute("UPDATE jobs SET progress = ?, leaseUntil = ? WHERE jobId = ?",
+                 (json.dumps(progress), time.time() + self.lease_seconds, job_id))
+
+  def finish(self, job_id, status, result=None, error=None):
+    with self._connect() as db:
+      db.execute("UPDATE jobs SET status = ?, result = ?, error = ?, finished = ?, leaseUntil = NULL WHERE jobId = ?",
+                 (status, json.dumps(result), error, time.time(), job_id))
+
+  def get(self, job_id):
+    with self._connect() as db:
+      row = db.execute("SELECT * FROM jobs WHERE jobId = ?", (job_id,)).fetchone()
+    return None if row is None else self._record(row)
+
+  def list(self, session=None, limit=100):
+    with self._connect() as db:
+      if session is None:
+        rows = db.execute("SELECT * FROM jobs ORDER BY seq DESC LIMIT ?", (limit,)).fetchall()
+      else:
+        rows = db.execute("SELECT * FROM jobs WHERE session = ? ORDER BY seq DESC LIMIT ?", (session, limit)).fetchall()
+    return [self._record(row) for row in rows]
+
+
+class _Closing:
+  """
+  Context manager that closes an sqlite3 connection (sqlite3's own only
+  ends the transaction).
+  """
+
+  def __init__(self, db):
+    self.db = db
+
+  def __enter__(self):
+    return self.db
+
+  def __exit__(self, *exc_info):
+    self.db.close()
+
+
+def from_config(configur):
+  """
+  Creates the queue named in the [jobs] section of config.ini:
+
+    [jobs]
+    backend = sqlite    path = /tmp/inclearn-jobs.sqlite (default)
+    backend = memory
+  """
+  backend = configur.get('jobs', 'backend', fallback='sqlite')
+  if backend == 'sqlite':
+    return SQLiteQueue(configur.get('jobs', 'path', fallback='/tmp/inclearn-jobs.sqlite'))
+  if backend == 'memory':
+    return MemoryQueue()
+  raise ValueError(f"unknown jobs backend '{backend}'")
+
+
+def progress(force=False, **fields):
+  """
+  Reports progress of the job the calling thread is running, e.g.
+  progress(phase="fit", epoch=3, epochs=100); a no-op outside a job.
+  Fields are kept until the phase changes. Reports are written at most
+  every PROGRESS_INTERVAL seconds unless force is set or the phase
+  changes.
+  """
+  current = getattr(_local, "job", None)
+  if current is None:
+    return
+  now = time.time()
+  changed = fields.get("phase") not in (None, current["fields"].get("phase"))
+  current["fields"] = {**({} if changed else current["fields"]), **fields}
+  if force or changed or now - current["reported"] >= PROGRESS_INTERVAL:
+    current["queue"].update_progress(current["jobId"], current["fields"])
+    current["reported"] = now
+
+
+def run_job(queue, job, handlers):
+  """
+  Runs a claimed job with the handler of its kind and records the
+  outcome: succeeded with the handler's response if it returned status
+  200, failed otherwise.
+
+  Parameters
+  ----------
+  queue: JobQueue the job was claimed from
+  job: job record
+  handlers: {kind: lambda_handler}
+  """
+  _local.job = {"queue": queue, "jobId": job["jobId"], "fields": {}, "reported": 0.0}
+  try:
+    response = handlers[job["kind"]](job["event"], None)
+  except Exception as err:
+    queue.finish(job["jobId"], "failed", error=str(err))
+    return
+  finally:
+    _local.job = None
+
+  if isinstance(response, dict) and response.get("statusCode") == 200:
+    queue.finish(job["jobId"], "succeeded", result=response)
+  else:
+    error = response.get("body") if isinstance(response, dict) else None
+    try:
+      error = json.loads(error)
+    except (TypeError, ValueError):
+      pass
+    queue.finish(job["jobId"], "failed", result=response, error=str(error))
+
+
+def drain(queue, handlers, worker=None, max_jobs=None, idle_seconds=0.0, poll_seconds=0.5, deadline=None):
+  """
+  Claims and runs jobs until max_jobs have run, the deadline
+  (time.time()) passes or no job could be claimed for idle_seconds.
+
+  Returns
+  -------
+  number of jobs run
+  """
+  worker = worker or f"{os.getpid()}-{threading.get_ident()}"
+  ran = 0
+  idle_since = time.monotonic()
+  while (max_jobs is None or ran < max_jobs) and (deadline is None or time.time() < deadline):
+    job = queue.claim(worker)
+    if job is None:
+      if time.monotonic() - idle_since >= idle_seconds:
+        break
+      time.sleep(poll_seconds)
+      continue
+    print(f"worker {worker} running job {job['jobId']} ({job['kind']}, session {job['session']})")
+    run_job(queue, job, handlers)
+    ran += 1
+    idle_since = time.monotonic()
+  return ran
@@ -0,0 +1,397 @@
+"""
+Append-only metrics log of a session.
+
+Every training step writes its records as a new jsonl segment under
+<session>/metrics/, so no writer ever reads or rewrites what others
+wrote. Segment names start with a nanosecond timestamp, so they sort in
+write order, and end with the kind and the number of their records:
+
+  seg-<timestamp>-<id>-<kind>-<count>.jsonl
+
+Once enough segments pile up, a compaction moves their records into
+pages under <session>/metrics-pages/, one kind and at most PAGE_RECORDS
+records each, and writes a manifest, compact-<newest timestamp>.json,
+listing the pages of the previous manifest followed by the new ones with
+their kind and count. Readers take the newest manifest plus every
+segment written after it; from the counts they know which pages and
+segments a page of a view spans without reading the others.
+
+Sessions trained before the log existed kept "<model> <metric>" lines in
+progress.txt. The first write that finds no legacy-<count>.jsonl entry
+in the log copies them into one (an empty one if there is no
+progress.txt); until then readers read progress.txt itself.
+
+What a compaction merged is deleted while other readers or compactors
+may still be reading it, so both re-list the log when a key they listed
+is gone. Pages are never deleted.
+"""
+import json
+import os
+import time
+import uuid
+
+from inclearn.storage import NotFound, PreconditionFailed
+
+METRICS_DIR = "metrics"
+PAGES_DIR = "metrics-pages"
+PROGRESS_FILE = "progress.txt"
+SEGMENT_PREFIX = "seg-"
+COMPACT_PREFIX = "compact-"
+LEGACY_PREFIX = "legacy-"
+# kind of a segment holding records of several kinds
+MIXED = "mixed"
+COMPACT_AFTER = 64
+PAGE_RECORDS = 1000
+# segments younger than this are left alone, so a write that was named
+# before a compaction but landed after it is not skipped by readers
+COMPACT_GRACE_NS = 60 * 10**9
+
+
+def _stamp(key):
+  """
+  Returns the timestamp part of a segment or manifest key.
+  """
+  name = os.path.basename(key)
+  return name.split(".")[0].split("-")[1]
+
+
+def _body(records):
+  return "".join(json.dumps(record) + "\n" for record in records).encode()
+
+
+def record_kind(record):
+  """
+  Returns "model" for the record of a trained model, "sweep" for a sweep
+  candidate that was never saved. Sweep records written before they
+  carried a kind are told apart by their sweep id.
+  """
+  return record.get("kind") or ("sweep" if "sweep" in record else "model")
+
+
+def _count(records):
+  """
+  Returns how many of records the views list: those with a metric.
+  """
+  return sum(1 for record in records if record.get("metric") is not None)
+
+
+def append(storage, modelBucket, records):
+  """
+  Writes records as a new segment of the session's metrics log.
+
+  Parameters
+  ----------
+  storage: Storage holding the session
+  modelBucket: session folder
+  records: list of json-serializable dicts
+
+  Returns
+  -------
+  key of the new segment
+  """
+  kinds = {record_kind(record) for record in records}
+  kind = kinds.pop() if len(kinds) == 1 else MIXED
+  name = f"{SEGMENT_PREFIX}{time.time_ns():020d}-{uuid.uuid4().hex[:8]}-{kind}-{_count(records)}.jsonl"
+  key = os.path.join(modelBucket, METRICS_DIR, name)
+  storage.put_bytes(key, _body(records))
+  return key
+
+
+def parse_progress(body):
+  """
+  Returns the records of the "<model> <metric>" lines of a progress.txt.
+  """
+  records = []
+  for line in body.splitlines():
+    line = line.strip()
+    if line == "":
+      continue
+    model, _, metric = line.rpartition(" ")
+    try:
+      records.append({"model": model, "metric": float(metric), "legacy": True})
+    except ValueError:
+      records.append({"model": line, "metric": None, "legacy": True})
+  return records
+
+
+def import_progress(storage, modelBucket):
+  """
+  Copies the lines of the session's progress.txt into the log's legacy
+  entry. Concurrent imports write the same entry, so only the first one
+  is kept.
+
+  Returns
+  -------
+  key of the legacy entry
+  """
+  try:
+    records = parse_progress(storage.get_bytes(os.path.join(modelBucket, PROGRESS_FILE)).decode())
+  except NotFound:
+    records = []
+  key = os.path.join(modelBucket, METRICS_DIR, f"{LEGACY_PREFIX}{_count(records)}.jsonl")
+  try:
+    storage.put_bytes(key, _body(records), if_none_match=True)
+  except PreconditionFailed:
+    pass
+  return key
+
+
+def _list_keys(storage, modelBucket):
+  """
+  Returns (legacy entry key or None, manifest keys, plain segment keys)
+  of the log.
+  """
+  prefix = os.path.join(modelBucket, METRICS_DIR) + "/"
+  legacy = None
+  compacted = []
+  segments = []
+  for obj in storage.list(prefix):
+    name = os.path.basename(obj["key"])
+    if name.startswith(COMPACT_PREFIX):
+      compacted.append(obj["key"])
+    elif name.startswith(SEGMENT_PREFIX):
+      segments.append(obj["key"])
+    elif name.startswith(LEGACY_PREFIX):
+      legacy = obj["key"]
+  return legacy, compacted, segments
+
+
+def list_segments(storage, modelBucket, keys=None):
+  """
+  Returns (legacy entry key or None, newest manifest key or None, plain
+  segment keys newer than it in write order), from keys if the log was
+  listed already.
+  """
+  legacy, compacted, segments = keys or _list_keys(storage, modelBucket)
+  base = max(compacted, key=_stamp) if compacted else None
+  if base is not None:
+    segments = [key for key in segments if _stamp(key) > _stamp(base)]
+  return legacy, base, sorted(segments, key=os.path.basename)
+
+
+def _pages(storage, base):
+  """
+  Returns the pages a manifest lists, keys relative to the session.
+  """
+  if base is None:
+    return []
+  if base.endswith(".jsonl"):
+    #logs compacted before pages existed merged everything into this segment
+    return [{"key": os.path.join(METRICS_DIR, os.path.basename(base)), "kind": None, "count": None}]
+  manifest = storage.get_json(base)
+  if manifest is None:
+    raise NotFound(base)
+  return manifest["pages"]
+
+
+def _segment_item(key):
+  """
+  Returns the item of a plain segment; segments named before they
+  carried their kind and count have neither.
+  """
+  parts = os.path.basename(key).split(".")[0].split("-")
+  if len(parts) == 5 and parts[4].isdigit():
+    return {"key": key, "kind": parts[3], "count": int(parts[4])}
+  return {"key": key, "kind": None, "count": None}
+
+
+def _items(storage, modelBucket):
+  """
+  Returns the log as items {"key", "kind", "count"} in write order; kind
+  and count are None where only reading the item tells.
+  """
+  legacy, base, segments = list_segments(storage, modelBucket)
+  if legacy is not None:
+    items = [{"key": legacy, "kind": "model", "count": int(_stamp(legacy))}]
+  else:
+    #not imported yet
+    items = [{"key": os.path.join(modelBucket, PROGRESS_FILE), "kind": "model", "count": None, "progress": True}]
+  items += [dict(page, key=os.path.join(modelBucket, page["key"])) for page in _pages(storage, base)]
+  return items + [_segment_item(key) for key in segments]
+
+
+def _read_item(storage, item, skip_missing):
+  """
+  Returns the records of an item; raises NotFound if it was deleted by a
+  compaction meanwhile, unless skip_missing.
+  """
+  try:
+    body = storage.get_bytes(item["key"]).decode()
+  except NotFound:
+    if item.get("progress"):
+      return []
+    if not skip_missing:
+      raise
+    print(f"{item['key']} was compacted while being read, skipped")
+    return []
+  if item.get("progress"):
+    return parse_progress(body)
+  return [json.loads(line) for line in body.splitlines() if line.strip() != ""]
+
+
+def _relisting(read):
+  """
+  Returns read(skip_missing=False), or if a compaction deleted what it
+  listed, read(skip_missing=True): the merged records are in the new
+  listing.
+  """
+  try:
+    return read(False)
+  except NotFound:
+    return read(True)
+
+
+def read_records(storage, modelBucket, kind=None):
+  """
+  Returns the records of the session's metrics log, or only those of one
+  kind (see record_kind), in write order within each kind. Pages and
+  segments that hold only other kinds are not read.
+  """
+  def read(skip_missing):
+    records = []
+    for item in _items(storage, modelBucket):
+      if kind is None or item["kind"] in (kind, None, MIXED):
+        records.extend(_read_item(storage, item, skip_missing))
+    return [record for record in records if kind is None or record_kind(record) == kind]
+
+  return _relisting(read)
+
+
+def query_log(storage, modelBucket, offset=0, limit=100, min_metric=None, max_metric=None, top_k=None, kind="model"):
+  """
+  Runs query (see there for the parameters and result) on the session's
+  metrics log. A plain page only reads the pages and segments it spans,
+  skipping the others by their counts; metric bounds and top_k read
+  every record of the kind.
+  """
+  if min_metric is not None or max_metric is not None or top_k is not None:
+    return query(read_records(storage, modelBucket, kind), offset, limit, min_metric, max_metric, top_k, kind)
+
+  def read(skip_missing):
+    page = []
+    total = 0
+    for item in _items(storage, modelBucket):
+      if item["kind"] not in (kind, None, MIXED):
+        continue
+      count = item["count"] if item["kind"] == kind else None
+      if count is not None and (total + count <= offset or total >= offset + limit):
+        total += count
+        continue
+      records = [record for record in _read_item(storage, item, skip_missing)
+                 if record_kind(record) == kind and record.get("metric") is not None]
+      page.extend(records[max(offset - total, 0):max(offset + limit - total, 0)])
+      total += len(records)
+    next_offset = offset + limit if offset + limit < total else None
+    return {"records": page, "total": total, "nextOffset": next_offset}
+
+  return _relisting(read)
+
+
+def compact(storage, modelBucket, min_segments=COMPACT_AFTER, keys=None):
+  """
+  Moves the log's plain segments into pages once at least min_segments
+  of them are older than the grace period, then deletes the merged
+  segments and older manifests. The pages of the previous manifest are
+  reused, so a compaction costs what it merges, not the session's
+  length. Gives up, leaving the log as it is, when another compaction
+  deletes what this one listed or writes a newer manifest. keys is the
+  log as _list_keys returned it, if it was listed already.
+
+  Returns
+  -------
+  key of the new manifest, or None if nothing was done
+  """
+  _, base, segments = list_segments(storage, modelBucket, keys)
+  cutoff = f"{time.time_ns() - COMPACT_GRACE_NS:020d}"
+  segments = [key for key in segments if _stamp(key) <= cutoff]
+  if len(segments) < min_segments:
+    return None
+
+  records = []
+  try:
+    pages = _pages(storage, base)
+    for key in segments:
+      records.extend(_read_item(storage, {"key": key}, skip_missing=False))
+  except NotFound:
+    print("metrics log compacted concurrently, skipping")
+    return None
+
+  stamp = _stamp(segments[-1])
+  by_kind = {}
+  for record in records:
+    by_kind.setdefault(record_kind(record), []).append(record)
+  for kind, kind_records in sorted(by_kind.items()):
+    for start in range(0, len(kind_records), PAGE_RECORDS):
+      chunk = kind_records[start:start + PAGE_RECORDS]
+      name = os.path.join(PAGES_DIR, f"{stamp}-{kind}-{start // PAGE_RECORDS}.jsonl")
+      storage.put_bytes(os.path.join(modelBucket, name), _body(chunk))
+      pages.append({"key": name, "kind": kind, "count": _count(chunk)})
+  key = os.path.join(modelBucket, METRICS_DIR, f"{COMPACT_PREFIX}{stamp}.json")
+  storage.put_json(key, {"pages": pages})
+
+  #a newer manifest merged more than this one; its compaction deletes the rest
+  _, compacted, _ = _list_keys(storage, modelBucket)
+  if max(compacted, key=_stamp) != key:
+    storage.delete([key])
+    return None
+  #older manifests include those of compactions that lost to this one;
+  #segments compacted before pages existed may be one of this one's pages
+  storage.delete([other for other in compacted if _stamp(other) < _stamp(key) and other.endswith(".json")] + segments)
+  return key
+
+
+def try_compact(storage, modelBucket):
+  """
+  Tidies the log after the request's write is committed: imports
+  progress.txt if the log has no legacy entry yet, then runs compact.
+  Errors are logged instead of raised: the next write tries again, while
+  a failed response would make a retrying client commit a second time.
+  """
+  try:
+    keys = _list_keys(storage, modelBucket)
+    if keys[0] is None:
+      import_progress(storage, modelBucket)
+    return compact(storage, modelBucket, keys=keys)
+  except Exception as err:
+    print(f"tidying the metrics log failed, left for the next write: {err!r}")
+    return None
+
+
+def query(records, offset=0, limit=100, min_metric=None, max_metric=None, top_k=None, kind="model"):
+  """
+  Filters and pages metrics records.
+
+  Parameters
+  ----------
+  records: records in write order
+  offset, limit: page of the filtered records to return
+  min_metric, max_metric: inclusive bounds on "metric"
+  top_k: keep only the k records with the highest metric, best first
+  kind: kind of records to select, see record_kind
+
+  Returns
+  -------
+  dict with "records", "total" (matching records) and "nextOffset"
+  (None on the last page)
+  """
+  selected = [
+    record for record in records
+    if record_kind(record) == kind
+    and record.get("metric") is not None
+    and (min_metric is None or record["metric"] >= min_metric)
+    and (max_metric is None or record["metric"] <= max_metric)
+  ]
+  if top_k is not None:
+    selected = sorted(selected, key=lambda record: record["metric"], reverse=True)[:top_k]
+
+  page = selected[offset:offset + limit]
+  next_offset = offset + limit if offset + limit < len(selected) else None
+  return {"records": page, "total": len(selected), "nextOffset": next_offset}
+
+
+def render_progress(records):
+  """
+  Renders records the way progress.txt listed them: "<model> <metric>" per line.
+  """
+  return "\n".join(record["model"] if record["metric"] is None else f"{record['model']} {record['metric']}"
+                   for record in records if "model" in record)
@@ -0,0 +1,176 @@
+"""
+Bounded cache of loaded models for warm containers.
+
+Entries are keyed by object key plus ETag, so a model is only reused while
+the stored object is unchanged. Loaded models are kept in memory and the
+downloaded files in a /tmp directory; both tiers evict the least recently
+used entries once their byte budget is exceeded.
+"""
+import copy
+import hashlib
+import os
+import threading
+
+from collections import OrderedDict
+
+from inclearn import instrument
+
+
+class ModelCache:
+  """
+  Two-tier (memory, /tmp) LRU cache of joblib (or compact) models.
+
+  Parameters
+  ----------
+  max_memory_bytes: budget for loaded models, measured by file size
+  max_disk_bytes: budget for downloaded files in cache_dir
+  cache_dir: local directory for downloaded files
+  """
+
+  def __init__(self, max_memory_bytes=64 << 20, max_disk_bytes=256 << 20, cache_dir="/tmp/model-cache"):
+    self.max_memory_bytes = max_memory_bytes
+    self.max_disk_bytes = max_disk_bytes
+    self.cache_dir = cache_dir
+    self._memory = OrderedDict()  # (key, etag) -> (model, size)
+    self._disk = OrderedDict()    # (key, etag) -> (path, size)
+    self._memory_bytes = 0
+    self._disk_bytes = 0
+    self._lock = threading.RLock()
+    self.hits = 0
+    self.disk_hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+  def stats(self):
+    """
+    Returns the cache counters as a dict.
+    """
+    with self._lock:
+      return {
+        "hits": self.hits,
+        "disk_hits": self.disk_hits,
+        "misses": self.misses,
+        "evictions": self.evictions,
+        "memory_bytes": self._memory_bytes,
+        "disk_bytes": self._disk_bytes,
+        "entries": len(self._memory),
+      }
+
+  def get(self, storage, key, copy_model=False, loader=None):
+    """
+    Returns the model stored under key, downloading and loading it only if
+    the cache has no entry for its current ETag.
+
+    Parameters
+    ----------
+    storage: Storage holding the model
+    key: object key of the model file
+    copy_model: return a deep copy, for callers that modify the model
+    loader: function loading the model from a local path, joblib.load
+      when None
+
+    Returns
+    -------
+    loaded model
+    """
+    etag = storage.head(key)["etag"]
+    cache_key = (key, etag)
+
+    with self._lock:
+      entry = self._memory.get(cache_key)
+      if entry is not None:
+        self._memory.move_to_end(cache_key)
+        self.hits += 1
+        instrument.count("model_cache.hit")
+        return copy.deepcopy(entry[0]) if copy_model else entry[0]
+
+      disk_entry = self._disk.get(cache_key)
+      if disk_entry is not None and os.path.exists(disk_entry[0]):
+        self._disk.move_to_end(cache_key)
+        self.disk_hits += 1
+        instrument.count("model_cache.disk_hit")
+        path = disk_entry[0]
+      else:
+        self.misses += 1
+        instrument.count("model_cache.miss")
+        path = None
+
+    if path is None:
+      path = self._path(cache_key)
+      os.makedirs(self.cache_dir, exist_ok=True)
+      partial = self._partial_path(path)
+      storage.download_file(key, partial)
+      os.replace(partial, path)
+      self._add_file(cache_key, path)
+
+    if loader is None:
+      import joblib
+
+      loader = joblib.load
+    with instrument.span("deserialize"):
+      model = loader(path)
+    self._add_model(cache_key, model, os.path.getsize(path))
+    return copy.deepcopy(model) if copy_model else model
+
+  def put(self, key, etag, model, data):
+    """
+    Caches a model that was just written, so the next call that reads it
+    back skips the download.
+
+    Parameters
+    ----------
+    key: object key the model was stored under
+    etag: ETag returned by the put
+    model: the model object
+    data: serialized bytes of the model
+    """
+    cache_key = (key, etag)
+    path = self._path(cache_key)
+    os.makedirs(self.cache_dir, exist_ok=True)
+    partial = self._partial_path(path)
+    with open(partial, "wb") as fp:
+      fp.write(data)
+    os.replace(partial, path)
+    self._add_file(cache_key, path)
+    self._add_model(cache_key, copy.deepcopy(model), len(data))
+
+  def _path(self, cache_key):
+    name = hashlib.sha1("\0".join(cache_key).encode()).hexdigest()
+    return os.path.join(self.cache_dir, name + (os.path.splitext(cache_key[0])[1] or ".joblib"))
+
+  def _partial_path(self, path):
+    """
+    Returns where to write a cache file before it is renamed into place;
+    processes on one machine (job workers) share cache_dir, so none of
+    them may see another's half-written file.
+    """
+    return f"{path}.{os.getpid()}-{threading.get_ident()}.partial"
+
+  def _add_model(self, cache_key, model, size):
+    with self._lock:
+      if cache_key in self._memory:
+        self._memory_bytes -= self._memory.pop(cache_key)[1]
+      if size > self.max_memory_bytes:
+        return
+      self._memory[cache_key] = (model, size)
+      self._memory_bytes += size
+      while self._memory_bytes > self.max_memory_bytes:
+        _, (_, evicted) = self._memory.popitem(last=False)
+        self._memory_bytes -= evicted
+        self.evictions += 1
+
+  def _add_file(self, cache_key, path):
+    size = os.path.getsize(path)
+    with self._lock:
+      if cache_key in self._disk:
+        self._disk_bytes -= self._disk.pop(cache_key)[1]
+      self._disk[cache_key] = (path, size)
+      self._disk_bytes += size
+      while self._disk_bytes > self.max_disk_bytes and len(self._disk) > 1:
+        _, (evicted_path, evicted) = self._disk.popitem(last=False)
+        self._disk_bytes -= evicted
+        self.evictions += 1
+        try:
+          os.remove(evicted_path)
+        except OSError:
+          pass
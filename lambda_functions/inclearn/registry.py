@@ -0,0 +1,268 @@
+"""
+Per-session model registry.
+
+The session folder holds:
+
+  head.json                  {"version": 3, "name": "model<uuid>.joblib"}
+  registry/<version>.json    one entry per model, {"version": 3, "name": ...,
+                             "parent": ..., "metric": ..., "metricName": ...,
+                             "created": ...}, version zero-padded
+  registry.json              {"format": 1, "version": 2, "head": ...,
+                              "models": [entries of versions 1..2]}
+
+Every model gets the next version number. Training resolves its parent
+with one read of head.json. A training step moves the head with a put
+that succeeds only if head.json still has the ETag it read when it chose
+its parent, so of two steps trained from the same head exactly one
+commits; the other gets HeadMoved and retrains on top of the new head.
+The head decides every version number, so the committed step writes its
+entry object unconditionally and no step reads or rewrites what other
+steps wrote.
+
+registry.json is an index of the entries up to its "version", folded in
+by a write once INDEX_AFTER entries have piled up past it, the way the
+metrics log compacts. The manifest get_models answers from is the index
+plus the entries listed after it. Entry objects are never deleted, so a
+reader can not miss one that a concurrent fold is indexing. Sessions
+trained before the registry existed are bootstrapped from a (paginated)
+listing of their model files.
+"""
+import os
+import time
+
+from inclearn.storage import PreconditionFailed
+
+HEAD_NAME = "head.json"
+REGISTRY_NAME = "registry.json"
+ENTRIES_DIR = "registry"
+FORMAT = 1
+# times a training step is retrained on a moved head before it gives up; of
+# n steps started together the last to commit rebases n - 1 times, larger
+# fan-outs belong on the jobs queue, which runs a session's steps in order
+MAX_REBASES = 32
+# entries past the index before a write folds them into registry.json
+INDEX_AFTER = 64
+# seconds a version may stay unregistered (a step committed the head but
+# has not written its entry yet) before folding skips over it
+MISSING_GRACE = 600
+
+
+class HeadMoved(Exception):
+  """
+  The session head changed after it was read; the update has to be
+  rebased on the new head.
+  """
+
+
+def read_head(storage, modelBucket):
+  """
+  Returns the session head {"version", "name"}, or None for a new or
+  pre-registry session.
+  """
+  return storage.get_json(os.path.join(modelBucket, HEAD_NAME))
+
+
+def resolve_head(storage, modelBucket):
+  """
+  Returns (head, etag) to train from and commit against: head is None
+  for a new session, etag is None when head.json does not exist yet (a
+  new or pre-registry session).
+  """
+  head, etag = storage.get_json_versioned(os.path.join(modelBucket, HEAD_NAME))
+  if head is None:
+    head = legacy_head(storage, modelBucket)
+  return head, etag
+
+
+def entry_key(modelBucket, version):
+  return os.path.join(modelBucket, ENTRIES_DIR, f"{version:012d}.json")
+
+
+def _entries_after(storage, modelBucket, version):
+  """
+  Returns the entries with versions above version, in version order.
+  """
+  listed = storage.list(os.path.join(modelBucket, ENTRIES_DIR) + "/", start_after=entry_key(modelBucket, version))
+  return [storage.get_json(obj["key"]) for obj in listed if obj["key"].endswith(".json")]
+
+
+def _fold(registry, entries):
+  """
+  Adds entries to a manifest in place. An entry replaces any entry with
+  its version or name: a version is only ever committed by one step, and
+  entries bootstrapped from a listing are guesses.
+  """
+  replaced = {entry["version"] for entry in entries} | {entry["name"] for entry in entries}
+  models = [model for model in registry["models"] if model["version"] not in replaced and model["name"] not in replaced]
+  models.extend(entries)
+  models.sort(key=lambda model: model["version"])
+  registry["models"] = models
+  if models:
+    registry["version"] = models[-1]["version"]
+    registry["head"] = models[-1]["name"]
+  return registry
+
+
+def load_registry(storage, modelBucket):
+  """
+  Returns the session manifest, or None if the session has none yet.
+  """
+  index = storage.get_json(os.path.join(modelBucket, REGISTRY_NAME))
+  entries = _entries_after(storage, modelBucket, 0 if index is None else index["version"])
+  if index is None and not entries:
+    return None
+  return _fold(new_registry() if index is None else index, entries)
+
+
+def new_registry():
+  return {"format": FORMAT, "version": 0, "head": None, "models": []}
+
+
+def list_model_files(storage, modelBucket):
+  """
+  Lists every .joblib model of a session, oldest first; ties on
+  lastModified are broken by key.
+  """
+  models = [obj for obj in storage.list(os.path.join(modelBucket, "model")) if obj["key"].endswith(".joblib")]
+  models.sort(key=lambda obj: (obj["lastModified"], obj["key"]))
+  return models
+
+
+def registry_from_listing(storage, modelBucket, exclude=()):
+  """
+  Builds a manifest for a session trained before the registry existed.
+  Models get versions in lastModified order; their metrics are unknown.
+  """
+  registry = new_registry()
+  parent = None
+  for obj in list_model_files(storage, modelBucket):
+    name = os.path.basename(obj["key"])
+    if name in exclude:
+      continue
+    add_entry(registry, name, None, None, parent, obj["lastModified"])
+    parent = name
+  return registry
+
+
+def legacy_head(storage, modelBucket):
+  """
+  Returns the head of a pre-registry session from a listing, or None if
+  the session has no models.
+  """
+  registry = registry_from_listing(storage, modelBucket)
+  if registry["head"] is None:
+    return None
+  return {"version": registry["version"], "name": registry["head"]}
+
+
+def add_entry(registry, name, metric, metricName, parent, created=None):
+  """
+  Appends a model to the manifest with the next version and makes it the head.
+  """
+  registry["version"] += 1
+  entry = {
+    "version": registry["version"],
+    "name": name,
+    "parent": parent,
+    "metric": metric,
+    "metricName": metricName,
+    "created": created if created is not None else time.time(),
+  }
+  registry["models"].append(entry)
+  registry["head"] = name
+  return entry
+
+
+def bootstrap_index(storage, modelBucket, entry):
+  """
+  Writes the index of a session that predates the registry, whose models
+  before entry are only known from a listing.
+  """
+  listed = registry_from_listing(storage, modelBucket, exclude=(entry["name"],))
+  index = _fold(new_registry(), [model for model in listed["models"] if model["version"] < entry["version"]])
+  try:
+    storage.put_json(os.path.join(modelBucket, REGISTRY_NAME), index, if_none_match=True)
+  except PreconditionFailed:
+    pass
+
+
+def fold_index(storage, modelBucket, min_entries=None):
+  """
+  Folds the entries listed past registry.json into it once at least
+  min_entries (default INDEX_AFTER) have piled up. Only an unbroken run of versions is folded:
+  a missing version may still be written by a step that committed the
+  head before a later one, and is skipped once it has been missing for
+  MISSING_GRACE seconds. The index is replaced conditionally; a fold that
+  loses to another one is dropped.
+
+  Returns
+  -------
+  the new index, or None if nothing was done
+  """
+  key = os.path.join(modelBucket, REGISTRY_NAME)
+  index, etag = storage.get_json_versioned(key)
+  if index is None:
+    index = new_registry()
+  entries = _entries_after(storage, modelBucket, index["version"])
+  if len(entries) < (INDEX_AFTER if min_entries is None else min_entries):
+    return None
+
+  run = []
+  expected = index["version"] + 1
+  for entry in entries:
+    if entry["version"] != expected:
+      if time.time() - entry["created"] < MISSING_GRACE:
+        break
+      print(f"versions {expected}..{entry['version'] - 1} of {modelBucket} were never registered, skipped")
+    run.append(entry)
+    expected = entry["version"] + 1
+  if not run:
+    return None
+  try:
+    storage.put_json(key, _fold(index, run), if_match=etag, if_none_match=etag is None)
+  except PreconditionFailed:
+    return None
+  return index
+
+
+def record_model(storage, modelBucket, name, metric, metricName, parent, head=None, etag=None):
+  """
+  Registers a newly written model and moves the session head to it, if
+  the head is still the one the model was trained from.
+
+  Parameters
+  ----------
+  storage: Storage holding the session
+  modelBucket: session folder
+  name: file name of the new model
+  metric: score of the new model on its held-out split
+  metricName: "accuracy" or "r2"
+  parent: name of the model it was trained from, None for a first model
+  head, etag: the head and ETag resolve_head returned when the parent was
+    chosen (a first model still commits against the head it replaces)
+
+  Returns
+  -------
+  the new manifest entry
+
+  Raises
+  ------
+  HeadMoved if another step moved the head in the meantime; nothing was
+  registered
+  """
+  version = (head["version"] if head is not None else 0) + 1
+  entry = {"version": version, "name": name, "parent": parent, "metric": metric, "metricName": metricName, "created": time.time()}
+  try:
+    storage.put_json(os.path.join(modelBucket, HEAD_NAME), {"version": version, "name": name},
+                     if_match=etag, if_none_match=etag is None)
+  except PreconditionFailed:
+    raise HeadMoved(f"head of {modelBucket} moved past version {version - 1}")
+  storage.put_json(entry_key(modelBucket, version), entry)
+  if etag is None and version > 1:
+    bootstrap_index(storage, modelBucket, entry)
+  #the step is committed, so a failed fold is left to the next one
+  try:
+    fold_index(storage, modelBucket)
+  except Exception as err:
+    print(f"folding the registry index failed, left for the next step: {err!r}")
+  return entry
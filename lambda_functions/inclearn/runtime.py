@@ -0,0 +1,146 @@
+"""
+Per-process state shared by warm invocations of a handler.
+
+Lambda keeps the python process of a container alive between calls, so
+the config, the boto3 session, the S3 client and the storage are created on first use
+and then reused instead of being rebuilt by every lambda_handler call.
+"""
+import os
+import threading
+
+from configparser import ConfigParser
+
+CONFIG_FILE = 'config.ini'
+S3_PROFILE = 's3readwrite'
+MAX_POOL_CONNECTIONS = 16
+SCRATCH_DIR = '/tmp'
+
+_lock = threading.RLock()
+_state = {}
+_scratch = threading.local()
+
+
+def _get(name, create):
+  """
+  Returns the cached object called name, creating it on first use.
+  """
+  value = _state.get(name)
+  if value is None:
+    with _lock:
+      value = _state.get(name)
+      if value is None:
+        value = create()
+        _state[name] = value
+  return value
+
+
+def reset():
+  """
+  Drops every cached object, so the next call behaves like a cold start.
+  """
+  with _lock:
+    _state.clear()
+
+
+def get_config():
+  """
+  Returns the ConfigParser for config.ini, which is also the AWS shared
+  credentials file.
+  """
+  def create():
+    os.environ['AWS_SHARED_CREDENTIALS_FILE'] = CONFIG_FILE
+    configur = ConfigParser()
+    configur.read(CONFIG_FILE)
+    return configur
+
+  return _get('config', create)
+
+
+def get_session():
+  """
+  Returns the boto3 session for the s3readwrite profile.
+  """
+  def create():
+    import boto3
+
+    get_config()
+    return boto3.session.Session(profile_name=S3_PROFILE)
+
+  return _get('session', create)
+
+
+def get_bucketname():
+  return _get('bucketname', lambda: get_config().get('s3', 'bucket_name'))
+
+
+def get_s3_client():
+  """
+  Returns the S3 client; its connection pool is kept across invocations.
+  """
+  def create():
+    from botocore.config import Config
+
+    return get_session().client('s3', config=Config(max_pool_connections=MAX_POOL_CONNECTIONS))
+
+  return _get('s3_client', create)
+
+
+def get_storage():
+  """
+  Returns the container's Storage, selected by the optional [storage]
+  section of config.ini (S3 unless backend = local or memory). Its calls
+  are metered for inclearn.instrument.
+  """
+  def create():
+    from inclearn.storage import MeteredStorage, from_config
+
+    return MeteredStorage(from_config(get_config(), get_s3_client))
+
+  return _get('storage', create)
+
+
+def get_job_queue():
+  """
+  Returns the container's job queue, selected by the optional [jobs]
+  section of config.ini (see inclearn.jobs.from_config).
+  """
+  def create():
+    from inclearn.jobs import from_config
+
+    return from_config(get_config())
+
+  return _get('job_queue', create)
+
+
+def scratch_path(filename):
+  """
+  Returns the local path for a working file such as a downloaded
+  dataset: /tmp/<filename>, or a directory set for the calling thread
+  with set_scratch_dir, so concurrent job workers never share a file.
+  """
+  return os.path.join(getattr(_scratch, "dir", None) or SCRATCH_DIR, filename)
+
+
+def set_scratch_dir(path):
+  """
+  Sets the scratch directory of the calling thread; None restores /tmp.
+  """
+  if path is not None:
+    os.makedirs(path, exist_ok=True)
+  _scratch.dir = path
+
+
+def get_model_cache():
+  """
+  Returns the container's model cache. Its budgets can be set in the
+  optional [cache] section of config.ini (memory_mb, disk_mb).
+  """
+  def create():
+    from inclearn.modelcache import ModelCache
+
+    configur = get_config()
+    memory_mb = configur.getint('cache', 'memory_mb', fallback=64)
+    disk_mb = configur.getint('cache', 'disk_mb', fallback=256)
+    return ModelCache(max_memory_bytes=memory_mb << 20, max_disk_bytes=disk_mb << 20)
+
+  return _get('model_cache', create)
@@ -0,0 +1,701 @@
+"""
+Storage backends for session data.
+
+Handlers talk to a Storage instead of calling boto3 directly, so the
+whole pipeline can run against S3, a local directory or process memory:
+
+  S3Storage       a bucket, through a boto3 client
+  LocalStorage    a directory tree, one file per key
+  MemoryStorage   a dict, for tests and benchmarks
+
+MeteredStorage wraps any of them to report calls, time and bytes to
+inclearn.instrument.
+
+Keys are "/"-separated paths such as "session/calhouse0.csv". ETags are
+quoted strings as S3 returns them; conditional puts compare them.
+"""
+import contextlib
+import fcntl
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+from inclearn import instrument
+
+
+class NotFound(Exception):
+  """
+  Raised when a key does not exist.
+  """
+
+
+class PreconditionFailed(Exception):
+  """
+  Raised when a conditional put finds the key changed (or present).
+  """
+
+
+def _etag(data):
+  return '"' + hashlib.md5(data).hexdigest() + '"'
+
+
+class Storage:
+  """
+  Interface of a storage backend. Conditional puts use if_match (the
+  current ETag must equal it) or if_none_match (the key must not exist).
+  """
+
+  def get_bytes(self, key):
+    raise NotImplementedError
+
+  def put_bytes(self, key, data, if_match=None, if_none_match=False):
+    """
+    Stores data under key and returns its ETag.
+    """
+    raise NotImplementedError
+
+  def head(self, key):
+    """
+    Returns {"etag", "size", "lastModified"} of key.
+    """
+    raise NotImplementedError
+
+  def open_stream(self, key):
+    """
+    Returns a readable binary file object over the value of key.
+    """
+    raise NotImplementedError
+
+  def list(self, prefix, start_after=None):
+    """
+    Returns [{"key", "size", "lastModified"}, ...] of keys starting with
+    prefix, in key order; only keys after start_after if it is given.
+    """
+    raise NotImplementedError
+
+  def delete(self, keys):
+    raise NotImplementedError
+
+  def copy(self, src, dst):
+    """
+    Stores the value of src under dst too. Backends that can copy
+    without moving the bytes through this process do.
+    """
+    self.put_bytes(dst, self.get_bytes(src))
+
+  def begin_multipart(self, key):
+    """
+    Starts a multipart upload and returns its id.
+    """
+    raise NotImplementedError
+
+  def upload_part(self, key, upload_id, part_number, data):
+    raise NotImplementedError
+
+  def presign_part(self, key, upload_id, part_number, expires=3600):
+    """
+    Returns a URL that takes a PUT of one part's bytes straight to the
+    backend for expires seconds, or None if the backend has no such URLs
+    and parts must go through upload_part.
+    """
+    return None
+
+  def list_parts(self, key, upload_id):
+    """
+    Returns [{"partNumber", "size", "etag"}, ...] in part order.
+    """
+    raise NotImplementedError
+
+  def complete_multipart(self, key, upload_id):
+    """
+    Stores the concatenated parts under key.
+    """
+    raise NotImplementedError
+
+  def abort_multipart(self, key, upload_id):
+    raise NotImplementedError
+
+  def download_file(self, key, path):
+    with self.open_stream(key) as src, open(path, "wb") as dst:
+      shutil.copyfileobj(src, dst, 1 << 20)
+
+  def upload_file(self, path, key):
+    with open(path, "rb") as fp:
+      return self.put_bytes(key, fp.read())
+
+  def exists(self, key):
+    try:
+      self.head(key)
+    except NotFound:
+      return False
+    return True
+
+  def get_json(self, key):
+    """
+    Returns the parsed json stored under key, or None if there is none.
+    """
+    try:
+      return json.loads(self.get_bytes(key))
+    except NotFound:
+      return None
+
+  def put_json(self, key, obj, if_match=None, if_none_match=False):
+    return self.put_bytes(key, json.dumps(obj).encode(), if_match=if_match, if_none_match=if_none_match)
+
+  def get_json_versioned(self, key):
+    """
+    Returns (parsed json, ETag) of key for a conditional put of its next
+    version, or (None, None) if there is none. The ETag is read first, so
+    a concurrent write can only make it older than the content and fail
+    the conditional put.
+    """
+    try:
+      etag = self.head(key)["etag"]
+    except NotFound:
+      return None, None
+    obj = self.get_json(key)
+    return obj, (None if obj is None else etag)
+
+
+class S3Storage(Storage):
+  """
+  Storage in an S3 bucket.
+
+  Parameters
+  ----------
+  bucketname: name of the bucket
+  s3_client: boto3 S3 client
+  client_factory: function returning the client, called on first use
+    when s3_client is None, so boto3 is only imported by a call that
+    actually talks to S3
+  """
+
+  def __init__(self, bucketname, s3_client=None, client_factory=None):
+    self.bucketname = bucketname
+    self._s3_client = s3_client
+    self._client_factory = client_factory
+
+  @property
+  def s3_client(self):
+    if self._s3_client is None:
+      self._s3_client = self._client_factory()
+    return self._s3_client
+
+  def _translate(self, err):
+    from botocore.exceptions import ClientError
+
+    if isinstance(err, ClientError):
+      code = str(err.response.get("Error", {}).get("Code"))
+      if code in ("NoSuchKey", "404", "NotFound", "NoSuchUpload"):
+        return NotFound(str(err))
+      if code in ("PreconditionFailed", "412", "ConditionalRequestConflict", "409"):
+        return PreconditionFailed(str(err))
+    return err
+
+  def _call(self, fn, **kwargs):
+    try:
+      return fn(Bucket=self.bucketname, **kwargs)
+    except Exception as err:
+      translated = self._translate(err)
+      if translated is err:
+        raise
+      raise translated from err
+
+  def get_bytes(self, key):
+    return self._call(self.s3_client.get_object, Key=key)["Body"].read()
+
+  def put_bytes(self, key, data, if_match=None, if_none_match=False):
+    kwargs = {}
+    if if_match is not None:
+      kwargs["IfMatch"] = if_match
+    if if_none_match:
+      kwargs["IfNoneMatch"] = "*"
+    return self._call(self.s3_client.put_object, Key=key, Body=data, **kwargs)["ETag"]
+
+  def head(self, key):
+    response = self._call(self.s3_client.head_object, Key=key)
+    return {"etag": response["ETag"], "size": response["ContentLength"], "lastModified": response["LastModified"].timestamp()}
+
+  def open_stream(self, key):
+    return self._call(self.s3_client.get_object, Key=key)["Body"]
+
+  def list(self, prefix, start_after=None):
+    paginator = self.s3_client.get_paginator("list_objects_v2")
+    kwargs = {} if start_after is None else {"StartAfter": start_after}
+    items = []
+    for page in paginator.paginate(Bucket=self.bucketname, Prefix=prefix, **kwargs):
+      for obj in page.get("Contents", []):
+        items.append({"key": obj["Key"], "size": obj["Size"], "lastModified": obj["LastModified"].timestamp()})
+    return items
+
+  def delete(self, keys):
+    keys = list(keys)
+    for i in range(0, len(keys), 1000):
+      batch = [{"Key": key} for key in keys[i:i + 1000]]
+      self._call(self.s3_client.delete_objects, Delete={"Objects": batch, "Quiet": True})
+
+  def copy(self, src, dst):
+    #inside S3; the managed copy switches to a multipart copy for large objects
+    self._call(self.s3_client.copy, CopySource={"Bucket": self.bucketname, "Key": src}, Key=dst)
+
+  def download_file(self, key, path):
+    self._call(self.s3_client.download_file, Key=key, Filename=path)
+
+  def upload_file(self, path, key):
+    self._call(self.s3_client.upload_file, Key=key, Filename=path)
+
+  def begin_multipart(self, key):
+    return self._call(self.s3_client.create_multipart_upload, Key=key)["UploadId"]
+
+  def upload_part(self, key, upload_id, part_number, data):
+    return self._call(self.s3_client.upload_part, Key=key, UploadId=upload_id, PartNumber=part_number, Body=data)["ETag"]
+
+  def presign_part(self, key, upload_id, part_number, expires=3600):
+    #signed locally, no request is sent
+    return self.s3_client.generate_presigned_url(
+      "upload_part", ExpiresIn=expires,
+      Params={"Bucket": self.bucketname, "Key": key, "UploadId": upload_id, "PartNumber": part_number})
+
+  def list_parts(self, key, upload_id):
+    paginator = self.s3_client.get_paginator("list_parts")
+    parts = []
+    try:
+      for page in paginator.paginate(Bucket=self.bucketname, Key=key, UploadId=upload_id):
+        parts.extend({"partNumber": p["PartNumber"], "size": p["Size"], "etag": p["ETag"]} for p in page.get("Parts", []))
+    except Exception as err:
+      translated = self._translate(err)
+      if translated is err:
+        raise
+      raise translated from err
+    return sorted(parts, key=lambda part: part["partNumber"])
+
+  def complete_multipart(self, key, upload_id):
+    parts = self.list_parts(key, upload_id)
+    self._call(self.s3_client.complete_multipart_upload, Key=key, UploadId=upload_id,
+               MultipartUpload={"Parts": [{"PartNumber": p["partNumber"], "ETag": p["etag"]} for p in parts]})
+
+  def abort_multipart(self, key, upload_id):
+    self._call(self.s3_client.abort_multipart_upload, Key=key, UploadId=upload_id)
+
+
+class LocalStorage(Storage):
+  """
+  Storage in a local directory; key "a/b.csv" is the file root/a/b.csv.
+  Writes go through a temporary file and a rename, and conditional puts
+  hold a lock file, so several processes can share one root. The ETag of
+  a file is computed while it is written and kept next to it in
+  .etag-<name> with the file's inode, size and mtime, so head costs a
+  stat and a small read instead of hashing the file; files changed
+  behind the storage's back are hashed on their next head.
+
+  Parameters
+  ----------
+  root: directory holding the keys
+  """
+
+  MULTIPART_DIR = ".multipart"
+  ETAG_PREFIX = ".etag-"
+
+  def __init__(self, root):
+    self.root = os.path.abspath(root)
+    os.makedirs(self.root, exist_ok=True)
+    self._lock = threading.Lock()
+
+  def _path(self, key):
+    path = os.path.abspath(os.path.join(self.root, key))
+    if not path.startswith(self.root + os.sep):
+      raise ValueError(f"key {key} is outside the storage root")
+    return path
+
+  def _etag_path(self, path):
+    return os.path.join(os.path.dirname(path), self.ETAG_PREFIX + os.path.basename(path))
+
+  def _keep_etag(self, path, stat, etag):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    with os.fdopen(fd, "w") as fp:
+      json.dump({"etag": etag, "stat": [stat.st_ino, stat.st_size, stat.st_mtime_ns]}, fp)
+    os.replace(tmp, self._etag_path(path))
+
+  def _file_etag(self, path, stat):
+    """
+    Returns the ETag kept for the file at path if it still describes the
+    file stat is of, else hashes the file and keeps the result.
+    """
+    try:
+      with open(self._etag_path(path)) as fp:
+        kept = json.load(fp)
+      if kept["stat"] == [stat.st_ino, stat.st_size, stat.st_mtime_ns]:
+        return kept["etag"]
+    except (FileNotFoundError, ValueError, KeyError):
+      pass
+    with open(path, "rb") as fp:
+      digest = hashlib.md5()
+      for block in iter(lambda: fp.read(1 << 20), b""):
+        digest.update(block)
+    etag = '"' + digest.hexdigest() + '"'
+    self._keep_etag(path, stat, etag)
+    return etag
+
+  def _store(self, path, write):
+    """
+    Creates the file at path through a temporary file and a rename.
+    write(fp) fills the temporary file and returns the ETag of what it
+    wrote, which is kept for head before the rename.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+      with os.fdopen(fd, "wb") as fp:
+        etag = write(fp)
+      self._keep_etag(path, os.stat(tmp), etag)
+      os.replace(tmp, path)
+    except BaseException:
+      with contextlib.suppress(FileNotFoundError):
+        os.remove(tmp)
+      raise
+    return etag
+
+  def _write(self, path, data):
+    def write(fp):
+      fp.write(data)
+      return _etag(data)
+
+    return self._store(path, write)
+
+  def _write_from(self, path, sources):
+    """
+    Creates the file at path from the concatenated content of the files
+    sources, hashing it on the way.
+    """
+    def write(fp):
+      digest = hashlib.md5()
+      for source in sources:
+        with open(source, "rb") as src:
+          for block in iter(lambda: src.read(1 << 20), b""):
+            digest.update(block)
+            fp.write(block)
+      return '"' + digest.hexdigest() + '"'
+
+    return self._store(path, write)
+
+  def get_bytes(self, key):
+    try:
+      with open(self._path(key), "rb") as fp:
+        return fp.read()
+    except FileNotFoundError:
+      raise NotFound(key)
+
+  def put_bytes(self, key, data, if_match=None, if_none_match=False):
+    path = self._path(key)
+    if if_match is None and not if_none_match:
+      self._write(path, data)
+      return _etag(data)
+
+    with self._lock, open(os.path.join(self.root, ".lock"), "a") as lock:
+      fcntl.flock(lock, fcntl.LOCK_EX)
+      try:
+        current = self.head(key)["etag"]
+      except NotFound:
+        current = None
+      if if_none_match and current is not None:
+        raise PreconditionFailed(f"{key} already exists")
+      if if_match is not None and current != if_match:
+        raise PreconditionFailed(f"{key} changed")
+      self._write(path, data)
+    return _etag(data)
+
+  def head(self, key):
+    path = self._path(key)
+    try:
+      stat = os.stat(path)
+      etag = self._file_etag(path, stat)
+    except FileNotFoundError:
+      raise NotFound(key)
+    return {"etag": etag, "size": stat.st_size, "lastModified": stat.st_mtime}
+
+  def open_stream(self, key):
+    try:
+      return open(self._path(key), "rb")
+    except FileNotFoundError:
+      raise NotFound(key)
+
+  def list(self, prefix, start_after=None):
+    base = os.path.dirname(prefix)
+    top = os.path.join(self.root, base) if base else self.root
+    items = []
+    for dirpath, dirnames, filenames in os.walk(top):
+      dirnames[:] = [d for d in dirnames if d != self.MULTIPART_DIR]
+      for name in filenames:
+        if name.startswith((".tmp-", self.ETAG_PREFIX)) or name == ".lock":
+          continue
+        path = os.path.join(dirpath, name)
+        key = os.path.relpath(path, self.root).replace(os.sep, "/")
+        if key.startswith(prefix) and (start_after is None or key > start_after):
+          stat = os.stat(path)
+          items.append({"key": key, "size": stat.st_size, "lastModified": stat.st_mtime})
+    return sorted(items, key=lambda item: item["key"])
+
+  def delete(self, keys):
+    for key in keys:
+      path = self._path(key)
+      for name in (path, self._etag_path(path)):
+        try:
+          os.remove(name)
+        except FileNotFoundError:
+          pass
+
+  def copy(self, src, dst):
+    try:
+      self._write_from(self._path(dst), [self._path(src)])
+    except FileNotFoundError:
+      raise NotFound(src)
+
+  def download_file(self, key, path):
+    try:
+      shutil.copyfile(self._path(key), path)
+    except FileNotFoundError:
+      raise NotFound(key)
+
+  def upload_file(self, path, key):
+    return self._write_from(self._path(key), [path])
+
+  def _upload_dir(self, upload_id):
+    if not upload_id.isalnum():
+      raise NotFound(upload_id)
+    return os.path.join(self.root, self.MULTIPART_DIR, upload_id)
+
+  def begin_multipart(self, key):
+    upload_id = uuid.uuid4().hex
+    os.makedirs(self._upload_dir(upload_id))
+    return upload_id
+
+  def upload_part(self, key, upload_id, part_number, data):
+    directory = self._upload_dir(upload_id)
+    if not os.path.isdir(directory):
+      raise NotFound(upload_id)
+    self._write(os.path.join(directory, f"{int(part_number):05d}.part"), data)
+    return _etag(data)
+
+  def list_parts(self, key, upload_id):
+    directory = self._upload_dir(upload_id)
+    if not os.path.isdir(directory):
+      raise NotFound(upload_id)
+    parts = []
+    for name in sorted(os.listdir(directory)):
+      if name.endswith(".part") and not name.startswith("."):
+        path = os.path.join(directory, name)
+        stat = os.stat(path)
+        parts.append({"partNumber": int(name[:-5]), "size": stat.st_size, "etag": self._file_etag(path, stat)})
+    return parts
+
+  def complete_multipart(self, key, upload_id):
+    directory = self._upload_dir(upload_id)
+    parts = self.list_parts(key, upload_id)
+    self._write_from(self._path(key), [os.path.join(directory, f"{part['partNumber']:05d}.part") for part in parts])
+    shutil.rmtree(directory)
+
+  def abort_multipart(self, key, upload_id):
+    shutil.rmtree(self._upload_dir(upload_id), ignore_errors=True)
+
+
+class MemoryStorage(Storage):
+  """
+  Storage in a dict of this process.
+  """
+
+  def __init__(self):
+    self._objects = {}  # key -> (data, lastModified)
+    self._uploads = {}  # upload id -> {part number: data}
+    self._lock = threading.Lock()
+
+  def get_bytes(self, key):
+    try:
+      return self._objects[key][0]
+    except KeyError:
+      raise NotFound(key)
+
+  def put_bytes(self, key, data, if_match=None, if_none_match=False):
+    data = bytes(data)
+    with self._lock:
+      current = self._objects.get(key)
+      if if_none_match and current is not None:
+        raise PreconditionFailed(f"{key} already exists")
+      if if_match is not None and (current is None or _etag(current[0]) != if_match):
+        raise PreconditionFailed(f"{key} changed")
+      self._objects[key] = (data, time.time())
+    return _etag(data)
+
+  def head(self, key):
+    try:
+      data, modified = self._objects[key]
+    except KeyError:
+      raise NotFound(key)
+    return {"etag": _etag(data), "size": len(data), "lastModified": modified}
+
+  def open_stream(self, key):
+    return io.BytesIO(self.get_bytes(key))
+
+  def list(self, prefix, start_after=None):
+    with self._lock:
+      items = [{"key": key, "size": len(data), "lastModified": modified}
+               for key, (data, modified) in self._objects.items()
+               if key.startswith(prefix) and (start_after is None or key > start_after)]
+    return sorted(items, key=lambda item: item["key"])
+
+  def delete(self, keys):
+    with self._lock:
+      for key in keys:
+        self._objects.pop(key, None)
+
+  def copy(self, src, dst):
+    with self._lock:
+      try:
+        self._objects[dst] = (self._objects[src][0], time.time())
+      except KeyError:
+        raise NotFound(src)
+
+  def begin_multipart(self, key):
+    upload_id = uuid.uuid4().hex
+    self._uploads[upload_id] = {}
+    return upload_id
+
+  def _parts(self, upload_id):
+    try:
+      return self._uploads[upload_id]
+    except KeyError:
+      raise NotFound(upload_id)
+
+  def upload_part(self, key, upload_id, part_number, data):
+    self._parts(upload_id)[int(part_number)] = bytes(data)
+    return _etag(data)
+
+  def list_parts(self, key, upload_id):
+    parts = self._parts(upload_id)
+    return [{"partNumber": n, "size": len(parts[n]), "etag": _etag(parts[n])} for n in sorted(parts)]
+
+  def complete_multipart(self, key, upload_id):
+    parts = self._parts(upload_id)
+    self.put_bytes(key, b"".join(parts[n] for n in sorted(parts)))
+    del self._uploads[upload_id]
+
+  def abort_multipart(self, key, upload_id):
+    self._uploads.pop(upload_id, None)
+
+
+class MeteredStorage(Storage):
+  """
+  Wraps a Storage, timing each call as a "storage.<method>" span and
+  counting calls and bytes moved in the current instrument Recorder.
+
+  Parameters
+  ----------
+  inner: the Storage doing the work
+  """
+
+  def __init__(self, inner):
+    self.inner = inner
+
+  @contextlib.contextmanager
+  def _metered(self, method):
+    instrument.count("storage." + method)
+    with instrument.span("storage." + method):
+      yield
+
+  def get_bytes(self, key):
+    with self._metered("get"):
+      data = self.inner.get_bytes(key)
+    instrument.add_bytes("storage.read", len(data))
+    return data
+
+  def put_bytes(self, key, data, if_match=None, if_none_match=False):
+    with self._metered("put"):
+      etag = self.inner.put_bytes(key, data, if_match=if_match, if_none_match=if_none_match)
+    instrument.add_bytes("storage.written", len(data))
+    return etag
+
+  def head(self, key):
+    with self._metered("head"):
+      return self.inner.head(key)
+
+  def open_stream(self, key):
+    with self._metered("open_stream"):
+      return self.inner.open_stream(key)
+
+  def list(self, prefix, start_after=None):
+    with self._metered("list"):
+      return self.inner.list(prefix, start_after)
+
+  def delete(self, keys):
+    with self._metered("delete"):
+      self.inner.delete(keys)
+
+  def copy(self, src, dst):
+    with self._metered("copy"):
+      self.inner.copy(src, dst)
+
+  def download_file(self, key, path):
+    with self._metered("download_file"):
+      self.inner.download_file(key, path)
+    instrument.add_bytes("storage.read", os.path.getsize(path))
+
+  def upload_file(self, path, key):
+    with self._metered("upload_file"):
+      result = self.inner.upload_file(path, key)
+    instrument.add_bytes("storage.written", os.path.getsize(path))
+    return result
+
+  def begin_multipart(self, key):
+    with self._metered("begin_multipart"):
+      return self.inner.begin_multipart(key)
+
+  def upload_part(self, key, upload_id, part_number, data):
+    with self._metered("upload_part"):
+      etag = self.inner.upload_part(key, upload_id, part_number, data)
+    instrument.add_bytes("storage.written", len(data))
+    return etag
+
+  def presign_part(self, key, upload_id, part_number, expires=3600):
+    with self._metered("presign_part"):
+      return self.inner.presign_part(key, upload_id, part_number, expires)
+
+  def list_parts(self, key, upload_id):
+    with self._metered("list_parts"):
+      return self.inner.list_parts(key, upload_id)
+
+  def complete_multipart(self, key, upload_id):
+    with self._metered("complete_multipart"):
+      self.inner.complete_multipart(key, upload_id)
+
+  def abort_multipart(self, key, upload_id):
+    with self._metered("abort_multipart"):
+      self.inner.abort_multipart(key, upload_id)
+
+
+def from_config(configur, s3_client_factory=None):
+  """
+  Creates the backend named in the [storage] section of config.ini:
+
+    [storage]
+    backend = s3        (default; uses [s3] bucket_name)
+    backend = local     root = /path/to/directory
+    backend = memory
+
+  Parameters
+  ----------
+  configur: ConfigParser of config.ini
+  s3_client_factory: function returning the boto3 S3 client
+  """
+  backend = configur.get('storage', 'backend', fallback='s3')
+  if backend == 's3':
+    return S3Storage(configur.get('s3', 'bucket_name'), client_factory=s3_client_factory)
+  if backend == 'local':
+    return LocalStorage(configur.get('storage', 'root', fallback='/tmp/inclearn-storage'))
+  if backend == 'memory':
+    return MemoryStorage()
+  raise ValueError(f"unknown storage backend '{backend}'")
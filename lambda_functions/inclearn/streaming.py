@@ -0,0 +1,123 @@
+"""
+Out-of-core training over a dataset read in fixed-size row chunks.
+
+Memory use is bounded by the chunk size rather than the dataset size:
+every chunk is split into training and held-out rows on the fly, the
+training rows update the scaler and the model with partial_fit, and the
+held-out rows are scored in a second pass that only keeps running sums.
+The split of chunk i is drawn from a generator seeded with (seed, i), so
+both passes agree on which rows are held out.
+"""
+import numpy as np
+import sklearn.base
+
+from inclearn.instrument import span, timed_iter
+from inclearn.trainer import train_epochs
+
+
+def holdout_mask(seed, chunk_index, rows, test_size):
+  """
+  Returns a boolean mask marking the held-out rows of a chunk.
+  """
+  rng = np.random.default_rng([seed, chunk_index])
+  return rng.random(rows) < test_size
+
+
+def find_classes(make_chunks):
+  """
+  Returns the sorted class labels of a dataset, with one pass that only
+  looks at the target column.
+  """
+  classes = np.empty(0)
+  for _, y in make_chunks():
+    classes = np.union1d(classes, y)
+  return classes
+
+
+class HeldOutScore:
+  """
+  Running accuracy (classifiers) or R2 score (regressors) over held-out
+  chunks, matching what estimator.score returns on all of them at once.
+  """
+
+  def __init__(self, is_classifier):
+    self.is_classifier = is_classifier
+    self.n = 0
+    self.correct = 0
+    self.sum_y = 0.0
+    self.sum_y2 = 0.0
+    self.sse = 0.0
+
+  def update(self, y_true, y_pred):
+    self.n += len(y_true)
+    if self.is_classifier:
+      self.correct += int(np.count_nonzero(y_true == y_pred))
+    else:
+      self.sum_y += float(np.sum(y_true))
+      self.sum_y2 += float(np.dot(y_true, y_true))
+      self.sse += float(np.sum((y_true - y_pred) ** 2))
+
+  def value(self):
+    if self.n == 0:
+      raise ValueError("no held-out rows to score")
+    if self.is_classifier:
+      return self.correct / self.n
+    sst = self.sum_y2 - self.sum_y * self.sum_y / self.n
+    return 1.0 - self.sse / sst if sst > 0 else 0.0
+
+
+def stream_fit(model, scaler, make_chunks, test_size=0.2, epochs=1, batch_size=32, seed=0, classes=None):
+  """
+  Trains model chunk by chunk and scores it on the held-out rows.
+
+  Parameters
+  ----------
+  model: SGDClassifier/SGDRegressor, fitted or not
+  scaler: StandardScaler, updated with partial_fit on every training chunk
+  make_chunks: function returning a generator of (X, y) chunks, see
+    inclearn.datasets.dataset_chunks
+  test_size: fraction of every chunk held out for scoring
+  epochs: partial_fit epochs over each chunk's training rows
+  batch_size: rows per partial_fit call, None for one call per epoch
+  seed: seed of the held-out split and of the minibatch shuffles
+  classes: class labels for an unfitted classifier; found with an extra
+    pass over the targets when None
+
+  Returns
+  -------
+  dict with the held-out "score" and the "trainRows", "testRows" and
+  "chunks" counts
+  """
+  is_classifier = sklearn.base.is_classifier(model)
+  if is_classifier and not hasattr(model, "classes_") and classes is None:
+    classes = find_classes(make_chunks)
+
+  train_rows = 0
+  chunks = 0
+  for i, (X, y) in enumerate(timed_iter(make_chunks(), "parse")):
+    mask = holdout_mask(seed, i, len(y), test_size)
+    X_train = X[~mask]
+    y_train = y[~mask]
+    chunks += 1
+    if len(y_train) == 0:
+      continue
+    with span("scale"):
+      scaler.partial_fit(X_train)
+      X_train = scaler.transform(X_train)
+    with span("fit"):
+      train_epochs(model, X_train, y_train, epochs=epochs, batch_size=batch_size,
+                   classes=classes if is_classifier else None, random_state=[seed, i])
+    classes = None
+    train_rows += len(y_train)
+
+  if train_rows == 0:
+    raise ValueError("dataset has no training rows")
+
+  score = HeldOutScore(is_classifier)
+  for i, (X, y) in enumerate(timed_iter(make_chunks(), "parse")):
+    mask = holdout_mask(seed, i, len(y), test_size)
+    if np.any(mask):
+      with span("score"):
+        score.update(y[mask], model.predict(scaler.transform(X[mask])))
+
+  return {"score": score.value(), "trainRows": train_rows, "testRows": score.n, "chunks": chunks}
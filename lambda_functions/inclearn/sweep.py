@@ -0,0 +1,239 @@
+"""
+Hyperparameter sweeps over one parsed dataset.
+
+A sweep trains one candidate per point of a grid over SGD
+hyperparameters, all from the same split and scaled rows. The rows are
+copied once into shared memory blocks that the worker processes of a
+pool attach to by name, so no candidate gets a pickled copy of the
+dataset. Where processes or shared memory are unavailable (AWS Lambda
+has no /dev/shm) the candidates are trained one after another instead.
+
+Candidates are not saved as models; their scores are appended to the
+session's metrics log as
+
+  {"sweep": <id>, "params": {...}, "metric": ..., "metricName": ...,
+   "dataset": ..., "parent": <model the candidates continued>, "seconds": ..., "time": ...}
+
+and the best params can be passed to a training step as "params".
+"""
+import copy
+import itertools
+import os
+import time
+import uuid
+
+import numpy as np
+
+# estimator parameters a sweep (or a training step's "params") may set
+SWEEP_PARAMS = (
+  "loss", "penalty", "alpha", "l1_ratio", "learning_rate", "eta0", "power_t", "max_iter", "tol",
+  "epsilon", "average", "early_stopping", "validation_fraction", "n_iter_no_change",
+)
+MAX_CONFIGS = 256
+
+
+def check_params(params):
+  """
+  Raises ValueError unless params is a dict of SWEEP_PARAMS names.
+  """
+  if not isinstance(params, dict):
+    raise ValueError("params must be an object of SGD hyperparameters")
+  unknown = sorted(set(params) - set(SWEEP_PARAMS))
+  if unknown:
+    raise ValueError(f"unsupported hyperparameters {unknown}, expected some of {list(SWEEP_PARAMS)}")
+  return params
+
+
+def apply_params(model, params, continuing=False):
+  """
+  Sets params on model after checking their names and values, so a bad
+  value raises a ValueError naming it instead of failing in fit. A
+  continued model keeps its "average": the averaged weights it would
+  start or drop midway are not there.
+
+  Returns
+  -------
+  model
+  """
+  import sklearn.base
+
+  check_params(params)
+  if continuing and "average" in params and params["average"] != model.average:
+    raise ValueError(f"average of a continued model cannot change from {model.average!r} to {params['average']!r}")
+  try:
+    sklearn.base.clone(model).set_params(**params)._validate_params()
+  except (TypeError, ValueError) as err:
+    raise ValueError(f"invalid hyperparameters {params}: {err}")
+  return model.set_params(**params)
+
+
+def expand_grid(grid):
+  """
+  Returns every combination of a grid {name: [values]} as a list of
+  param dicts, in the order of the sorted names.
+  """
+  check_params(grid)
+  if len(grid) == 0:
+    raise ValueError("grid is empty")
+  names = sorted(grid)
+  values = [grid[name] if isinstance(grid[name], list) else [grid[name]] for name in names]
+  n_configs = int(np.prod([len(choices) for choices in values]))
+  if n_configs == 0 or n_configs > MAX_CONFIGS:
+    raise ValueError(f"grid has {n_configs} configurations, expected 1 to {MAX_CONFIGS}")
+  return [dict(zip(names, combination)) for combination in itertools.product(*values)]
+
+
+def fit_config(base, config, first, arrays, epochs, batch_size):
+  """
+  Trains and scores one candidate.
+
+  Parameters
+  ----------
+  base: estimator the candidate starts from, unfitted for a first model
+  config: hyperparameters set on top of base
+  first: True to fit a new model, False to continue base with epochs of
+    partial_fit
+  arrays: dict with X_train, y_train, X_test, y_test (scaled)
+  epochs, batch_size: see inclearn.trainer.train_epochs
+
+  Returns
+  -------
+  {"params", "metric", "seconds"}, with "error" and metric None if the
+  configuration is invalid or training it failed
+  """
+  import sklearn.base
+
+  from inclearn.trainer import train_epochs
+
+  start = time.perf_counter()
+  try:
+    model = sklearn.base.clone(base) if first else copy.deepcopy(base)
+    apply_params(model, config, continuing=not first)
+    if first:
+      model.fit(arrays["X_train"], arrays["y_train"])
+    else:
+      train_epochs(model, arrays["X_train"], arrays["y_train"], epochs=epochs, batch_size=batch_size)
+    metric = float(model.score(arrays["X_test"], arrays["y_test"]))
+  except Exception as err:
+    #one bad candidate must not fail the others
+    return {"params": config, "metric": None, "seconds": time.perf_counter() - start, "error": f"{type(err).__name__}: {err}"}
+  return {"params": config, "metric": metric, "seconds": time.perf_counter() - start}
+
+
+class SharedArrays:
+  """
+  Copies of named arrays in shared memory; descriptors is what a worker
+  needs to attach to them.
+  """
+
+  def __init__(self, arrays):
+    from multiprocessing import shared_memory
+
+    self.blocks = []
+    self.descriptors = {}
+    try:
+      for name, value in arrays.items():
+        value = np.ascontiguousarray(value)
+        block = shared_memory.SharedMemory(create=True, size=max(value.nbytes, 1))
+        self.blocks.append(block)
+        np.ndarray(value.shape, dtype=value.dtype, buffer=block.buf)[...] = value
+        self.descriptors[name] = (block.name, value.shape, value.dtype.str)
+    except BaseException:
+      self.close()
+      raise
+
+  def close(self):
+    for block in self.blocks:
+      block.close()
+      block.unlink()
+    self.blocks = []
+
+  @staticmethod
+  def attach(descriptors):
+    """
+    Attaches to the arrays of descriptors in a worker process. Returns
+    (blocks, {name: array}); close the blocks once the arrays are no
+    longer used.
+    """
+    from multiprocessing import shared_memory
+
+    blocks = []
+    arrays = {}
+    try:
+      for name, (block_name, shape, dtype) in descriptors.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        blocks.append(block)
+        arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+    except BaseException:
+      for block in blocks:
+        block.close()
+      raise
+    return blocks, arrays
+
+
+def _fit_shared(base, config, first, descriptors, epochs, batch_size):
+  """
+  fit_config in a worker process, on arrays attached from shared memory.
+  """
+  blocks, arrays = SharedArrays.attach(descriptors)
+  try:
+    result = fit_config(base, config, first, arrays, epochs, batch_size)
+    del arrays
+    return result
+  finally:
+    for block in blocks:
+      block.close()
+
+
+def _run_parallel(base, configs, first, arrays, epochs, batch_size, workers):
+  from concurrent.futures import ProcessPoolExecutor
+
+  shared = SharedArrays(arrays)
+  try:
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+      futures = [pool.submit(_fit_shared, base, config, first, shared.descriptors, epochs, batch_size) for config in configs]
+      return [future.result() for future in futures]
+  finally:
+    shared.close()
+
+
+def run_sweep(base, configs, first, arrays, epochs=100, batch_size=32, workers=None):
+  """
+  Trains and scores one candidate per config.
+
+  Parameters
+  ----------
+  base, first, arrays, epochs, batch_size: see fit_config
+  configs: list of param dicts, see expand_grid
+  workers: worker processes, default one per core; 1 trains in this
+    process
+
+  Returns
+  -------
+  results in config order (see fit_config), number of worker processes
+  used (1 when the sweep ran sequentially)
+  """
+  workers = max(1, min(workers or os.cpu_count() or 1, len(configs)))
+  if workers > 1:
+    try:
+      return _run_parallel(base, configs, first, arrays, epochs, batch_size, workers), workers
+    except (OSError, ImportError) as err:
+      print(f"process pool or shared memory unavailable ({err}), sweeping sequentially")
+  return [fit_config(base, config, first, arrays, epochs, batch_size) for config in configs], 1
+
+
+def sweep_records(results, metricName, dataset, parent):
+  """
+  Returns the metrics log records of a sweep's results, best first.
+  """
+  sweep_id = uuid.uuid4().hex
+  now = time.time()
+  records = []
+  for result in results:
+    record = {"kind": "sweep", "sweep": sweep_id, "params": result["params"], "metric": result["metric"], "metricName": metricName,
+              "dataset": dataset, "parent": parent, "seconds": result["seconds"], "time": now}
+    if "error" in result:
+      record["error"] = result["error"]
+    records.append(record)
+  records.sort(key=lambda record: (record["metric"] is not None, record["metric"] or 0), reverse=True)
+  return records
@@ -0,0 +1,196 @@
+"""
+Epoch/minibatch driver for incremental partial_fit training.
+
+partial_fit makes one SGD pass over the rows it is given, so training on
+a chunk runs several shuffled epochs of minibatches. Each epoch shuffles
+an index array in place and gathers every batch into a preallocated
+buffer with np.take, so the training data is never copied in permuted
+order.
+
+train_epochs_sharded runs the epochs data-parallel: the rows are split
+into shards, every shard trains a copy of the model in its own worker
+process from the same starting weights, and the copies' weights are
+averaged (weighted by shard rows) after every sync_every epochs.
+"""
+import os
+import time
+
+import numpy as np
+
+# fewer rows per shard than this do not pay for starting worker processes
+MIN_SHARD_ROWS = 1000
+# fitted attributes of SGDClassifier/SGDRegressor that are averaged over shards
+AVERAGED_ATTRIBUTES = ("coef_", "intercept_", "_average_coef", "_average_intercept", "_standard_coef", "_standard_intercept")
+
+
+def train_epochs(model, X, y, epochs=100, batch_size=32, classes=None, random_state=None, on_epoch=None):
+  """
+  Trains model with shuffled minibatch partial_fit epochs.
+
+  Parameters
+  ----------
+  model: estimator with partial_fit (SGDClassifier, SGDRegressor)
+  X: (rows, features) training data
+  y: (rows,) training targets
+  epochs: number of passes over the data
+  batch_size: rows per partial_fit call; None makes each epoch a single
+    call over all rows
+  classes: class labels, passed with the first partial_fit call only
+    (needed by classifiers that have not been fitted yet)
+  random_state: seed or numpy Generator for the shuffles
+  on_epoch: optional callback(epoch, seconds) called after every epoch
+
+  Returns
+  -------
+  list of per-epoch wall-clock times in seconds
+  """
+  X = np.ascontiguousarray(X)
+  y = np.ascontiguousarray(y)
+  n = X.shape[0]
+  if n == 0:
+    raise ValueError("no training rows")
+  if batch_size is None or batch_size > n:
+    batch_size = n
+  if batch_size < 1:
+    raise ValueError("batch_size must be at least 1")
+
+  rng = np.random.default_rng(random_state)
+  order = np.arange(n)
+  X_batch = np.empty((batch_size,) + X.shape[1:], dtype=X.dtype)
+  y_batch = np.empty((batch_size,) + y.shape[1:], dtype=y.dtype)
+
+  fit_kwargs = {} if classes is None else {"classes": classes}
+  epoch_times = []
+  for epoch in range(epochs):
+    start = time.perf_counter()
+    rng.shuffle(order)
+    for i in range(0, n, batch_size):
+      rows = order[i:i + batch_size]
+      m = len(rows)
+      np.take(X, rows, axis=0, out=X_batch[:m])
+      np.take(y, rows, axis=0, out=y_batch[:m])
+      model.partial_fit(X_batch[:m], y_batch[:m], **fit_kwargs)
+      fit_kwargs = {}
+    epoch_times.append(time.perf_counter() - start)
+    if on_epoch is not None:
+      on_epoch(epoch, epoch_times[-1])
+  return epoch_times
+
+
+def average_models(model, shard_models, weights):
+  """
+  Sets model to the weighted average of shard_models, copies of it that
+  were trained on different shards: the weights in AVERAGED_ATTRIBUTES
+  are averaged, t_ (the SGD step counter the learning rate schedules
+  use) counts the steps of every shard, and all other fitted state
+  (classes_, n_features_in_, ...) is taken from the first copy.
+  """
+  base_t = getattr(model, "t_", 1.0)
+  merged = vars(shard_models[0]).copy()
+  for name in AVERAGED_ATTRIBUTES:
+    values = [getattr(shard_model, name, None) for shard_model in shard_models]
+    if all(value is not None for value in values):
+      merged[name] = np.average(np.stack(values), axis=0, weights=weights)
+  if "t_" in merged:
+    merged["t_"] = base_t + sum(shard_model.t_ - base_t for shard_model in shard_models)
+  vars(model).update(merged)
+  return model
+
+
+def _train_shard(model, descriptors, rows, epochs, batch_size, classes, seed):
+  """
+  train_epochs in a worker process on the rows of one shard, gathered
+  from arrays attached from shared memory. Returns the trained copy.
+  """
+  from inclearn.sweep import SharedArrays
+
+  blocks, arrays = SharedArrays.attach(descriptors)
+  try:
+    X = arrays["X"][rows]
+    y = arrays["y"][rows]
+    del arrays
+  finally:
+    for block in blocks:
+      block.close()
+  train_epochs(model, X, y, epochs=epochs, batch_size=batch_size, classes=classes, random_state=seed)
+  return model
+
+
+def _train_parallel(model, X, y, epochs, batch_size, shards, sync_every, classes, rng, on_epoch):
+  from concurrent.futures import ProcessPoolExecutor
+
+  from inclearn.sweep import SharedArrays
+
+  shard_rows = np.array_split(rng.permutation(X.shape[0]), shards)
+  weights = [len(rows) for rows in shard_rows]
+  shared = SharedArrays({"X": X, "y": y})
+  epoch_times = []
+  try:
+    with ProcessPoolExecutor(max_workers=shards) as pool:
+      done = 0
+      while done < epochs:
+        #every shard starts the round from the averaged weights
+        round_epochs = min(sync_every, epochs - done)
+        start = time.perf_counter()
+        seeds = rng.integers(2**32, size=shards)
+        futures = [pool.submit(_train_shard, model, shared.descriptors, rows, round_epochs, batch_size, classes, int(seed))
+                   for rows, seed in zip(shard_rows, seeds)]
+        average_models(model, [future.result() for future in futures], weights)
+        classes = None
+        seconds = (time.perf_counter() - start) / round_epochs
+        for epoch in range(done, done + round_epochs):
+          epoch_times.append(seconds)
+          if on_epoch is not None:
+            on_epoch(epoch, seconds)
+        done += round_epochs
+  finally:
+    shared.close()
+  return epoch_times
+
+
+def train_epochs_sharded(model, X, y, epochs=100, batch_size=32, shards=None, sync_every=1, classes=None,
+                         random_state=None, on_epoch=None):
+  """
+  Trains model like train_epochs, data-parallel over shards of the rows.
+
+  Parameters
+  ----------
+  model, X, y, epochs, batch_size, classes, random_state, on_epoch: see
+    train_epochs; on_epoch gets each round's time spread over its epochs
+  shards: worker processes, default one per core; capped so every shard
+    has at least MIN_SHARD_ROWS rows
+  sync_every: epochs between averaging the shards' weights, None to
+    average once after all epochs (which drifts further from the
+    sequential result, see benchmarks/bench_sharded_trainer.py)
+
+  Returns
+  -------
+  list of per-epoch wall-clock times in seconds, number of shards used
+  (1 when the epochs ran in this process)
+  """
+  X = np.ascontiguousarray(X)
+  y = np.ascontiguousarray(y)
+  if X.shape[0] == 0:
+    raise ValueError("no training rows")
+  shards = max(1, min(shards or os.cpu_count() or 1, X.shape[0] // MIN_SHARD_ROWS))
+  sync_every = epochs if sync_every is None else max(1, int(sync_every))
+  rng = np.random.default_rng(random_state)
+  if shards > 1 and epochs > 0:
+    try:
+      return _train_parallel(model, X, y, epochs, batch_size, shards, sync_every, classes, rng, on_epoch), shards
+    except (OSError, ImportError) as err:
+      print(f"process pool or shared memory unavailable ({err}), training in one process")
+  return train_epochs(model, X, y, epochs=epochs, batch_size=batch_size, classes=classes, random_state=rng,
+                      on_epoch=on_epoch), 1
+
+
+def summarize(epoch_times):
+  """
+  Returns a one-line summary of per-epoch timings for the logs.
+  """
+  if not epoch_times:
+    return "0 epochs"
+  total = sum(epoch_times)
+  return (f"{len(epoch_times)} epochs in {total:.3f}s "
+          f"(mean {total / len(epoch_times) * 1000:.2f} ms, "
+          f"min {min(epoch_times) * 1000:.2f} ms, max {max(epoch_times) * 1000:.2f} ms)")
@@ -0,0 +1,170 @@
+import json
+import os
+import sys
+import tempfile
+
+
+# shared code (inclearn) ships as a lambda layer; in a checkout it lives next to this folder
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from inclearn import instrument, jobs, runtime
+
+#
+# Asynchronous training jobs. Events (fields may also come as query
+# string parameters):
+#
+#   "submit"  {"kind": "train_job" | "train_job_reg" | "predict", "event": {...},
+#              optional "jobId" chosen by the client so a retried submit is
+#              queued once}                      -> {"jobId", "status"}
+#   "status"  {"jobId"}                          -> the job record
+#   "list"    optional {"modelFolder", "limit"}  -> {"jobs": [...]}
+#   "drain"   optional {"maxJobs"}               -> {"ran"}; runs queued jobs in
+#              this invocation until maxJobs ran, the queue is empty or the
+#              invocation is about to time out
+#
+# Workers can also run outside Lambda, next to the queue database:
+#
+#   python lambda_function.py --workers 4
+#
+# The handlers jobs run are the sibling lambda_functions/<kind> folders.
+#
+HANDLER_DIRS = {"train_job": "train_job", "train_job_reg": "train_job _reg", "predict": "predict"}
+# seconds left to an invocation when drain stops claiming jobs
+DRAIN_MARGIN = 120
+
+_handlers = {}
+
+
+def load_handlers():
+  """
+  Returns {kind: lambda_handler}; every handler file has the same module
+  name, so they are loaded by path.
+  """
+  if not _handlers:
+    import importlib.util
+
+    lambda_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    for kind, folder in HANDLER_DIRS.items():
+      spec = importlib.util.spec_from_file_location(f"handler_{kind}", os.path.join(lambda_dir, folder, "lambda_function.py"))
+      module = importlib.util.module_from_spec(spec)
+      spec.loader.exec_module(module)
+      _handlers[kind] = module.lambda_handler
+  return _handlers
+
+
+def get_param(event, name):
+  if name in event:
+    return event[name]
+  return (event.get("queryStringParameters") or {}).get(name)
+
+
+@instrument.handler("jobs")
+def lambda_handler(event, context):
+  try:
+    print("**STARTING**")
+
+    action = get_param(event, "action")
+    if action is None:
+        raise Exception("requires action in event")
+
+    queue = runtime.get_job_queue()
+    print(f"action: {action}")
+
+    if action == "submit":
+      kind = get_param(event, "kind")
+      if kind not in HANDLER_DIRS:
+          raise Exception(f"requires kind in event, one of {sorted(HANDLER_DIRS)}")
+      job_event = get_param(event, "event")
+      if not isinstance(job_event, dict):
+          raise Exception("requires the job's event in event")
+      session = job_event.get("modelBucket") or job_event.get("modelFolder")
+      if session is None:
+          raise Exception("the job's event requires modelBucket or modelFolder")
+
+      job = queue.submit(kind, session, job_event, get_param(event, "jobId"))
+      print(f"job {job['jobId']} is {job['status']}")
+      return {
+        'statusCode': 200,
+        'body': json.dumps({"jobId": job["jobId"], "status": job["status"]})
+      }
+
+    elif action == "status":
+      jobId = get_param(event, "jobId")
+      if jobId is None:
+          raise Exception("requires jobId in event")
+      job = queue.get(jobId)
+      if job is None:
+          raise Exception(f"no job {jobId}")
+      return {
+        'statusCode': 200,
+        'body': json.dumps(job)
+      }
+
+    elif action == "list":
+      found = queue.list(get_param(event, "modelFolder"), int(get_param(event, "limit") or 100))
+      return {
+        'statusCode': 200,
+        'body': json.dumps({"jobs": found})
+      }
+
+    elif action == "drain":
+      maxJobs = get_param(event, "maxJobs")
+      deadline = None
+      if context is not None:
+        #stop claiming while there is still time to finish a job
+        import time
+
+        deadline = time.time() + context.get_remaining_time_in_millis() / 1000 - DRAIN_MARGIN
+      ran = jobs.drain(queue, load_handlers(), max_jobs=None if maxJobs is None else int(maxJobs), deadline=deadline)
+      return {
+        'statusCode': 200,
+        'body': json.dumps({"ran": ran})
+      }
+
+    else:
+      raise Exception(f"unknown action '{action}'")
+
+  except Exception as err:
+    print("**ERROR**")
+    print(str(err))
+
+    return {
+      'statusCode': 400,
+      'body': json.dumps(str(err))
+    }
+
+
+def work(worker, idle_seconds, max_jobs):
+  """
+  Drains the queue as one worker with its own scratch directory.
+  """
+  runtime.set_scratch_dir(tempfile.mkdtemp(prefix=f"inclearn-worker{worker}-"))
+  return jobs.drain(runtime.get_job_queue(), load_handlers(), worker=f"{os.getpid()}-{worker}",
+                    max_jobs=max_jobs, idle_seconds=idle_seconds)
+
+
+def main():
+  import argparse
+  import threading
+
+  parser = argparse.ArgumentParser(description="Runs job workers against the queue in config.ini.")
+  parser.add_argument("--workers", type=int, default=1)
+  parser.add_argument("--idle", type=float, default=float("inf"), help="exit after this many seconds without jobs")
+  parser.add_argument("--max-jobs", type=int, default=None, help="jobs per worker")
+  args = parser.parse_args()
+
+  #an sqlite queue is shared by worker processes; a memory queue only by threads of this process
+  if isinstance(runtime.get_job_queue(), jobs.SQLiteQueue):
+    import multiprocessing
+
+    runtime.reset()
+    workers = [multiprocessing.Process(target=work, args=(i, args.idle, args.max_jobs)) for i in range(args.workers)]
+  else:
+    workers = [threading.Thread(target=work, args=(i, args.idle, args.max_jobs)) for i in range(args.workers)]
+  for worker in workers:
+    worker.start()
+  for worker in workers:
+    worker.join()
+
+
+if __name__=="__main__":
+  main()
@@ -1,39 +1,65 @@
 import json
-import boto3
 import os
-import csv
-import tempfile
-import joblib
-import numpy as np
+import sys
 
-from sklearn.preprocessing import StandardScaler
 
-from configparser import ConfigParser
+# shared code (inclearn) ships as a lambda layer; in a checkout it lives next to this folder
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+#numpy, sklearn and joblib are imported where they are first needed, so
+#invalid events and missing datasets return without loading sklearn
+from inclearn import datastore, evalcache, instrument, runtime
+from inclearn.instrument import span
+from inclearn.storage import NotFound
 
+
+def get_scorer(storage, model_cache, model_file_path):
+  """
+  Returns the LinearScorer of a model's compact form, or None for models
+  saved before the compact form existed.
+  """
+  from inclearn.compact import compact_name, load_compact
+
+  try:
+    with span("load_model"):
+      return model_cache.get(storage, compact_name(model_file_path), loader=load_compact)
+  except NotFound:
+    return None
+
+
+def load_scorer(storage, model_cache, model_file_path, X=None):
+  """
+  Returns the LinearScorer of a model, converting its .joblib when it has
+  no compact form. Models saved without their scaler get one fitted on
+  the inference rows X, as scoring does; without X they cannot be used.
+  """
+  scorer = get_scorer(storage, model_cache, model_file_path)
+  if scorer is not None:
+    return scorer
+
+  from inclearn.artifacts import unpack
+  from inclearn.compact import scorer_from_estimator
+
+  with span("load_model"):
+    loaded_model, scaler = unpack(model_cache.get(storage, model_file_path))
+  if scaler is None:
+    if X is None:
+      raise Exception("model was saved without its scaler, retrain it to predict")
+    from sklearn.preprocessing import StandardScaler
+
+    scaler = StandardScaler().fit(X)
+  return scorer_from_estimator(loaded_model, scaler)
+
+
+@instrument.handler("predict")
 def lambda_handler(event, context):
   try:
     print("**STARTING**")
     
     #
-    # setup AWS based on config file:
-    #
-    config_file = 'config.ini'
-    os.environ['AWS_SHARED_CREDENTIALS_FILE'] = config_file
-    
-    configur = ConfigParser()
-    configur.read(config_file)
-    
-    #
-    # configure for S3 access:
+    # config and storage access are set up once per container and reused
+    # by warm invocations:
     #
-    s3_profile = 's3readwrite'
-    boto3.setup_default_session(profile_name=s3_profile)
-    
-    bucketname = configur.get('s3', 'bucket_name')
-    
-    s3_resource = boto3.resource('s3')
-    bucket = s3_resource.Bucket(bucketname)
-    s3_client = boto3.client('s3')
+    storage = runtime.get_storage()
     
     modelFolder = ""
     modelName = ""
@@ -44,73 +70,205 @@ def lambda_handler(event, context):
       modelFolder = event["modelFolder"]
     else:
         raise Exception("requires model folder name in event")
+    #"score" (default) scores the model on a labeled dataset, "predict" writes
+    #its predictions for every row of a dataset to the session, "leaderboard"
+    #scores every (or the topN) model of the session on a labeled dataset,
+    #"invalidate" drops memoized scores (of modelName, on datasetFilenameIn,
+    #both, or all of the session's)
+    mode = event.get("mode", "score")
     #check for model name
     if "modelName" in event:
       modelName = event["modelName"]
-    else:
+    elif mode not in ("leaderboard", "invalidate"):
         raise Exception("requires model name in event")
     #check for dataset filename
     if "datasetFilenameIn" in event:
       datasetFilenameIn = event["datasetFilenameIn"]
-    else:
+    elif mode != "invalidate":
         raise Exception("requires dataset file name in event")
     #check for train type (0 for classification, 1 for regression)
     if "trainType" in event:
       trainType = event["trainType"]
-    else:
+    elif mode == "score":
         raise Exception("requires train type in event")
 
-    print(f"modelFolder: {modelFolder}, modelName: {modelName}, datasetFilenameIn: {datasetFilenameIn}, trainType: {trainType}")
+    print(f"modelFolder: {modelFolder}, modelName: {modelName}, datasetFilenameIn: {datasetFilenameIn}, trainType: {trainType}, mode: {mode}")
+
+    local_file_path = runtime.scratch_path("dataset.csv")
+    #the name is an alias of content-addressed bytes (older sessions: the file itself)
+    if datasetFilenameIn:
+      dataset_file_path, dataset_sha256 = datastore.resolve(storage, modelFolder, datasetFilenameIn)
+    model_file_path = os.path.join(modelFolder,modelName)
+
+    if mode == "predict":
+      #the dataset is read in blocks of blockRows rows and the predictions are
+      #streamed to <modelFolder>/predictions/, so memory use stays constant;
+      #hasTarget drops a last target column
+      from inclearn.datasets import dataset_chunks
+      from inclearn.inference import BLOCK_ROWS, predict_to_storage
+
+      try:
+        make_chunks = dataset_chunks(storage, dataset_file_path, local_file_path, int(event.get("blockRows", BLOCK_ROWS)),
+                                     has_target=bool(event.get("hasTarget", False)))
+      except NotFound as err:
+        print("no dataset found")
+        print(str(err))
+        return {
+          'statusCode': 400,
+          'body': json.dumps("No dataset found.")
+        }
+
+      scorer = load_scorer(storage, runtime.get_model_cache(), model_file_path)
+
+      outputFilename = event.get("outputFilename")
+      if outputFilename is None:
+        outputFilename = os.path.splitext(os.path.basename(datasetFilenameIn))[0] + "-" + os.path.splitext(modelName)[0] + ".csv"
+      predictions_file_path = os.path.join(modelFolder, "predictions", outputFilename)
+      rows = predict_to_storage(storage, scorer, make_chunks, predictions_file_path)
+      print(f"wrote {rows} predictions to {predictions_file_path}")
+      return {
+        'statusCode': 200,
+        'body': json.dumps({"predictions": predictions_file_path, "rows": rows})
+      }
+    elif mode == "invalidate":
+      dataset = None
+      if datasetFilenameIn:
+        try:
+          dataset = evalcache.dataset_id(storage, dataset_file_path, dataset_sha256)
+        except NotFound:
+          return {
+            'statusCode': 400,
+            'body': json.dumps("No dataset found.")
+          }
+      dropped = evalcache.invalidate(storage, modelFolder, dataset, modelName or None)
+      print(f"dropped {dropped} memoized scores")
+      return {
+        'statusCode': 200,
+        'body': json.dumps({"invalidated": dropped})
+      }
+    elif mode not in ("score", "leaderboard"):
+      raise Exception(f"unknown mode '{mode}'")
 
-    ##get dataset in modelBucket##
-    #download to local memory then load
-    local_file_path = "/tmp/dataset.csv" 
-    dataset_file_path = os.path.join(modelFolder,datasetFilenameIn)
+    #
+    # scores are memoized per model and dataset content, so repeated requests
+    # are answered without downloading the dataset; refresh recomputes them:
+    #
     try:
-      bucket.download_file(dataset_file_path, local_file_path)
-    except Exception as err:
+      dataset = evalcache.dataset_id(storage, dataset_file_path, dataset_sha256)
+    except NotFound as err:
       print("no dataset found")
       print(str(err))
       return {
         'statusCode': 400,
         'body': json.dumps("No dataset found.")
       }
-    X=[]
-    y=[]
-    
+    cached = evalcache.load(storage, modelFolder, dataset)
+    if event.get("refresh", False):
+      cached["scores"] = {}
 
-    with open(local_file_path, 'r') as file:
-      my_reader = csv.reader(file, delimiter=',')
-      next(my_reader)
-      for row in my_reader:
-          X.append([float(value) for value in row[:-1]])  
-          y.append(float(row[-1])) 
+    if mode == "leaderboard":
+      from inclearn.inference import rank, select_models
+      from inclearn.registry import load_registry, registry_from_listing
 
-    X = np.array(X)
-    y = np.array(y)
-    
-    scaler = StandardScaler()
-    scaler.fit(X)
-    X = scaler.transform(X)
-    
-    if (len(X) == 0):
-      print("**error reading csv dataset file, returning...**")
-      raise Exception("Could not read dataset.")
+      registry = load_registry(storage, modelFolder)
+      if registry is None:
+        registry = registry_from_listing(storage, modelFolder)
+      entries = select_models(registry["models"], event.get("topN"))
+      if len(entries) == 0:
+        raise Exception("no models found in session")
+      missing = [entry for entry in entries if entry["name"] not in cached["scores"]]
+      instrument.count("evalcache.hit", len(entries) - len(missing))
+      print(f"{len(entries) - len(missing)} of {len(entries)} scores memoized")
+    elif modelName in cached["scores"]:
+      instrument.count("evalcache.hit")
+      accuracy = cached["scores"][modelName]["score"]
+      print(f"memoized {cached['scores'][modelName]['metricName']}: {accuracy}")
+      return {
+        'statusCode': 200,
+        'accuracy': accuracy
+      }
+
+    if mode != "leaderboard" or missing:
+      ##get dataset in modelBucket##
+      #download to local memory then load
+      from inclearn.datasets import download_dataset
+
+      try:
+        X, y = download_dataset(storage, dataset_file_path, local_file_path)
+      except NotFound as err:
+        print("no dataset found")
+        print(str(err))
+        return {
+          'statusCode': 400,
+          'body': json.dumps("No dataset found.")
+        }
+
+      if (len(X) == 0):
+        print("**error reading csv dataset file, returning...**")
+        raise Exception("Could not read dataset.")
+      instrument.count("rows", len(X))
+
+    if mode == "leaderboard":
+      if missing:
+        #the dataset is parsed once and the models are stacked into one matrix,
+        #so all of them are scored with a single matrix product per block
+        from inclearn.inference import score_stacked
+
+        model_cache = runtime.get_model_cache()
+        scorers = [load_scorer(storage, model_cache, os.path.join(modelFolder, entry["name"]), X) for entry in missing]
+        instrument.count("models", len(scorers))
+        with span("score"):
+          scores = score_stacked(scorers, X, y)
+        print(f"model cache: {model_cache.stats()}")
+        metricName = "accuracy" if scorers[0].is_classifier else "r2"
+        evalcache.record(storage, modelFolder, dataset, dict(zip([entry["name"] for entry in missing], scores)), metricName, len(X))
+        cached["scores"].update({entry["name"]: {"score": score, "metricName": metricName} for entry, score in zip(missing, scores)})
+        cached["rows"] = len(X)
+
+      leaderboard = rank(entries, [cached["scores"][entry["name"]]["score"] for entry in entries])
+      for row in leaderboard:
+        print(f"{row['rank']:>3} v{row['version']} {row['name']}: {row['score']}")
+
+      return {
+        'statusCode': 200,
+        'body': json.dumps({"metricName": cached["scores"][entries[0]["name"]]["metricName"], "rows": cached["rows"], "models": leaderboard})
+      }
     
-    #download model to local memory temporarily then load
-    model_file_path = os.path.join(modelFolder,modelName)
     print(f"model_file_path is {model_file_path}")
 
-    with tempfile.TemporaryFile() as fp:
-      s3_client.download_fileobj(Fileobj=fp, Bucket=bucketname, Key=model_file_path)
-      fp.seek(0)
-      loaded_model = joblib.load(fp)
+    #a warm container reuses the model it loaded before if the object is unchanged;
+    #models with a compact form are scored with numpy alone, older ones are
+    #unpickled from their .joblib
+    model_cache = runtime.get_model_cache()
+    scorer = get_scorer(storage, model_cache, model_file_path)
+
+    if scorer is not None:
+      with span("score"):
+        accuracy = scorer.score(X,y)
+    else:
+      from inclearn.artifacts import unpack
+
+      with span("load_model"):
+        loaded_model, scaler = unpack(model_cache.get(storage, model_file_path))
+
+      #apply the scaling statistics stored with the model; models saved before
+      #scalers were persisted fall back to fitting one on the inference data
+      with span("scale"):
+        if scaler is None:
+          from sklearn.preprocessing import StandardScaler
+
+          scaler = StandardScaler()
+          scaler.fit(X)
+        X = scaler.transform(X)
+
+      with span("score"):
+        accuracy = loaded_model.score(X,y)
+    print(f"model cache: {model_cache.stats()}")
+    evalcache.record(storage, modelFolder, dataset, {modelName: accuracy}, "r2" if trainType else "accuracy", len(X))
 
     if(trainType):
-      accuracy = loaded_model.score(X,y)
       print(f"R2 score: {accuracy}")
     else:
-      accuracy = loaded_model.score(X,y)
       print(f"Accuracy: {accuracy}")
 
     return {
@@ -1,42 +1,38 @@
 import json
-import boto3
 import os
 import uuid
-import csv
-import tempfile
+import sys
 
-from sklearn.preprocessing import StandardScaler
-from sklearn.model_selection import train_test_split
-from sklearn.linear_model import SGDClassifier
-import joblib
-import numpy as np
 
-from configparser import ConfigParser
+# shared code (inclearn) ships as a lambda layer; in a checkout it lives next to this folder
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+#numpy, sklearn and joblib are imported where they are first needed, so
+#invalid events return without loading them
+from inclearn import datastore, instrument, jobs, metricslog, runtime
+from inclearn.instrument import span
+from inclearn.storage import NotFound
+from inclearn.registry import MAX_REBASES, HeadMoved, record_model, resolve_head
 
-def lambda_handler(event):
+
+def new_model():
+  """
+  Returns the estimator a session starts from.
+  """
+  from sklearn.linear_model import SGDClassifier
+
+  return SGDClassifier(max_iter = 100, loss='log', early_stopping=True, shuffle = True, learning_rate='adaptive', eta0 = 0.01)
+
+
+@instrument.handler("train_job")
+def lambda_handler(event, context=None):
   try:
     print("**STARTING**")
     
     #
-    # setup AWS based on config file:
+    # config and storage access are set up once per container and reused
+    # by warm invocations:
     #
-    config_file = 'config.ini'
-    os.environ['AWS_SHARED_CREDENTIALS_FILE'] = config_file
-    
-    configur = ConfigParser()
-    configur.read(config_file)
-    
-    #
-    # configure for S3 access:
-    #
-    s3_profile = 's3readwrite'
-    boto3.setup_default_session(profile_name=s3_profile)
-    
-    bucketname = configur.get('s3', 'bucket_name')
-    
-    s3_resource = boto3.resource('s3')
-    bucket = s3_resource.Bucket(bucketname)
-    s3_client = boto3.client('s3')
+    storage = runtime.get_storage()
     
     # check for bucket name to store model
     modelBucket = ""
@@ -56,143 +52,248 @@ def lambda_handler(event):
       firstModel = event["firstModel"]
     else:
         raise Exception("requires model fit type in event")
+    #optional epochs and minibatch size for partial_fit training (null batchSize: one batch per epoch)
+    n_epochs = int(event.get("epochs", 100))
+    batch_size = event.get("batchSize", 32)
+    if batch_size is not None:
+      batch_size = int(batch_size)
+    
+    #optional data-parallel epochs: continue the model on shards of the rows in that many
+    #worker processes (0: one per core), averaging their weights every syncEvery epochs
+    #(null: once at the end)
+    shards = int(event.get("shards", 1))
+    sync_every = event.get("syncEvery", 1)
+    if shards < 0:
+      raise Exception("shards must be 0 (one per core) or more")
+
+    #optional out-of-core mode: train on the dataset in chunks of chunkRows rows
+    streaming = bool(event.get("streaming", False))
+    chunk_rows = int(event.get("chunkRows", 100000))
+    if streaming and shards != 1:
+      raise Exception("sharded training does not support streaming")
+
+    #"train" (default) trains the next model of the session, "sweep" trains one
+    #candidate per point of a hyperparameter grid and only records their scores
+    mode = event.get("mode", "train")
+    #optional SGD hyperparameters set on the model before training, e.g. the best of a sweep
+    params = event.get("params") or {}
+    if mode == "sweep":
+      if streaming:
+        raise Exception("sweeps do not support streaming")
+      if "grid" not in event:
+        raise Exception("requires hyperparameter grid in event")
+      from inclearn.sweep import expand_grid
+
+      configs = expand_grid(event["grid"])
+    elif mode != "train":
+      raise Exception(f"unknown mode '{mode}'")
+    if params:
+      from inclearn.sweep import apply_params
+
+      #names and values are checked before the dataset is downloaded
+      apply_params(new_model(), params)
     
         
-    print("modelBucket: ", modelBucket, "firstModel: ", firstModel, "dataset: ", datasetFilenameIn)
+    print("modelBucket: ", modelBucket, "firstModel: ", firstModel, "dataset: ", datasetFilenameIn, "streaming: ", streaming)
 
     ##get dataset in modelBucket##
-    #download to local memory then load
-    local_file_path = "/tmp/dataset.csv" 
-    dataset_file_path = os.path.join(modelBucket,datasetFilenameIn)
+    #the dataset is downloaded (and split) once; a step that has to be rebased retrains on it
+    #run as a job, the handler reports its phase (and epochs) to the job's status
+    jobs.progress(phase="download")
+    local_file_path = runtime.scratch_path("dataset.csv")
+    #the name is an alias of content-addressed bytes (older sessions: the file itself)
+    dataset_file_path, dataset_sha256 = datastore.resolve(storage, modelBucket, datasetFilenameIn)
     try:
-      bucket.download_file(dataset_file_path, local_file_path)
-    except Exception as err:
+      if(streaming):
+        #only one chunk of the dataset is in memory at a time
+        from inclearn.datasets import dataset_chunks
+        from inclearn.streaming import stream_fit
+
+        make_chunks = dataset_chunks(storage, dataset_file_path, local_file_path, chunk_rows)
+      else:
+        #download to local memory then load
+        from inclearn.datasets import download_dataset
+
+        X, y = download_dataset(storage, dataset_file_path, local_file_path)
+    except NotFound as err:
       print("no dataset found")
       print(str(err))
       return {
         'statusCode': 400,
         'body': json.dumps("No dataset found.")
       }
-    X=[]
-    y=[]
-
-    with open(local_file_path, 'r') as file:
-      my_reader = csv.reader(file, delimiter=',')
-      next(my_reader)
-      for row in my_reader:
-          X.append([float(value) for value in row[:-1]])  
-          y.append(float(row[-1])) 
-
-    X = np.array(X)
-    y = np.array(y)
-    
-    if (len(X) == 0):
-      print("**error reading csv dataset file, returning...**")
-      raise Exception("Could not read dataset.")
-    
-  # Split the data into training and testing sets
-    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2)
-    scaler = StandardScaler()
-    scaler.fit(X_train)
-    X_train = scaler.transform(X_train)
-    X_test = scaler.transform(X_test)
-      
-    modelName = ""
-    model_file_path = ""
-    prog_file_path = os.path.join(modelBucket,"progress.txt")
-    #if firstModel, instatiate new model and save in modelBucket 
-    if(firstModel):
-      print("first model")
-      print(X_train.shape, y_train.shape)
-      
-      # Initialize the SGDClassifier
-      sgd_clf = SGDClassifier(max_iter = 100, loss='log', early_stopping=True, shuffle = True, learning_rate='adaptive', eta0 = 0.01)
-      sgd_clf.fit(X_train, y_train)
-      accuracy = sgd_clf.score(X_test,y_test)
+
+    if(not streaming):
+      if (len(X) == 0):
+        print("**error reading csv dataset file, returning...**")
+        raise Exception("Could not read dataset.")
+      instrument.count("rows", len(X))
+
+      # Split the data into training and testing sets
+      from sklearn.model_selection import train_test_split
+
+      with span("split"):
+        X_train_raw, X_test_raw, y_train, y_test = train_test_split(X, y, test_size=0.2)
+
+    #
+    # the session head only moves to the new model if it is still the head
+    # this step trained from; if another step moved it first, the model is
+    # discarded and trained again on top of the new head:
+    #
+    for attempt in range(MAX_REBASES + 1):
+      head, head_etag = resolve_head(storage, modelBucket)
+      parentName = None
+      loaded_model = None
+      scaler = None
+      if(not firstModel):
+        ##get latest model##
+        #the session head names it; sessions trained before the registry fall back to a listing
+        if head is None:
+           raise Exception("Initial model not found.")
+        parentName = head["name"]
+        print(f"latest model is {parentName}, version {head['version']}")
+
+        model_file_path = os.path.join(modelBucket,parentName)
+        print(f"model_file_path is {model_file_path}")
+        #training modifies the model and scaler, so take a copy of the cached ones
+        from inclearn.artifacts import unpack
+        from inclearn.sweep import apply_params
+
+        model_cache = runtime.get_model_cache()
+        with span("load_model"):
+          loaded_model, scaler = unpack(model_cache.get(storage, model_file_path, copy_model=True))
+        print(f"model cache: {model_cache.stats()}")
+
+        loaded_model.learning_rate = 'adaptive'
+        loaded_model.eta0 = 0.01
+        loaded_model.early_stopping = False
+        #a continued model cannot change its averaging
+        apply_params(loaded_model, params, continuing=True)
+
+      #the scaler's running mean and variance cover every chunk of the session;
+      #models saved before scalers were persisted start a new one
+      if scaler is None:
+        from sklearn.preprocessing import StandardScaler
+
+        scaler = StandardScaler()
+
+      if(streaming):
+        if(firstModel):
+          print("first model, streaming")
+          from sklearn.linear_model import SGDClassifier
+
+          loaded_model = SGDClassifier(loss='log', shuffle = True, learning_rate='adaptive', eta0 = 0.01)
+          loaded_model.set_params(**params)
+        else:
+          print("subsequent model, streaming")
+
+        jobs.progress(phase="fit")
+        result = stream_fit(loaded_model, scaler, make_chunks, test_size=0.2, epochs=n_epochs, batch_size=batch_size)
+        print(f"trained on {result['trainRows']} rows in {result['chunks']} chunks, scored on {result['testRows']}")
+        instrument.count("rows", result["trainRows"] + result["testRows"])
+        instrument.count("chunks", result["chunks"])
+        accuracy = result["score"]
+
+      else:
+        with span("scale"):
+          scaler.partial_fit(X_train_raw)
+          X_train = scaler.transform(X_train_raw)
+          X_test = scaler.transform(X_test_raw)
+
+        if(mode == "sweep"):
+          #every candidate trains from the same split and scaled rows
+          from inclearn.sweep import run_sweep, sweep_records
+
+          base = new_model().set_params(**params) if firstModel else loaded_model
+          arrays = {"X_train": X_train, "y_train": y_train, "X_test": X_test, "y_test": y_test}
+          jobs.progress(phase="sweep", configs=len(configs))
+          with span("fit"):
+            results, workers = run_sweep(base, configs, bool(firstModel), arrays, epochs=n_epochs, batch_size=batch_size,
+                                         workers=event.get("workers"))
+          instrument.count("configs", len(configs))
+          print(f"swept {len(configs)} configurations with {workers} worker processes")
+
+          with span("progress"):
+            records = sweep_records(results, "accuracy", datasetFilenameIn, parentName)
+            metricslog.append(storage, modelBucket, records)
+            metricslog.try_compact(storage, modelBucket)
+          for record in records:
+            print(f"{record['params']}: {record['metric']}")
+          return {
+            'statusCode': 200,
+            'body': json.dumps({"sweep": records[0]["sweep"], "workers": workers, "results": records})
+          }
+
+        #if firstModel, instatiate new model
+        if(firstModel):
+          print("first model")
+          print(X_train.shape, y_train.shape)
+          # Initialize the SGDClassifier
+          loaded_model = new_model().set_params(**params)
+          jobs.progress(phase="fit")
+          with span("fit"):
+            loaded_model.fit(X_train, y_train)
+
+        else: #if not firstModel, continue training the latest model
+          print("subsequent model")
+          from inclearn.trainer import summarize, train_epochs_sharded
+
+          #epochs of shuffled minibatches since partial_fit only does one pass of gradient descent
+          jobs.progress(phase="fit", epoch=0, epochs=n_epochs)
+          with span("fit"):
+            epoch_times, used_shards = train_epochs_sharded(loaded_model, X_train, y_train, epochs=n_epochs, batch_size=batch_size,
+                                                            shards=shards, sync_every=sync_every,
+                                                            on_epoch=lambda epoch, seconds: jobs.progress(epoch=epoch + 1))
+          instrument.count("shards", used_shards)
+          print(f"{summarize(epoch_times)} on {used_shards} shards")
+
+        with span("score"):
+          accuracy = loaded_model.score(X_test,y_test)
       print(f"Accuracy: {accuracy}")
 
       #save model in modelBucket
       modelName = "model" + str(uuid.uuid4()) + ".joblib"
       model_file_path = os.path.join(modelBucket,modelName)
-      with tempfile.TemporaryFile() as fp:
-        joblib.dump(sgd_clf, fp)
-        fp.seek(0)
-        s3_client.put_object(Body=fp.read(), Bucket=bucketname, Key=model_file_path)
-      
-      #create progress.txt file
-      s3_client.put_object(Body="", Bucket=bucketname, Key=prog_file_path)
+      from inclearn.artifacts import dump_model
+      from inclearn.compact import compact_name, dump_compact, load_compact
+
+      #the compact form next to the .joblib lets predict score without sklearn
+      compact_file_path = compact_name(model_file_path)
+      jobs.progress(phase="save")
+      with span("serialize"):
+        artifact, model_bytes = dump_model(loaded_model, scaler)
+        compact_bytes = dump_compact(loaded_model, scaler)
+      with span("upload"):
+        etag = storage.put_bytes(model_file_path, model_bytes)
+        compact_etag = storage.put_bytes(compact_file_path, compact_bytes)
 
       print("model saved as ", modelName)
 
-    else: #if not firstModel, download latest model in modelBucket and save
-      ##get latest model##
-      s3_client = boto3.client('s3')
-      prefix = os.path.join(modelBucket,"model")
-      response = s3_client.list_objects_v2(Bucket=bucketname, Prefix=prefix)
-      #print(f"respone is {response}")
-      all_models = [obj for obj in response.get('Contents', []) if obj['Key'].endswith("joblib")]
-      if(len(all_models) == 0):
-         raise Exception("Initial model not found.")
-      latest_model = max(all_models, key=lambda x: x['LastModified'])
-      print(f"latest model is {latest_model}, this should have .joblib suffix")
-
-      #download to local memory temporarily then load
-      model_file_path = latest_model['Key']
-      print(f"model_file_path is {model_file_path}")
-      with tempfile.TemporaryFile() as fp:
-        s3_client.download_fileobj(Fileobj=fp, Bucket=bucketname, Key=model_file_path)
-        fp.seek(0)
-        loaded_model = joblib.load(fp)
-
-      print("subsequent model")
-      loaded_model.learning_rate = 'adaptive'
-      loaded_model.eta0 = 0.01
-      loaded_model.early_stopping = False
-
-      n_iterations = 100
-      batch_size = 32
-      #loop to mimic epochs since partial_fit only does one step in gradient descent
-      for iteration in range(n_iterations):
-          permutation_0 = np.random.permutation(X_train.shape[0])
-          X_train = X_train[permutation_0]
-          y_train = y_train[permutation_0]
-
-          # Split the training data into batches
-          for i in range(0, len(X_train), batch_size):
-              X_batch = X_train[i:i+batch_size]
-              y_batch = y_train[i:i+batch_size]
-
-              # Perform partial fit on the current batch
-              loaded_model.partial_fit(X_batch, y_batch)
-
-      accuracy = loaded_model.score(X_test,y_test)
-      print(f"Accuracy: {accuracy}")
+      with span("progress"):
+        #register the new model and move the session head to it
+        try:
+          entry = record_model(storage, modelBucket, modelName, accuracy, "accuracy", parentName, head, head_etag)
+        except HeadMoved as err:
+          print(f"{err}, rebasing ({attempt + 1} of {MAX_REBASES})")
+          instrument.count("rebases", 1)
+          storage.delete([model_file_path, compact_file_path])
+          continue
+      break
+    else:
+      raise Exception(f"the session head kept moving, gave up after {MAX_REBASES} rebases")
 
-      #save model in modelBucket
-      modelName = "model" + str(uuid.uuid4()) + ".joblib"
-      model_file_path = os.path.join(modelBucket,modelName)
-      with tempfile.TemporaryFile() as fp:
-        joblib.dump(loaded_model, fp)
-        fp.seek(0)
-        s3_client.put_object(Body=fp.read(), Bucket=bucketname, Key=model_file_path)
-
-      print("subsequent model saved as ", modelName)
-
-    #write to progress.txt with model name and accuracy
-    writeLine = modelName + " " + str(accuracy)
-    print(f"writeLine is {writeLine}")
-    local_prog_file_path = "/tmp/progress.txt" 
-    bucket.download_file(prog_file_path, local_prog_file_path)
-    with open(local_prog_file_path, "a+") as fp:
-      fp.seek(0)
-      data = fp.read(100)
-      if len(data) > 0:
-         fp.write("\n")
-      fp.write(writeLine)
-      fp.seek(0)
-      s3_client.put_object(Body=fp.read(), Bucket=bucketname, Key=prog_file_path)
-
-    print("wrote model name and acc to progress.txt")
+    print(f"registered {modelName} as version {entry['version']}")
+    model_cache = runtime.get_model_cache()
+    model_cache.put(model_file_path, etag, artifact, model_bytes)
+    model_cache.put(compact_file_path, compact_etag, load_compact(compact_bytes), compact_bytes)
+
+    with span("progress"):
+      #append model name and accuracy to the session's metrics log
+      record = {"model": modelName, "version": entry["version"], "metric": accuracy, "metricName": "accuracy", "dataset": datasetFilenameIn, "datasetSha256": dataset_sha256, "time": entry["created"]}
+      metricslog.append(storage, modelBucket, [record])
+      metricslog.try_compact(storage, modelBucket)
+
+    print("wrote model name and acc to metrics log")
     return {
         'statusCode': 200,
         'accuracy': accuracy
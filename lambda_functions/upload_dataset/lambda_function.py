@@ -1,74 +1,265 @@
 import json
-import boto3
 import os
+import sys
 import base64
+import gzip
 
 
-from configparser import ConfigParser
 
+# shared code (inclearn) ships as a lambda layer; in a checkout it lives next to this folder
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from inclearn import datastore, instrument, runtime
+
+#
+# Datasets are stored by content (see inclearn.datastore); dataset_filename
+# becomes an alias in modelFolder. A client that knows the sha256 of its
+# file asks first:
+#
+#   action "link" with "sha256" -> {"linked": true} if the bucket already
+#                holds those bytes; the name now points at them and nothing
+#                has to be sent
+#
+# Otherwise the csv is sent one of two ways:
+#
+#   action "put" (default): the whole csv, base64-encoded, in "dataset"
+#
+#   multipart, for files of any size:
+#     "begin"    -> {"uploadId", "partSize"}
+#     "presign"  -> {"urls": {partNumber: url}} for up to PRESIGN_BATCH
+#                "partNumbers"; every part is PUT to its url, straight to
+#                the bucket. "urls" is null if the storage backend has no
+#                such urls, and parts are sent with "part" instead
+#     "part"     raw (or gzip with encoding=gzip) bytes of one part as the
+#                request body; uploadId and partNumber (1, 2, ...) in the
+#                query string -> {"partNumber", "ETag"}
+#     "status"   -> {"parts": [{"partNumber", "size"}, ...]} to resume
+#     "complete" assembles the parts in partNumber order
+#     "abort"    discards the parts
+#
+# Every part except the last must hold at least 5 MiB of csv. A request
+# to the function carries at most 6 MB, so a "part" only fits if it
+# compresses well (8 MiB of csv is about 10.7 MB as base64); clients
+# upload through "presign" whenever it returns urls. "put" and "complete"
+# take an optional "sha256" that the stored bytes must match, and answer
+# {"sha256", "size", "deduplicated"}.
+#
+PART_SIZE = 8 * 1024 * 1024
+# S3 numbers parts 1..10000
+MAX_PARTS = 10000
+# urls signed per "presign" request, and how long each stays valid
+PRESIGN_BATCH = 100
+PRESIGN_SECONDS = 3600
+
+
+def get_param(event, name):
+  """
+  Returns a request field from the event, or from the query string for
+  requests whose body is a raw part.
+  """
+  if name in event:
+    return event[name]
+  return (event.get("queryStringParameters") or {}).get(name)
+
+
+def part_bytes(event):
+  """
+  Returns the raw bytes of a part request body.
+  """
+  body = event.get("body")
+  if body is None:
+    raise Exception("requires part bytes in request body")
+  if event.get("isBase64Encoded"):
+    data = base64.b64decode(body)
+  elif isinstance(body, str):
+    data = body.encode()
+  else:
+    data = body
+  if get_param(event, "encoding") == "gzip":
+    data = gzip.decompress(data)
+  return data
+
+
+def store_columnar(storage, local_file_path, upload_file_path):
+  """
+  Stores the columnar form next to the csv so training and predict can
+  memory-map it instead of parsing the csv on every call.
+  """
+  #numpy is only needed here, so the other actions never import it
+  from inclearn.columnar import columnar_name, csv_to_columnar
+
+  columnar_file_path = columnar_name(upload_file_path)
+  try:
+    local_columnar_path = columnar_name(local_file_path)
+    with instrument.span("convert"):
+      shape = csv_to_columnar(local_file_path, local_columnar_path)
+    instrument.count("rows", shape[1])
+    storage.upload_file(local_columnar_path, columnar_file_path)
+    print(f"columnar form {columnar_file_path} has {shape[0] - 1} features, {shape[1]} rows")
+  except ValueError as err:
+    #not a numeric dataset; make sure an older columnar form is not used instead
+    print(f"could not convert {upload_file_path} to columnar form: {err}")
+    storage.delete([columnar_file_path])
+
+
+def store_dataset(storage, local_file_path, modelFolder, dataset_filename, sha256, stored_key=None):
+  """
+  Stores an uploaded csv by its content, converts content that is new to
+  the bucket to columnar form and points the dataset name at it.
+  stored_key is where the storage holds the same bytes already, see
+  datastore.store.
+
+  Returns
+  -------
+  response body {"sha256", "size", "deduplicated"}
+  """
+  with instrument.span("store"):
+    sha256, size, new = datastore.store(storage, local_file_path, sha256, stored_key)
+  if new:
+    store_columnar(storage, local_file_path, datastore.blob_key(sha256))
+  else:
+    print(f"content {sha256} is already stored")
+    instrument.count("dataset.deduplicated")
+  datastore.write_alias(storage, modelFolder, dataset_filename, sha256, size)
+  print(f"{modelFolder}/{dataset_filename} -> {sha256}")
+  return {"sha256": sha256, "size": size, "deduplicated": not new}
+
+
+@instrument.handler("upload_dataset")
 def lambda_handler(event, context):
   try:
     print("**STARTING**")
-    
-    #
-    # setup AWS based on config file:
-    #
-    config_file = 'config.ini'
-    os.environ['AWS_SHARED_CREDENTIALS_FILE'] = config_file
-    
-    configur = ConfigParser()
-    configur.read(config_file)
-    
+
     #
-    # configure for S3 access:
+    # config and storage access are set up once per container and reused
+    # by warm invocations:
     #
-    s3_profile = 's3readwrite'
-    boto3.setup_default_session(profile_name=s3_profile)
-    
-    bucketname = configur.get('s3', 'bucket_name')
-    
-    s3_resource = boto3.resource('s3')
-    bucket = s3_resource.Bucket(bucketname)
-    
-    dataset = ""
+    storage = runtime.get_storage()
+
+    action = get_param(event, "action") or "put"
     dataset_filename = ""
     modelFolder = ""
-    #check for dataset 
-    if "dataset" in event:
-      dataset = event["dataset"]
-    else:
-        raise Exception("requires csv dataset in event")
     #check for dataset file name
-    if "dataset_filename" in event:
-      dataset_filename = event["dataset_filename"]
-    else:
+    dataset_filename = get_param(event, "dataset_filename")
+    if dataset_filename is None:
         raise Exception("requires csv dataset filename in event")
-    #check for model name (name of folder to store model artifacts, progress.txt, datasets) 
-    if "modelFolder" in event:
-      modelFolder = event["modelFolder"]
-    else:
+    #check for model name (name of folder to store model artifacts, metrics, datasets)
+    modelFolder = get_param(event, "modelFolder")
+    if modelFolder is None:
         raise Exception("requires model folder name in event")
-    
-    print(f"dataset: {dataset}, dataset_filename: {dataset_filename} modelFolder: {modelFolder}")
-
-    upload_file_path = os.path.join(modelFolder,dataset_filename)
-       
-    base64_bytes = dataset.encode()       
-    bytes = base64.b64decode(base64_bytes)
-
-    #upload csv file to bucket
-    key = ""
-    filelist=""
-    local_file_path = "/tmp/" + dataset_filename
-    with open(local_file_path, 'wb') as fp:
-      fp.write(bytes)
-      bucket.upload_file(local_file_path, upload_file_path)
 
-    return {
-      'statusCode': 200,
-      'body': "Uploaded"
-    }
-    
+    print(f"action: {action}, dataset_filename: {dataset_filename} modelFolder: {modelFolder}")
+
+    #multipart uploads are assembled here, then stored by content
+    upload_file_path = os.path.join(modelFolder,"uploads",dataset_filename)
+    local_file_path = runtime.scratch_path(os.path.basename(dataset_filename))
+    sha256 = get_param(event, "sha256")
+
+    if action == "link":
+      if sha256 is None:
+          raise Exception("requires sha256 in event")
+      alias = datastore.link(storage, modelFolder, dataset_filename, sha256)
+      print(f"linked to {sha256}" if alias else f"no content {sha256}, upload it")
+      return {
+        'statusCode': 200,
+        'body': json.dumps({"linked": alias is not None})
+      }
+
+    if action == "put":
+      #check for dataset
+      if "dataset" in event:
+        dataset = event["dataset"]
+      else:
+          raise Exception("requires csv dataset in event")
+
+      with instrument.span("decode"):
+        base64_bytes = dataset.encode()
+        bytes = base64.b64decode(base64_bytes)
+
+      #upload csv file to storage
+      with open(local_file_path, 'wb') as fp:
+        fp.write(bytes)
+      result = store_dataset(storage, local_file_path, modelFolder, dataset_filename, sha256)
+
+      return {
+        'statusCode': 200,
+        'body': json.dumps(result)
+      }
+
+    if action == "begin":
+      uploadId = storage.begin_multipart(upload_file_path)
+      print(f"started multipart upload {uploadId}")
+      return {
+        'statusCode': 200,
+        'body': json.dumps({"uploadId": uploadId, "partSize": PART_SIZE})
+      }
+
+    uploadId = get_param(event, "uploadId")
+    if uploadId is None:
+        raise Exception("requires uploadId in event")
+
+    if action == "part":
+      partNumber = int(get_param(event, "partNumber"))
+      with instrument.span("decode"):
+        data = part_bytes(event)
+      etag = storage.upload_part(upload_file_path, uploadId, partNumber, data)
+      print(f"stored part {partNumber}, {len(data)} bytes")
+      return {
+        'statusCode': 200,
+        'body': json.dumps({"partNumber": partNumber, "ETag": etag})
+      }
+
+    elif action == "presign":
+      partNumbers = get_param(event, "partNumbers")
+      if (not isinstance(partNumbers, list) or len(partNumbers) > PRESIGN_BATCH
+          or not all(isinstance(n, int) and 1 <= n <= MAX_PARTS for n in partNumbers)):
+        raise Exception(f"requires partNumbers, a list of at most {PRESIGN_BATCH} part numbers in 1..{MAX_PARTS}")
+      urls = {}
+      for partNumber in partNumbers:
+        url = storage.presign_part(upload_file_path, uploadId, partNumber, PRESIGN_SECONDS)
+        if url is None:
+          print("storage has no presigned part urls, parts go through this function")
+          urls = None
+          break
+        urls[str(partNumber)] = url
+      return {
+        'statusCode': 200,
+        'body': json.dumps({"urls": urls})
+      }
+
+    elif action == "status":
+      parts = storage.list_parts(upload_file_path, uploadId)
+      return {
+        'statusCode': 200,
+        'body': json.dumps({"parts": [{"partNumber": part['partNumber'], "size": part['size']} for part in parts]})
+      }
+
+    elif action == "complete":
+      parts = storage.list_parts(upload_file_path, uploadId)
+      if len(parts) == 0:
+        raise Exception("no parts uploaded")
+      storage.complete_multipart(upload_file_path, uploadId)
+      print(f"assembled {upload_file_path} from {len(parts)} parts")
+
+      #the assembled csv is streamed to /tmp once, to be hashed and converted;
+      #new content is copied to its content key inside the storage, not uploaded again
+      storage.download_file(upload_file_path, local_file_path)
+      result = store_dataset(storage, local_file_path, modelFolder, dataset_filename, sha256, upload_file_path)
+      storage.delete([upload_file_path])
+      return {
+        'statusCode': 200,
+        'body': json.dumps(result)
+      }
+
+    elif action == "abort":
+      storage.abort_multipart(upload_file_path, uploadId)
+      return {
+        'statusCode': 200,
+        'body': "Aborted"
+      }
+
+    else:
+      raise Exception(f"unknown action '{action}'")
+
   # on an error, try to upload error message to S3:
   except Exception as err:
     print("**ERROR**")